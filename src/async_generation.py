@@ -0,0 +1,190 @@
+"""
+Concurrent LLM Generation with Per-Provider Rate Limiting
+
+Sends Google Gemini and OpenAI GPT requests for many documents, prompts and repeats
+at once using asyncio, instead of calling each provider in series and sleeping
+between repeats. Each provider gets its own requests-per-minute and
+tokens-per-minute budget (a sliding one-minute window) plus a cap on in-flight
+requests, so a run is limited by provider quota rather than round-trip latency. Completions
+already in the on-disk completion cache are returned without touching the network.
+
+Budgets default to conservative values and can be overridden in .env:
+OPENAI_RPM, OPENAI_TPM, OPENAI_MAX_CONCURRENCY, GOOGLE_RPM, GOOGLE_TPM,
+GOOGLE_MAX_CONCURRENCY.
+
+Calls go through the shared providers in llm_providers.py (pooled connections,
+timeouts, or the offline mock backend with LLM_BACKEND=mock). A provider is only
+created, and its SDK imported and authenticated, when a request to it misses the
+cache, so cached replays and single-provider runs never load the other.
+
+Transient failures (timeouts, 429, 5xx) are retried with backoff (see retry.py); a
+429 also pauses that provider's other requests for the same wait.
+
+With a batch directory set (see batch_mode.py), uncached requests are written to
+provider batch files instead and come back as BatchPending.
+"""
+
+import os
+import time
+import asyncio
+import logging
+from collections import deque, namedtuple
+from completion_cache import CacheMiss, cache_key, get_default_cache
+from llm_providers import get_provider, provider_cache_name
+from retry import acall_with_retry, status_code
+from batch_mode import get_batch_writer
+from profiling import get_profiler
+
+logger = logging.getLogger(__name__)
+
+GenerationRequest = namedtuple(
+    'GenerationRequest',
+    ['provider', 'model', 'prompt', 'system_prompt', 'max_tokens', 'temperature', 'repeat'],
+    defaults=(None, None, None, 0)
+)
+
+DEFAULT_LIMITS = {
+    'openai': {'rpm': 500, 'tpm': 200000, 'max_concurrency': 32},
+    'google': {'rpm': 60, 'tpm': 120000, 'max_concurrency': 16},
+}
+
+
+def provider_limits(provider):
+    defaults = DEFAULT_LIMITS[provider]
+    prefix = provider.upper()
+    return {
+        'rpm': int(os.getenv(f'{prefix}_RPM', defaults['rpm'])),
+        'tpm': int(os.getenv(f'{prefix}_TPM', defaults['tpm'])),
+        'max_concurrency': int(os.getenv(f'{prefix}_MAX_CONCURRENCY', defaults['max_concurrency'])),
+    }
+
+
+def estimate_tokens(request):
+    # Rough prompt size (~4 characters per token) plus the completion budget.
+    prompt_chars = len(request.prompt) + len(request.system_prompt or '')
+    return prompt_chars // 4 + (request.max_tokens or 1000)
+
+
+class RateLimiter:
+    """Sliding one-minute window over requests and tokens for a single provider."""
+
+    def __init__(self, rpm, tpm, max_concurrency):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.concurrency = asyncio.Semaphore(max_concurrency)
+        self._window = deque()
+        self._window_tokens = 0
+        self._resume_at = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds):
+        # After a 429 every in-flight request is likely to be throttled too, so hold new requests back as well
+        self._resume_at = max(self._resume_at, time.monotonic() + seconds)
+
+    async def acquire(self, tokens):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._resume_at:
+                    await asyncio.sleep(self._resume_at - now)
+                    continue
+                while self._window and now - self._window[0][0] >= 60:
+                    self._window_tokens -= self._window.popleft()[1]
+                within_rpm = len(self._window) < self.rpm
+                # A single request larger than the whole budget still goes through on an empty window.
+                within_tpm = self._window_tokens + tokens <= self.tpm or not self._window
+                if within_rpm and within_tpm:
+                    self._window.append((now, tokens))
+                    self._window_tokens += tokens
+                    return
+                await asyncio.sleep(60 - (now - self._window[0][0]))
+
+
+def request_cache_key(request):
+    return cache_key(provider_cache_name(request.provider), request.model, request.prompt, request.system_prompt,
+                     request.max_tokens, request.temperature, request.repeat)
+
+
+async def _generate(request, provider, limiter, cache):
+    async def attempt():
+        # The concurrency slot is released while a failed attempt backs off
+        queued = time.perf_counter()
+        async with limiter.concurrency:
+            await limiter.acquire(estimate_tokens(request))
+            get_profiler().record('queue_wait', time.perf_counter() - queued, provider.cache_name)
+            return await provider.acomplete(request)
+
+    def on_retry(error, delay):
+        if status_code(error) == 429:
+            limiter.pause(delay)
+
+    completion = await acall_with_retry(
+        attempt, description=f"{request.provider}/{request.model} call", provider=provider.cache_name, on_retry=on_retry)
+    cache.put(request_cache_key(request), completion,
+              provider=provider.cache_name, model=request.model, repeat=request.repeat)
+    return completion
+
+
+async def generate_all_async(requests, cache=None, max_concurrency=None):
+    cache = cache or get_default_cache()
+    results = [None] * len(requests)
+    pending = []
+    for index, request in enumerate(requests):
+        completion = cache.get(request_cache_key(request))
+        if completion is not None:
+            results[index] = completion
+        elif cache.offline:
+            results[index] = CacheMiss(
+                f"No cached {request.provider}/{request.model} completion for repeat {request.repeat}")
+        else:
+            pending.append(index)
+    batch = get_batch_writer()
+    if batch is not None:
+        # Batch mode: uncached requests go to the provider batch files instead of the network
+        for index in pending:
+            results[index] = batch.add(request_cache_key(requests[index]), requests[index])
+        logger.info(f"Queued {len(pending)} requests in batch files ({len(requests) - len(pending)} cached)")
+        return results
+    logger.info(f"Generating {len(pending)} completions ({len(requests) - len(pending)} cached)")
+
+    # Providers (and their connection pools) are opened here, before the request tasks are created,
+    # so every task sees the same session
+    providers, limiters, failed = {}, {}, {}
+    for name in sorted({requests[index].provider for index in pending}):
+        try:
+            providers[name] = get_provider(name)
+            await providers[name].open_async()
+        except Exception as e:
+            providers.pop(name, None)
+            failed[name] = e
+            continue
+        limits = provider_limits(name)
+        if max_concurrency is not None:
+            limits['max_concurrency'] = min(limits['max_concurrency'], max_concurrency)
+        limiters[name] = RateLimiter(**limits)
+    calls = [index for index in pending if requests[index].provider in providers]
+    try:
+        completions = await asyncio.gather(
+            *(_generate(requests[index], providers[requests[index].provider], limiters[requests[index].provider], cache)
+              for index in calls),
+            return_exceptions=True
+        )
+    finally:
+        for provider in providers.values():
+            await provider.close_async()
+    for index, completion in zip(calls, completions):
+        results[index] = completion
+    for index in pending:
+        if requests[index].provider in failed:
+            results[index] = failed[requests[index].provider]
+    return results
+
+
+def generate_all(requests, cache=None, max_concurrency=None):
+    """Run every request concurrently. Returns completions in request order; failures are returned as exceptions.
+
+    `max_concurrency` lowers each provider's in-flight cap for this batch.
+    """
+    if not requests:
+        return []
+    return asyncio.run(generate_all_async(list(requests), cache, max_concurrency))
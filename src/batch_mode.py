@@ -0,0 +1,274 @@
+"""
+Provider Batch-API Mode
+
+For bulk runs (thousands of documents), generation can go through the providers'
+batch APIs instead of live calls: cheaper per token and outside the live rate limits.
+The flow has three steps:
+
+1. Submit: run the experiment with a batch directory (run_benchmark.py --batch-dir,
+   or LLM_BATCH_DIR). Every request that is not already in the completion cache is
+   written to <batch-dir>/<provider>-<part>.jsonl in that provider's batch input
+   format instead of being sent, and nothing is scored. Each request's custom id
+   (OpenAI) or key (Gemini) is its completion cache key.
+2. Upload the files with the provider's batch tooling and download the result files
+   when the batches complete. Without network access, `simulate` produces a result
+   file locally from a batch file using the deterministic mock provider.
+3. Ingest the result files into the completion cache, then run the experiment again
+   without a batch directory: every completion is a cache hit (set
+   LLM_CACHE_OFFLINE=1 to be sure nothing is sent), so the usual metric and
+   aggregation code scores the batch output.
+
+Formats:
+- openai: {"custom_id", "method": "POST", "url": "/v1/chat/completions", "body"} lines in,
+  {"custom_id", "response": {"status_code", "body"}, "error"} lines out
+- google: {"key", "request": {"contents", "generation_config"}} lines in,
+  {"key", "response": {"candidates": ...}} or {"key", "error"} lines out
+
+Usage:
+    python src/batch_mode.py simulate outputs/batches/openai-000.jsonl outputs/batches/openai-000.results.jsonl
+    python src/batch_mode.py ingest outputs/batches/*.results.jsonl
+"""
+
+import os
+import json
+import glob
+import hashlib
+import logging
+import argparse
+
+logger = logging.getLogger(__name__)
+
+BATCH_PROVIDERS = ('openai', 'google')
+# OpenAI accepts at most 50,000 requests per batch file
+MAX_REQUESTS_PER_FILE = int(os.getenv('LLM_BATCH_MAX_REQUESTS', 50000))
+
+
+class BatchPending(Exception):
+    """Returned in place of a completion that was written to a batch file instead of being generated."""
+
+
+def openai_batch_line(key, request):
+    messages = []
+    if request.system_prompt:
+        messages.append({"role": "system", "content": request.system_prompt})
+    messages.append({"role": "user", "content": request.prompt})
+    body = {'model': request.model, 'messages': messages}
+    if request.max_tokens is not None:
+        body['max_tokens'] = request.max_tokens
+    if request.temperature is not None:
+        body['temperature'] = request.temperature
+    return {'custom_id': key, 'method': 'POST', 'url': '/v1/chat/completions', 'body': body}
+
+
+def google_batch_line(key, request):
+    # Same request GoogleProvider sends: the prompt as a single user turn plus the generation config
+    body = {'contents': [{'role': 'user', 'parts': [{'text': request.prompt}]}]}
+    generation_config = {}
+    if request.max_tokens is not None:
+        generation_config['max_output_tokens'] = request.max_tokens
+    if request.temperature is not None:
+        generation_config['temperature'] = request.temperature
+    if generation_config:
+        body['generation_config'] = generation_config
+    return {'key': key, 'model': request.model, 'request': body}
+
+
+BATCH_LINES = {'openai': openai_batch_line, 'google': google_batch_line}
+
+
+class BatchWriter:
+    """Appends requests to per-provider batch files in `directory`, once per cache key."""
+
+    def __init__(self, directory, max_requests=MAX_REQUESTS_PER_FILE):
+        self.directory = directory
+        self.max_requests = max_requests
+        self._keys = set()
+        self._files = {}
+        self._counts = {}
+        self._parts = {}
+        os.makedirs(directory, exist_ok=True)
+        for provider in BATCH_PROVIDERS:
+            # Requests written by an earlier (interrupted) submit run are not written again
+            paths = sorted(self._provider_paths(provider))
+            for path in paths:
+                with open(path, 'r', encoding='utf-8') as f:
+                    for line in f:
+                        self._keys.add(_line_key(json.loads(line)))
+            self._parts[provider] = max(len(paths) - 1, 0)
+            self._counts[provider] = _count_lines(paths[-1]) if paths else 0
+
+    def _provider_paths(self, provider):
+        return [path for path in glob.glob(os.path.join(self.directory, f"{provider}-*.jsonl"))
+                if not path.endswith('.results.jsonl')]
+
+    def path(self, provider, part):
+        return os.path.join(self.directory, f"{provider}-{part:03d}.jsonl")
+
+    def add(self, key, request):
+        """Write `request` (cached under `key`) to its provider's batch file; returns a BatchPending."""
+        if key not in self._keys:
+            provider = request.provider
+            if self._counts[provider] >= self.max_requests:
+                # The full file may be from an earlier run and not open in this one
+                handle = self._files.pop(provider, None)
+                if handle is not None:
+                    handle.close()
+                self._parts[provider] += 1
+                self._counts[provider] = 0
+            if provider not in self._files:
+                self._files[provider] = open(self.path(provider, self._parts[provider]), 'a', encoding='utf-8')
+            self._files[provider].write(json.dumps(BATCH_LINES[provider](key, request), ensure_ascii=False) + '\n')
+            self._files[provider].flush()
+            self._counts[provider] += 1
+            self._keys.add(key)
+        return BatchPending(f"{request.provider}/{request.model} repeat {request.repeat} queued in a batch file")
+
+    def __len__(self):
+        return len(self._keys)
+
+    def close(self):
+        for f in self._files.values():
+            f.close()
+        self._files = {}
+
+
+def _line_key(record):
+    return record.get('custom_id') or record.get('key')
+
+
+def _count_lines(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return sum(1 for _ in f)
+
+
+_batch_writer = None
+
+
+def get_batch_writer():
+    """The BatchWriter for LLM_BATCH_DIR, or None when generation is live."""
+    global _batch_writer
+    if _batch_writer is None and os.getenv('LLM_BATCH_DIR'):
+        _batch_writer = BatchWriter(os.getenv('LLM_BATCH_DIR'))
+        logger.info(f"Batch mode: requests are written to {_batch_writer.directory} instead of being sent")
+    return _batch_writer
+
+
+def enable_batch_mode(directory):
+    global _batch_writer
+    _batch_writer = BatchWriter(directory)
+    return _batch_writer
+
+
+# --- Results ---
+
+def parse_result_line(record):
+    """(cache key, provider, completion text or None, error message or None) from one result line."""
+    if 'custom_id' in record:
+        response = record.get('response') or {}
+        if record.get('error') or response.get('status_code', 200) != 200:
+            return record['custom_id'], 'openai', None, json.dumps(record.get('error') or response.get('body'))
+        return record['custom_id'], 'openai', response['body']['choices'][0]['message']['content'], None
+    if record.get('error'):
+        return record['key'], 'google', None, json.dumps(record['error'])
+    try:
+        parts = record['response']['candidates'][0]['content']['parts']
+    except (KeyError, IndexError, TypeError):
+        return record['key'], 'google', None, "response has no candidates"
+    return record['key'], 'google', ''.join(part.get('text', '') for part in parts), None
+
+
+def ingest(paths, cache=None):
+    """Store every successful completion in the result files `paths` in the completion cache.
+
+    Returns (stored, failed). Failed requests are not cached, so the next submit run writes them again.
+    """
+    from completion_cache import get_default_cache
+    cache = cache or get_default_cache()
+    stored = failed = 0
+    for path in paths:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line_number, line in enumerate(f, start=1):
+                if not line.strip():
+                    continue
+                key, provider, completion, error = parse_result_line(json.loads(line))
+                if completion is None:
+                    logger.warning(f"{path}:{line_number}: {provider} request {key} failed: {error}")
+                    failed += 1
+                    continue
+                cache.put(key, completion, provider=provider, source='batch')
+                stored += 1
+    logger.info(f"Ingested {stored} batch completions ({failed} failed) from {len(paths)} file(s)")
+    return stored, failed
+
+
+def _request_from_line(record):
+    from async_generation import GenerationRequest
+    # The cache key stands in for the repeat index so the mock still varies across repeats
+    if 'custom_id' in record:
+        body = record['body']
+        system = [m['content'] for m in body['messages'] if m['role'] == 'system']
+        prompt = next(m['content'] for m in body['messages'] if m['role'] == 'user')
+        return GenerationRequest('openai', body['model'], prompt, system[0] if system else None,
+                                 body.get('max_tokens'), body.get('temperature'), record['custom_id'])
+    body = record['request']
+    generation_config = body.get('generation_config', {})
+    return GenerationRequest('google', record.get('model'), body['contents'][0]['parts'][0]['text'], None,
+                             generation_config.get('max_output_tokens'), generation_config.get('temperature'),
+                             record['key'])
+
+
+def simulate(batch_path, result_path, failure_rate=0.0):
+    """Write the result file the provider would return for `batch_path`, generated locally by MockProvider.
+
+    A deterministic `failure_rate` fraction of requests comes back as errors, to exercise the failure path.
+    """
+    from llm_providers import MockProvider
+    providers = {name: MockProvider(name) for name in BATCH_PROVIDERS}
+    count = 0
+    with open(batch_path, 'r', encoding='utf-8') as f, open(result_path, 'w', encoding='utf-8') as out:
+        for line in f:
+            record = json.loads(line)
+            request = _request_from_line(record)
+            key = _line_key(record)
+            fails = int(hashlib.sha256(key.encode('utf-8')).hexdigest()[:8], 16) / 0xFFFFFFFF < failure_rate
+            if request.provider == 'openai':
+                if fails:
+                    result = {'custom_id': key, 'response': None,
+                              'error': {'code': 'server_error', 'message': 'Simulated failure'}}
+                else:
+                    result = {'custom_id': key, 'response': {'status_code': 200, 'body': {
+                        'model': request.model,
+                        'choices': [{'index': 0, 'message': {
+                            'role': 'assistant', 'content': providers['openai'].complete(request)}}],
+                    }}, 'error': None}
+            elif fails:
+                result = {'key': key, 'error': {'code': 500, 'message': 'Simulated failure'}}
+            else:
+                result = {'key': key, 'response': {'candidates': [{'content': {
+                    'role': 'model', 'parts': [{'text': providers['google'].complete(request)}]}}]}}
+            out.write(json.dumps(result, ensure_ascii=False) + '\n')
+            count += 1
+    logger.info(f"Simulated {count} batch results into {result_path}")
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulate or ingest provider batch results.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    simulate_parser = subparsers.add_parser('simulate', help="produce a result file locally from a batch file")
+    simulate_parser.add_argument('batch_file')
+    simulate_parser.add_argument('result_file')
+    simulate_parser.add_argument('--failure-rate', type=float, default=0.0)
+    ingest_parser = subparsers.add_parser('ingest', help="store result files in the completion cache")
+    ingest_parser.add_argument('result_files', nargs='+')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
+    if args.command == 'simulate':
+        simulate(args.batch_file, args.result_file, args.failure_rate)
+    else:
+        stored, failed = ingest(args.result_files)
+        print(f"Stored {stored} completions in the completion cache ({failed} failed requests to resubmit)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,289 @@
+"""
+Offline Evaluation Benchmark Suite
+
+Measures the throughput of the evaluation code itself, with no API calls, so a change
+to the scoring hot path can be checked for speed before a 1000-paper run. A fixed set
+of PLOS/eLife-shaped documents (generated from a seed, or the first N documents of a
+split with --data) is put through each stage of the real metric path:
+- readability: readability.readability, as every script's calculate_readability
+- rouge: RougeEngine.score of a candidate against the reference summary
+- bertscore: DeferredBertScore, queued and flushed in one batch
+- alignscore, summac: FactualityEngine, queued and flushed (SUMMAC_BIN_PATH for SummaC)
+- lexrank: the batched LexRank extractor behind extract_key_sentences
+- chunking: chunk_text, the tiktoken sentence chunker of the chunked pipeline
+
+Each stage runs in its own fresh process, so its peak RSS (resource.getrusage) is its
+own. It is run once untimed (model loading, word-level caches) and then --repeats
+times; per-text caches are cleared between repeats. Stages whose optional packages
+are not installed are reported as skipped. The report is stable, key-sorted JSON:
+documents/second (from the median repeat) and peak RSS per stage.
+
+Usage:
+    python src/benchmark_suite.py --documents 200 --output outputs/benchmark.json
+    python src/benchmark_suite.py --stages readability,rouge,lexrank --compare outputs/benchmark.json
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import platform
+import argparse
+import resource
+import statistics
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+SUITE_VERSION = 1
+STAGES = ('readability', 'rouge', 'bertscore', 'alignscore', 'summac', 'lexrank', 'chunking')
+CHUNK_TOKENS = 128
+
+_VOCABULARY = (
+    "cell cells protein proteins gene genes expression mutation mutant receptor signalling pathway tissue "
+    "mouse mice patients cohort infection virus bacteria immune response antibody neurons brain cortex "
+    "synaptic plasticity memory behaviour development embryo stem differentiation growth tumour cancer "
+    "metabolism mitochondria membrane transport channel calcium binding structure domain complex enzyme "
+    "activity regulation transcription factor chromatin DNA RNA sequencing genome population evolution "
+    "species selection fitness model analysis data results study trial treatment drug dose risk "
+    "significant increased reduced higher lower associated observed identified revealed suggest show "
+    "we our these this that which the of in and to a with for by on from as is are was were".split()
+)
+_LAY_VOCABULARY = (
+    "scientists researchers found people body disease healthy illness medicine help understand better "
+    "new way how why when important could might may because also show more less small large".split()
+)
+
+
+def _sentence(rng, vocabulary, low=12, high=28):
+    words = [rng.choice(vocabulary) for _ in range(rng.randint(low, high))]
+    return words[0].capitalize() + ' ' + ' '.join(words[1:]) + '.'
+
+
+def synthetic_documents(count, seed=0):
+    """`count` documents shaped like the PLOS/eLife splits (paragraph lists for abstract and summary)."""
+    rng = random.Random(seed)
+    documents = []
+    for index in range(count):
+        abstract = [' '.join(_sentence(rng, _VOCABULARY) for _ in range(rng.randint(8, 12)))]
+        summary = [' '.join(_sentence(rng, _VOCABULARY + _LAY_VOCABULARY) for _ in range(rng.randint(5, 8)))
+                   for _ in range(rng.randint(2, 3))]
+        documents.append({
+            'id': f"synthetic-{seed}-{index}",
+            'year': 2020,
+            'title': _sentence(rng, _VOCABULARY, 6, 12),
+            'abstract': abstract,
+            'summary': summary,
+            'keywords': sorted(set(rng.sample(_VOCABULARY[:60], 4))),
+        })
+    return documents
+
+
+def load_documents(args):
+    if args.data:
+        from dataset_reader import iter_documents
+        documents = list(iter_documents(args.data, num_documents=args.documents))
+    else:
+        documents = synthetic_documents(args.documents, args.seed)
+    return [_as_texts(document) for document in documents]
+
+
+def _as_texts(document):
+    abstract, summary = (
+        value if isinstance(value, str) else ' '.join(value)
+        for value in (document.get('abstract', ''), document.get('summary', ''))
+    )
+    # A stand-in generated summary: the abstract's leading sentences
+    candidate = ' '.join(abstract.split('. ')[:4])
+    return {'abstract': abstract, 'reference': summary, 'candidate': candidate}
+
+
+# --- Stages: each returns a callable that processes every document once ---
+
+def _readability_stage(documents):
+    import readability
+    def run():
+        readability.clear_cache()
+        for document in documents:
+            readability.readability(document['candidate'], readability.DEFAULT_METRICS)
+    return run
+
+
+def _rouge_stage(documents):
+    from rouge_engine import RougeEngine
+    def run():
+        scorer = RougeEngine(['rouge1', 'rouge2', 'rougeL'], use_stemmer=True)
+        for document in documents:
+            scorer.score(document['reference'], document['candidate'])
+    return run
+
+
+def _bertscore_stage(documents):
+    from bertscore_batch import DeferredBertScore
+    def run():
+        queue = DeferredBertScore(lang="en")
+        scores = [None] * len(documents)
+        for index, document in enumerate(documents):
+            queue.add(document['candidate'], document['reference'], scores, index)
+        queue.flush()
+    return run
+
+
+def _factuality_stage(metric):
+    def stage(documents):
+        from factuality_engine import FactualityEngine, HAS_FACTUALITY_MODELS
+        if not HAS_FACTUALITY_MODELS:
+            raise ImportError("alignscore and summac are not installed")
+        summac_start_file = os.getenv("SUMMAC_BIN_PATH", "summac_conv_vitc_sent_perc_e.bin")
+        def run():
+            engine = FactualityEngine(summac_start_file=summac_start_file, device='cpu', batch_size=16)
+            scores = [None] * len(documents)
+            for index, document in enumerate(documents):
+                engine.add(metric, document['abstract'], document['candidate'], scores, index)
+            engine.flush()
+        return run
+    return stage
+
+
+def _lexrank_stage(documents):
+    from lexrank import LexRankExtractor
+    def run():
+        LexRankExtractor().extract_batch([document['abstract'] for document in documents], 3)
+    return run
+
+
+def _chunking_stage(documents):
+    import chunking
+    def run():
+        for document in documents:
+            chunking.chunk_text(document['abstract'], CHUNK_TOKENS)
+    return run
+
+
+STAGE_BUILDERS = {
+    'readability': _readability_stage,
+    'rouge': _rouge_stage,
+    'bertscore': _bertscore_stage,
+    'alignscore': _factuality_stage('alignscore'),
+    'summac': _factuality_stage('summaC'),
+    'lexrank': _lexrank_stage,
+    'chunking': _chunking_stage,
+}
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def run_stage(stage, documents, repeats):
+    """Time one stage in the current process. Returns its report entry."""
+    try:
+        start = time.perf_counter()
+        run = STAGE_BUILDERS[stage](documents)
+        run()
+        setup_seconds = time.perf_counter() - start
+    except (ImportError, OSError, LookupError) as e:
+        # Optional package, model file or NLTK data not available here
+        message = str(e).strip().splitlines()
+        return {'status': 'skipped', 'reason': f"{type(e).__name__}: {message[0] if message else ''}"}
+    seconds = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        run()
+        seconds.append(time.perf_counter() - start)
+    median = statistics.median(seconds)
+    return {
+        'status': 'ok',
+        'documents': len(documents),
+        'setup_seconds': round(setup_seconds, 4),
+        'seconds': [round(value, 6) for value in seconds],
+        'median_seconds': round(median, 6),
+        'docs_per_second': round(len(documents) / median, 2) if median else None,
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+    }
+
+
+def run_suite(stages, documents, repeats, isolate=True):
+    results = {}
+    for stage in stages:
+        print(f"Benchmarking {stage} on {len(documents)} documents...", file=sys.stderr)
+        if isolate:
+            # A fresh process per stage, so each peak RSS belongs to that stage alone
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+                results[stage] = executor.submit(run_stage, stage, documents, repeats).result()
+        else:
+            results[stage] = run_stage(stage, documents, repeats)
+    return results
+
+
+def compare(report, baseline, tolerance):
+    """Stages whose throughput fell by more than `tolerance` against `baseline`, as printable lines."""
+    regressions = []
+    for stage, result in report['stages'].items():
+        before = baseline.get('stages', {}).get(stage, {})
+        if result.get('status') != 'ok' or before.get('status') != 'ok':
+            continue
+        ratio = result['docs_per_second'] / before['docs_per_second']
+        line = f"{stage}: {before['docs_per_second']:.1f} -> {result['docs_per_second']:.1f} docs/s ({ratio:.2f}x)"
+        print(line, file=sys.stderr)
+        if ratio < 1 - tolerance:
+            regressions.append(line)
+    return regressions
+
+
+def stage_list(value):
+    stages = tuple(stage.strip() for stage in value.split(',') if stage.strip())
+    unknown = [stage for stage in stages if stage not in STAGES]
+    if unknown or not stages:
+        raise argparse.ArgumentTypeError(f"choose from {', '.join(STAGES)}")
+    return stages
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the evaluation pipeline offline.")
+    parser.add_argument('--documents', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--data', default=None, help="use the first --documents documents of this split instead")
+    parser.add_argument('--stages', type=stage_list, default=STAGES, help="comma-separated, default: all")
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--no-isolate', dest='isolate', action='store_false',
+                        help="run every stage in this process (peak RSS is then cumulative)")
+    parser.add_argument('--output', default=None, help="write the JSON report here (default: stdout)")
+    parser.add_argument('--compare', default=None, help="baseline report; exit 1 if a stage is slower")
+    parser.add_argument('--tolerance', type=float, default=0.10, help="allowed throughput drop (default 10%%)")
+    args = parser.parse_args(argv)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+    documents = load_documents(args)
+    report = {
+        'suite_version': SUITE_VERSION,
+        'documents': len(documents),
+        'source': args.data or f"synthetic(seed={args.seed})",
+        'repeats': args.repeats,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'stages': run_suite(args.stages, documents, args.repeats, args.isolate),
+    }
+    text = json.dumps(report, indent=1, sort_keys=True)
+    if args.output:
+        directory = os.path.dirname(args.output)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    if baseline is not None:
+        regressions = compare(report, baseline, args.tolerance)
+        if regressions:
+            print("Throughput regressions:\n" + '\n'.join(regressions), file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
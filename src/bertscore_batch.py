@@ -0,0 +1,66 @@
+"""
+Deferred BERTScore Evaluation
+
+Collects (candidate, reference) pairs over a whole benchmark run and scores them in
+large padded batches with one resident BERTScore model, instead of calling
+bert_score() once per summary (which re-tokenises, runs a single-item forward pass
+and may reload the scoring model every time).
+
+Each queued pair carries a target container and key, so once the queue is flushed
+the F1 value lands back in the same prompt/model/metric bucket the per-summary call
+used to fill.
+"""
+
+import logging
+from profiling import get_profiler
+
+logger = logging.getLogger(__name__)
+
+# One scorer per (lang, device) per process; BERTScorer keeps the model resident.
+_scorers = {}
+
+
+def get_bert_scorer(lang="en", device=None, batch_size=64):
+    key = (lang, device)
+    if key not in _scorers:
+        # Imported on first use: bert_score pulls in torch and transformers.
+        from bert_score import BERTScorer
+        logger.info(f"Loading BERTScore model (lang={lang}, device={device or 'auto'})")
+        _scorers[key] = BERTScorer(lang=lang, device=device, batch_size=batch_size)
+    return _scorers[key]
+
+
+class DeferredBertScore:
+    """Queue of (candidate, reference) pairs scored together on flush()."""
+
+    def __init__(self, lang="en", device=None, batch_size=64):
+        self.lang = lang
+        self.device = device
+        self.batch_size = batch_size
+        self._candidates = []
+        self._references = []
+        self._targets = []
+
+    def __len__(self):
+        return len(self._candidates)
+
+    def add(self, candidate, reference, target, key):
+        """Queue one pair; its F1 is written to target[key] when the queue is flushed."""
+        self._candidates.append(candidate)
+        self._references.append(reference)
+        self._targets.append((target, key))
+
+    def flush(self):
+        """Score all queued pairs and write each F1 back to its target. Returns the F1 list."""
+        if not self._candidates:
+            return []
+        logger.info(f"Scoring {len(self._candidates)} summaries with BERTScore")
+        scorer = get_bert_scorer(self.lang, self.device, self.batch_size)
+        # BERTScorer sorts by length and deduplicates internally, so batches are tightly padded.
+        with get_profiler().stage('bertscore', items=len(self._candidates)):
+            _, _, F = scorer.score(self._candidates, self._references, batch_size=self.batch_size)
+        scores = F.tolist()
+        for (target, key), value in zip(self._targets, scores):
+            target[key] = value
+        self._candidates, self._references, self._targets = [], [], []
+        return scores
@@ -0,0 +1,75 @@
+"""
+Benchmark Run Checkpointing
+
+Appends each scored (document, prompt, model, repeat) result to a JSON Lines file as
+soon as it is complete, flushing and fsync-ing every line, so a crash late in a long
+run loses at most the results that were still being scored. A restarted run loads
+the file, skips work that is already recorded and rebuilds its aggregates from the
+stored metrics.
+
+Failed repeats are not recorded, so a restart retries them; a recorded result with a
+missing (NaN) metric counts as not recorded. Delete the checkpoint
+file (or point the run at a new one) to start an experiment from scratch.
+"""
+
+import os
+import json
+import math
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class RunCheckpoint:
+    def __init__(self, path):
+        self.path = path
+        self._results = {}
+        if os.path.isfile(path):
+            self._load()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(path, 'a', encoding='utf-8')
+
+    @staticmethod
+    def _key(document, prompt, model, repeat):
+        return (str(document), str(prompt), model, int(repeat))
+
+    def _load(self):
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line_number, line in enumerate(f, start=1):
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # A crash mid-write can leave a truncated final line; everything before it is intact.
+                    logger.warning(f"Ignoring unreadable checkpoint line {line_number} in {self.path}")
+                    continue
+                key = self._key(record['document'], record['prompt'], record['model'], record['repeat'])
+                self._results[key] = record['metrics']
+        logger.info(f"Resuming from {self.path}: {len(self._results)} results already recorded")
+
+    def __len__(self):
+        return len(self._results)
+
+    def get(self, document, prompt, model, repeat):
+        return self._results.get(self._key(document, prompt, model, repeat))
+
+    def has_all(self, document, prompt, models, repeat, metrics=()):
+        """True when every model's result for this repeat is recorded with a finite value for each of `metrics`."""
+        for model in models:
+            recorded = self.get(document, prompt, model, repeat)
+            if recorded is None or any(not math.isfinite(recorded.get(metric, math.nan)) for metric in metrics):
+                return False
+        return True
+
+    def record(self, document, prompt, model, repeat, metrics):
+        metrics = {name: float(value) for name, value in metrics.items()}
+        self._results[self._key(document, prompt, model, repeat)] = metrics
+        self._file.write(json.dumps({
+            'document': document, 'prompt': prompt, 'model': model, 'repeat': repeat, 'metrics': metrics
+        }) + '\n')
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
@@ -0,0 +1,89 @@
+"""
+Token-Aware Text Chunking
+
+Splits long text into chunks that fit a model's prompt budget, for the chunked
+extractive/abstractive pipeline. Compared with slicing the token list every
+max_tokens tokens:
+- Encoders are built once per model (tiktoken.encoding_for_model is slow to call
+  repeatedly), and token counts of repeated prompt fragments are memoised.
+- Chunks are packed greedily from whole sentences, so no chunk starts or ends
+  mid-sentence and each chunk is filled as close to the budget as possible. A single
+  sentence longer than the budget is the only thing ever cut at a token boundary.
+- Each chunk comes back with its token count, so callers never re-encode a chunk
+  to measure it.
+
+Text that fits the budget is returned unchanged as a single chunk. Otherwise sentences
+are re-joined with single spaces; tiktoken's pre-tokeniser never merges across that
+space, so a chunk's token count is the sum of its sentences' counts and no chunk is
+encoded twice.
+"""
+
+import re
+from collections import namedtuple
+from functools import lru_cache
+from profiling import get_profiler
+
+Chunk = namedtuple('Chunk', ['text', 'tokens'])
+
+# Sentence end: terminal punctuation, optionally closed by a quote or bracket, then whitespace and
+# a capitalised word (so "Fig. 2" or "p < 0.05" do not end a sentence)
+_SENTENCE_END = re.compile(r'(?:(?<=[.!?])|(?<=[.!?]["\')\]]))\s+(?=["\'(\[]?[A-Z])')
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model):
+    # tiktoken is only imported by runs that chunk text
+    import tiktoken
+    return tiktoken.encoding_for_model(model)
+
+
+@lru_cache(maxsize=1024)
+def count_tokens(text, model="gpt-4o-mini"):
+    """Token count of `text`; memoised, since prompt templates and few-shot examples repeat on every call."""
+    return len(get_encoding(model).encode(text))
+
+
+def split_sentences(text):
+    return [sentence for sentence in (part.strip() for part in _SENTENCE_END.split(text)) if sentence]
+
+
+def _split_long_sentence(tokens, encoding, max_tokens):
+    for start in range(0, len(tokens), max_tokens):
+        piece = tokens[start:start + max_tokens]
+        yield Chunk(encoding.decode(piece), len(piece))
+
+
+def chunk_text(text, max_tokens, model="gpt-4o-mini"):
+    """Pack whole sentences of `text` into chunks of at most `max_tokens` tokens. Returns a list of Chunk(text, tokens)."""
+    with get_profiler().stage('chunking'):
+        return _chunk_text(text, max_tokens, model)
+
+
+def _chunk_text(text, max_tokens, model):
+    if max_tokens <= 0:
+        raise ValueError(f"max_tokens must be positive, got {max_tokens}")
+    encoding = get_encoding(model)
+    total_tokens = len(encoding.encode(text))
+    if total_tokens <= max_tokens:
+        # Text that already fits is passed through unchanged, whitespace included
+        return [Chunk(text, total_tokens)] if total_tokens else []
+    chunks = []
+    sentences, size = [], 0
+    for sentence in split_sentences(text):
+        # Sentences are re-joined with a single space, which is counted with the sentence that follows it
+        sentence_tokens = len(encoding.encode((' ' if sentences else '') + sentence))
+        if sentences and size + sentence_tokens <= max_tokens:
+            sentences.append(sentence)
+            size += sentence_tokens
+            continue
+        if sentences:
+            chunks.append(Chunk(' '.join(sentences), size))
+            sentence_tokens = len(encoding.encode(sentence))
+        if sentence_tokens > max_tokens:
+            chunks.extend(_split_long_sentence(encoding.encode(sentence), encoding, max_tokens))
+            sentences, size = [], 0
+        else:
+            sentences, size = [sentence], sentence_tokens
+    if sentences:
+        chunks.append(Chunk(' '.join(sentences), size))
+    return chunks
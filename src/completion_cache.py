@@ -0,0 +1,102 @@
+"""
+Content-Addressed LLM Completion Cache
+
+Stores every generated completion on disk under a SHA-256 of the provider, model
+name, full prompt (including any system prompt), generation config and repeat index,
+so re-running a benchmark after a metric change replays summaries instead of
+regenerating them. The repeat index is part of the key so repeats stay distinct.
+
+Settings (in .env or the environment):
+- LLM_CACHE_DIR: cache location (default outputs/llm_cache).
+- LLM_CACHE_OFFLINE=1: replay a run from the cache only; a miss raises CacheMiss
+  instead of calling the provider, so no network access is needed.
+- LLM_CACHE_DISABLED=1: always call the provider and do not write the cache.
+"""
+
+import os
+import json
+import time
+import hashlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class CacheMiss(Exception):
+    """Raised in offline mode when a completion is not in the cache."""
+
+
+def cache_key(provider, model, prompt, system_prompt=None, max_tokens=None, temperature=None, repeat=0):
+    payload = json.dumps({
+        'provider': provider,
+        'model': model,
+        'prompt': prompt,
+        'system_prompt': system_prompt,
+        'max_tokens': max_tokens,
+        'temperature': temperature,
+        'repeat': repeat,
+    }, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class CompletionCache:
+    def __init__(self, cache_dir, offline=False, enabled=True):
+        self.cache_dir = cache_dir
+        self.offline = offline
+        self.enabled = enabled or offline
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+        try:
+            with open(self._path(key), 'r', encoding='utf-8') as f:
+                completion = json.load(f)['completion']
+        except (FileNotFoundError, json.JSONDecodeError, KeyError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return completion
+
+    def put(self, key, completion, **metadata):
+        if not self.enabled:
+            return
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        record = dict(metadata, completion=completion, created=time.time())
+        # Write then rename so a crash never leaves a half-written entry behind.
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(record, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def get_or_call(self, key, call, **metadata):
+        """Return the cached completion for `key`, calling `call()` and caching the result on a miss."""
+        completion = self.get(key)
+        if completion is not None:
+            return completion
+        if self.offline:
+            raise CacheMiss(f"No cached completion for {metadata or key} (offline replay)")
+        completion = call()
+        self.put(key, completion, **metadata)
+        return completion
+
+
+_default_cache = None
+
+
+def get_default_cache():
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = CompletionCache(
+            os.getenv('LLM_CACHE_DIR', os.path.join('outputs', 'llm_cache')),
+            offline=os.getenv('LLM_CACHE_OFFLINE') == '1',
+            enabled=os.getenv('LLM_CACHE_DISABLED') != '1',
+        )
+        if _default_cache.offline:
+            logger.info(f"Replaying completions from {_default_cache.cache_dir} (offline mode)")
+    return _default_cache
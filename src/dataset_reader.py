@@ -0,0 +1,81 @@
+"""
+Streaming PLOS/eLife Dataset Reader
+
+Yields documents one at a time from a PLOS/eLife split instead of json.load()-ing the
+whole file, and projects each record down to the fields the benchmarks actually use
+(the full-text `sections` and `headings` arrays are dropped as soon as a record is
+parsed). Reading stops once `num_documents` records have been yielded, so memory
+stays flat whatever the file size and the first document is available immediately.
+
+Accepts the JSON-array splits described in dataSets/*/README.md, JSON Lines files
+with one record per line, and preprocessed .bmds stores (see dataset_store.py), which
+are read memory-mapped and seek straight to `start`.
+
+For sharded runs, `shard_index`/`shard_count` stripe the selected document range
+(`start` to `start + num_documents`) across shards: shard i of n reads documents
+i, i + n, i + 2n, ... of that range, so shards are disjoint and cover it exactly.
+"""
+
+import json
+from dataset_store import STORE_EXTENSION, DocumentStore
+
+DOCUMENT_FIELDS = ('id', 'year', 'title', 'abstract', 'summary', 'keywords')
+CHUNK_SIZE = 1 << 20
+
+_decoder = json.JSONDecoder()
+
+
+def _skip_separators(buffer, position):
+    # Whitespace, commas and the opening bracket of a JSON array sit between records.
+    while position < len(buffer) and (buffer[position].isspace() or buffer[position] in ',['):
+        position += 1
+    return position
+
+
+def _iter_records(f):
+    buffer, position, eof = '', 0, False
+    read_size = CHUNK_SIZE
+    while True:
+        position = _skip_separators(buffer, position)
+        if position == len(buffer):
+            if eof:
+                return
+            buffer, position = f.read(CHUNK_SIZE), 0
+            eof = not buffer
+            continue
+        if buffer[position] == ']':
+            return
+        try:
+            record, end = _decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            # The record runs past the end of the buffer; read more and try again.
+            if eof:
+                raise
+            more = f.read(read_size)
+            eof = not more
+            buffer, position = buffer[position:] + more, 0
+            read_size *= 2
+            continue
+        read_size = CHUNK_SIZE
+        yield record
+        position = end
+
+
+def iter_documents(path, num_documents=None, fields=DOCUMENT_FIELDS, start=0, shard_index=0, shard_count=1):
+    """Yield this shard's records among documents `start` to `start + num_documents` of `path`, with only `fields` kept."""
+    if not 0 <= shard_index < shard_count:
+        raise ValueError(f"shard_index must be in [0, {shard_count}), got {shard_index}")
+    if num_documents is not None and num_documents <= 0:
+        return
+    stop = None if num_documents is None else start + num_documents
+    if path.endswith(STORE_EXTENSION):
+        with DocumentStore(path) as store:
+            for record in store.iter(start + shard_index, stop, shard_count):
+                yield {field: record[field] for field in fields if field in record} if fields else record
+        return
+    with open(path, 'r', encoding='utf-8') as f:
+        for index, record in enumerate(_iter_records(f)):
+            if index >= start and (index - start) % shard_count == shard_index:
+                yield {field: record[field] for field in fields if field in record} if fields else record
+            if stop is not None and index + 1 >= stop:
+                return
@@ -0,0 +1,131 @@
+"""
+Preprocessed PLOS/eLife Dataset Store
+
+One-time conversion of a PLOS/eLife JSON split into a compact binary store, so runs
+stop re-parsing the raw JSON (and its full-text sections) for every document.
+
+Each record holds the id, year and title, and the abstract, summary and keywords as
+flat lists of strings, exactly as the JSON split has them. The paragraphs are kept
+rather than pre-joined, so every script's own joining (concatenate_items,
+ensure_string, or the first paragraph only with get_first_item) gives the same text
+for a store as for the JSON split. A per-document offset index at the
+end of the file lets benchmarks open the store memory-mapped and seek straight to
+document N, which makes sharding, resuming and sampling subsets cheap.
+
+File layout (little-endian):
+    MAGIC | record 0 | record 1 | ... | offset index (uint64 per record) | count (uint64) | index offset (uint64)
+where each record is a uint32 byte length followed by a UTF-8 JSON object.
+
+Usage:
+    python src/dataset_store.py data/plos_val.json data/plos_val.bmds
+
+Any script that reads through dataset_reader.iter_documents accepts a .bmds path in
+place of the JSON split.
+"""
+
+import os
+import sys
+import json
+import mmap
+import struct
+import argparse
+from array import array
+
+# Version 2: paragraph lists; version 1 stores (pre-joined strings) must be converted again
+MAGIC = b'BMDS\x00\x02\x00\x00'
+STORE_EXTENSION = '.bmds'
+_LENGTH = struct.Struct('<I')
+_TRAILER = struct.Struct('<QQ')
+
+
+def _flatten(value):
+    if isinstance(value, list):
+        return [item for element in value for item in _flatten(element)]
+    if value is None or value == '':
+        return []
+    return [value]
+
+
+def normalise_document(record):
+    return {
+        'id': record.get('id', ''),
+        'year': record.get('year', ''),
+        'title': record.get('title', ''),
+        'abstract': [str(part) for part in _flatten(record.get('abstract', ''))],
+        'summary': [str(part) for part in _flatten(record.get('summary', ''))],
+        'keywords': [str(keyword) for keyword in _flatten(record.get('keywords', []))],
+    }
+
+
+def convert_split(json_path, store_path):
+    """Convert a JSON split into a store at `store_path`. Returns the number of documents written."""
+    from dataset_reader import iter_documents
+
+    offsets = array('Q')
+    tmp_path = f"{store_path}.tmp"
+    with open(tmp_path, 'wb') as out:
+        out.write(MAGIC)
+        for record in iter_documents(json_path):
+            payload = json.dumps(normalise_document(record), ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+            offsets.append(out.tell())
+            out.write(_LENGTH.pack(len(payload)))
+            out.write(payload)
+        index_offset = out.tell()
+        if sys.byteorder == 'big':
+            offsets.byteswap()
+        out.write(offsets.tobytes())
+        out.write(_TRAILER.pack(len(offsets), index_offset))
+    os.replace(tmp_path, store_path)
+    return len(offsets)
+
+
+class DocumentStore:
+    """Memory-mapped, random-access view of a converted split."""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        header = self._map[:len(MAGIC)]
+        if header != MAGIC:
+            self.close()
+            if header[:4] == MAGIC[:4]:
+                raise ValueError(f"{path} was written by an older dataset_store; convert the split again")
+            raise ValueError(f"{path} is not a dataset store (expected {STORE_EXTENSION} written by convert_split)")
+        count, index_offset = _TRAILER.unpack_from(self._map, len(self._map) - _TRAILER.size)
+        self._offsets = array('Q', self._map[index_offset:index_offset + 8 * count])
+        if sys.byteorder == 'big':
+            self._offsets.byteswap()
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def __getitem__(self, index):
+        offset = self._offsets[index]
+        (length,) = _LENGTH.unpack_from(self._map, offset)
+        start = offset + _LENGTH.size
+        return json.loads(self._map[start:start + length].decode('utf-8'))
+
+    def iter(self, start=0, stop=None, step=1):
+        for index in range(start, len(self) if stop is None else min(stop, len(self)), step):
+            yield self[index]
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert a PLOS/eLife JSON split into a dataset store.")
+    parser.add_argument('json_path')
+    parser.add_argument('store_path', nargs='?')
+    args = parser.parse_args()
+    store_path = args.store_path or os.path.splitext(args.json_path)[0] + STORE_EXTENSION
+    count = convert_split(args.json_path, store_path)
+    print(f"Wrote {count} documents to {store_path}")
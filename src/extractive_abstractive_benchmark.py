@@ -8,7 +8,9 @@ and OpenAI GPT models. It measures summary quality with multiple metrics (ROUGE,
 readability, AlignScore, SummaC), supporting reproducible and comparative experiments.
 
 Features:
-- Extracts key sentences from abstracts with LexRank.
+- Extracts key sentences from abstracts with LexRank, once per document and for all documents in
+  one batch (see lexrank.py); extracts are stored in EXTRACTS_PATH so reruns and shards over the
+  same documents skip LexRank.
 - Generates plain-language summaries with different prompt styles.
 - Evaluates summaries against human references using ROUGE, BERTScore, readability, AlignScore, SummaC.
 - Logs results and aggregates per-prompt metrics for direct comparison.
@@ -25,23 +27,22 @@ This script is not meant for production use but is provided for reproducibility,
 import os
 import csv
 import logging
-import time
-import json
-import numpy as np
+from itertools import islice
 from dotenv import load_dotenv
 
-import openai
-import google.generativeai as genai
-from rouge_score import rouge_scorer
-from bert_score import score as bert_score
-import textstat
-from alignscore import AlignScore
-from summac.model_summac import SummaCConv
-from sumy.parsers.plaintext import PlaintextParser
-from sumy.nlp.tokenizers import Tokenizer
-from sumy.summarizers.lex_rank import LexRankSummarizer
+from rouge_engine import RougeEngine
+from bertscore_batch import DeferredBertScore
+from readability import readability
+from factuality_engine import FactualityEngine
+from async_generation import GenerationRequest, generate_all
+from dataset_reader import iter_documents
+from extract_store import ExtractStore
+from lexrank import get_extractor
+from batch_mode import BatchPending
+from prompt_templates import get_templates, render_prompts
+from metric_accumulator import MetricAccumulator
 
-# Setup logger early!
+# Log handlers are attached when the script is run directly
 def setup_logger(log_file_path):
     logger = logging.getLogger(__name__)
     logger.setLevel(logging.INFO)
@@ -60,31 +61,17 @@ SUMMAC_BIN_PATH = os.getenv("SUMMAC_BIN_PATH", "summac_conv_vitc_sent_perc_e.bin
 DATA_PATH = os.getenv("DATA_PATH", "data/val.json")
 CSV_FILE_PATH = os.getenv("CSV_FILE_PATH", "outputs/results_PLOS_XEROSHOT.csv")
 LOG_FILE_PATH = os.getenv("LOG_FILE_PATH", "outputs/prompt_output.log")
+EXTRACTS_PATH = os.getenv("EXTRACTS_PATH", "outputs/lexrank_extracts.jsonl")
 
-logger = setup_logger(LOG_FILE_PATH)
+logger = logging.getLogger(__name__)
 
-# API keys
-google_api_key = os.getenv('API_KEY')
-openai_api_key = os.getenv('OPENAI_API_KEY')
-
-genai.configure(api_key=google_api_key)
+# API keys (API_KEY, OPENAI_API_KEY) are read by llm_providers when a provider is first called
 google_model_name = os.getenv("GOOGLE_MODEL_NAME", "models/text-bison-001")
-openai.api_key = openai_api_key
 
-rouge_scorer_instance = rouge_scorer.RougeScorer(['rouge1', 'rouge2', 'rougeL'], use_stemmer=True)
+MODEL_NAMES = ['Google Gemini', 'OpenAI GPT']
+METRIC_NAMES = ['rouge1', 'rouge2', 'rougeL', 'bertscore', 'fkgl', 'dcrs', 'cli', 'alignscore', 'summaC']
 
-summac_model = SummaCConv(
-    models=["vitc"],
-    bins='percentile',
-    granularity="sentence",
-    nli_labels="e",
-    device="cpu",
-    start_file=SUMMAC_BIN_PATH,
-    agg="mean"
-)
-alignscore_model = AlignScore(
-    model='roberta-base', batch_size=16, device='cpu', ckpt_path=None, evaluation_mode='nli_sp'
-)
+rouge_scorer_instance = RougeEngine(['rouge1', 'rouge2', 'rougeL'], use_stemmer=True)
 
 def concatenate_items(value, default=''):
     if isinstance(value, list):
@@ -96,36 +83,32 @@ def concatenate_items(value, default=''):
 
 def extract_key_sentences(abstract_text, num_sentences=3):
     try:
-        parser = PlaintextParser.from_string(abstract_text, Tokenizer('english'))
-        summarizer = LexRankSummarizer()
-        summary = summarizer(parser.document, num_sentences)
-        extracted_sentences = ' '.join(str(sentence) for sentence in summary)
-        return extracted_sentences
+        return get_extractor('english').extract(abstract_text, num_sentences)
     except Exception as e:
         logger.error(f"Error in extract_key_sentences: {e}")
         print(f"Error in extract_key_sentences: {e}")
         return abstract_text
 
+# Ranks all abstracts in one LexRank batch; if the batch fails, each abstract is retried on its own
+def extract_key_sentences_batch(abstract_texts, num_sentences=3):
+    try:
+        return get_extractor('english').extract_batch(abstract_texts, num_sentences)
+    except Exception as e:
+        logger.error(f"Error in batched extract_key_sentences, extracting one abstract at a time: {e}")
+        return [extract_key_sentences(abstract_text, num_sentences) for abstract_text in abstract_texts]
+
 def create_prompts(document, extracted_sentences):
-    title = document.get('title', 'No title available')
-    year = document.get('year', 'No year available')
-    prompt_intro_1 = (
-        "Compose a detailed Plain-Language Summary (PLS) of the following key sentences extracted from a biomedical research paper to promote Knowledge Translation (KT) and make the findings accessible to a non-expert audience.\n\n"
-    )
-    prompt_intro_2 = (
-        "Create an informative and accessible Plain-Language Summary (PLS) for the following key sentences extracted from a biomedical research paper, aimed at enhancing Knowledge Translation (KT) and making the content understandable to individuals without a scientific background.\n\n"
-    )
-    full_prompts = [
-        prompt_intro_1 + f"**Title**: \"{title}\"\n" + f"**Year**: {year}\n\n" + f"**Key Sentences**:\n{extracted_sentences}\n\n",
-        prompt_intro_2 + f"**Title**: \"{title}\"\n" + f"**Year**: {year}\n\n" + f"**Key Sentences**:\n{extracted_sentences}\n\n"
-    ]
-    return full_prompts
+    # Templates of the 'lexrank' set: instruction prefix first, this paper's key sentences last
+    return render_prompts(get_templates('lexrank'), {
+        'title': document.get('title', 'No title available'),
+        'year': document.get('year', 'No year available'),
+        'key_sentences': extracted_sentences,
+    })
 
 def calculate_readability(summary):
-    fkgl = textstat.flesch_kincaid_grade(summary)
-    dcrs = textstat.dale_chall_readability_score(summary)
-    cli = textstat.coleman_liau_index(summary)
-    return fkgl, dcrs, cli
+    # One shared analysis of the text for all three formulas
+    scores = readability(summary, ('fkgl', 'dcrs', 'cli'))
+    return scores['fkgl'], scores['dcrs'], scores['cli']
 
 def write_per_prompt_csv(per_prompt_metrics, file_path):
     os.makedirs(os.path.dirname(file_path), exist_ok=True)
@@ -178,21 +161,54 @@ def write_per_prompt_csv(per_prompt_metrics, file_path):
                 }
                 writer.writerow(row)
 
-def process_and_evaluate(data, num_repeats=3, num_documents=None):
+def process_and_evaluate(data, num_repeats=3, num_documents=None, extracts_path=EXTRACTS_PATH):
     per_prompt_metrics = {}
-    if num_documents is not None:
-        data = data[:num_documents]
+    accumulator = MetricAccumulator(METRIC_NAMES)
+    bertscore_queue = DeferredBertScore(lang="en", device='cpu')
+    factuality = FactualityEngine(summac_start_file=SUMMAC_BIN_PATH, device='cpu', batch_size=16)
+    # Accepts a list or a streaming reader; only the first num_documents records are read
+    data = list(islice(data, num_documents))
+    documents = []
     for test_num, document in enumerate(data):
         abstract_text = concatenate_items(document.get("abstract", ""))
         if not abstract_text:
             logger.warning(f"Skipping document {test_num + 1} due to empty abstract.")
             continue
-        extracted_sentences = extract_key_sentences(abstract_text, num_sentences=3)
-        prompts = create_prompts(document, extracted_sentences)
         reference_summary = concatenate_items(document.get("summary", ""))
         if not reference_summary:
             logger.warning(f"Skipping document {test_num + 1} due to empty reference summary.")
             continue
+        documents.append((test_num, document, abstract_text, reference_summary))
+
+    # LexRank is deterministic, so one extract per document serves every prompt and repeat;
+    # abstracts without a stored extract are ranked together in one batch
+    extracts = ExtractStore(extracts_path, reuse='document')
+    missing = list(dict.fromkeys(
+        abstract_text for _, _, abstract_text, _ in documents if extracts.get('lexrank-3', abstract_text, 0) is None))
+    batch_extracts = dict(zip(missing, extract_key_sentences_batch(missing, num_sentences=3)))
+    prepared = []
+    for test_num, document, abstract_text, reference_summary in documents:
+        extracted_sentences = extracts.get_or_extract(
+            'lexrank-3', abstract_text, 0, lambda extract_repeat: batch_extracts[abstract_text])
+        prompts = create_prompts(document, extracted_sentences)
+        prepared.append((test_num, abstract_text, reference_summary, prompts))
+    extracts.close()
+
+    # Send every document, prompt and repeat concurrently, within provider quotas
+    requests = []
+    for _, _, _, prompts in prepared:
+        for full_prompt in prompts:
+            for repeat in range(num_repeats):
+                requests.append(GenerationRequest(
+                    'google', google_model_name, full_prompt, max_tokens=1024, temperature=0.3, repeat=repeat))
+                requests.append(GenerationRequest(
+                    'openai', 'gpt-4o-mini', full_prompt,
+                    system_prompt="You are a helpful assistant.", max_tokens=1000, temperature=0.3, repeat=repeat))
+    completions = iter(generate_all(requests))
+    # Repeats whose completions went to provider batch files (batch mode); scored by a later run
+    batch_queued = 0
+
+    for test_num, abstract_text, reference_summary, prompts in prepared:
         logger.info(f"Processing document {test_num + 1}")
         logger.info(f"Reference Summary: {reference_summary}")
         for prompt_num, full_prompt in enumerate(prompts, start=1):
@@ -202,98 +218,62 @@ def process_and_evaluate(data, num_repeats=3, num_documents=None):
                     'prompt_text': full_prompt,
                     'papers_tested': 0,
                     'repeats': num_repeats,
-                    'models': {
-                        'Google Gemini': { 'metrics': {k: [] for k in [
-                            'rouge1','rouge2','rougeL','bertscore','fkgl','dcrs','cli','alignscore','summaC']}},
-                        'OpenAI GPT': { 'metrics': {k: [] for k in [
-                            'rouge1','rouge2','rougeL','bertscore','fkgl','dcrs','cli','alignscore','summaC']}},
-                    }
+                    'models': {model_name: {} for model_name in MODEL_NAMES}
                 }
             per_prompt_metrics[prompt_num]['papers_tested'] += 1
             for repeat in range(num_repeats):
+                summaryGoogle, summaryOpenAI = next(completions), next(completions)
+                if isinstance(summaryGoogle, BatchPending) or isinstance(summaryOpenAI, BatchPending):
+                    batch_queued += 1
+                    continue
                 try:
-                    responseGoogle = genai.GenerativeModel(google_model_name).generate_content(
-                        full_prompt,
-                        generation_config={"max_output_tokens": 1024, "temperature": 0.3}
-                    )
-                    summaryGoogle = responseGoogle.text
+                    for summary in (summaryGoogle, summaryOpenAI):
+                        if isinstance(summary, Exception):
+                            raise summary
                     logger.info(f"Google Gemini summary {repeat + 1}: {summaryGoogle}")
-                    responseOpenAI = openai.ChatCompletion.create(
-                        model="gpt-4o-mini",
-                        messages=[
-                            {"role": "system", "content": "You are a helpful assistant."},
-                            {"role": "user", "content": f'{full_prompt}'}
-                        ],
-                        max_tokens=1000,
-                        temperature=0.3
-                    )
-                    summaryOpenAI = responseOpenAI['choices'][0]['message']['content']
                     logger.info(f"OpenAI GPT summary {repeat + 1}: {summaryOpenAI}")
                     rouge_google = rouge_scorer_instance.score(reference_summary, summaryGoogle)
                     rouge_openai = rouge_scorer_instance.score(reference_summary, summaryOpenAI)
                     logger.info(f"ROUGE Google: {rouge_google}")
                     logger.info(f"ROUGE OpenAI: {rouge_openai}")
-                    P_google, R_google, F_google = bert_score([summaryGoogle], [reference_summary], lang="en", device='cpu')
-                    P_openai, R_openai, F_openai = bert_score([summaryOpenAI], [reference_summary], lang="en", device='cpu')
-                    logger.info(f"BERTScore Google F1: {F_google.mean().item()}")
-                    logger.info(f"BERTScore OpenAI F1: {F_openai.mean().item()}")
                     fkgl_google, dcrs_google, cli_google = calculate_readability(summaryGoogle)
                     fkgl_openai, dcrs_openai, cli_openai = calculate_readability(summaryOpenAI)
-                    alignscore_google = np.mean(alignscore_model.score(
-                        contexts=[abstract_text], claims=[summaryGoogle]))
-                    alignscore_openai = np.mean(alignscore_model.score(
-                        contexts=[abstract_text], claims=[summaryOpenAI]))
-                    summaC_google = np.mean(summac_model.score(
-                        [abstract_text], [summaryGoogle])['scores'])
-                    summaC_openai = np.mean(summac_model.score(
-                        [abstract_text], [summaryOpenAI])['scores'])
-                    logger.info(f"AlignScore Google: {alignscore_google}, SummaC Google: {summaC_google}")
-                    logger.info(f"AlignScore OpenAI: {alignscore_openai}, SummaC OpenAI: {summaC_openai}")
-                    metrics_google = {
-                        'rouge1': rouge_google['rouge1'].fmeasure,
-                        'rouge2': rouge_google['rouge2'].fmeasure,
-                        'rougeL': rouge_google['rougeL'].fmeasure,
-                        'bertscore': F_google.mean().item(),
-                        'fkgl': fkgl_google,
-                        'dcrs': dcrs_google,
-                        'cli': cli_google,
-                        'alignscore': alignscore_google,
-                        'summaC': summaC_google
-                    }
-                    metrics_openai = {
-                        'rouge1': rouge_openai['rouge1'].fmeasure,
-                        'rouge2': rouge_openai['rouge2'].fmeasure,
-                        'rougeL': rouge_openai['rougeL'].fmeasure,
-                        'bertscore': F_openai.mean().item(),
-                        'fkgl': fkgl_openai,
-                        'dcrs': dcrs_openai,
-                        'cli': cli_openai,
-                        'alignscore': alignscore_openai,
-                        'summaC': summaC_openai
-                    }
-                    for metric_name, value in metrics_google.items():
-                        per_prompt_metrics[prompt_num]['models']['Google Gemini']['metrics'][metric_name].append(value)
-                    for metric_name, value in metrics_openai.items():
-                        per_prompt_metrics[prompt_num]['models']['OpenAI GPT']['metrics'][metric_name].append(value)
-                    time.sleep(1)
+                    # BERTScore and factuality reach the accumulator when their batched passes are flushed
+                    for model_name, summary, rouge, (fkgl, dcrs, cli) in (
+                            ('Google Gemini', summaryGoogle, rouge_google, (fkgl_google, dcrs_google, cli_google)),
+                            ('OpenAI GPT', summaryOpenAI, rouge_openai, (fkgl_openai, dcrs_openai, cli_openai))):
+                        accumulator.add_many(prompt_num, model_name, {
+                            'rouge1': rouge['rouge1'].fmeasure, 'rouge2': rouge['rouge2'].fmeasure,
+                            'rougeL': rouge['rougeL'].fmeasure, 'fkgl': fkgl, 'dcrs': dcrs, 'cli': cli,
+                        })
+                        bertscore_queue.add(summary, reference_summary,
+                                            accumulator.sink(prompt_num, model_name, 'bertscore'), None)
+                        for metric_name in ('alignscore', 'summaC'):
+                            factuality.add(metric_name, abstract_text, summary,
+                                           accumulator.sink(prompt_num, model_name, metric_name), None)
                 except Exception as e:
                     logger.error(f"Error processing doc {test_num+1}, prompt {prompt_num}, repeat {repeat+1}: {e}")
-                    for metric_name in per_prompt_metrics[prompt_num]['models']['Google Gemini']['metrics']:
-                        per_prompt_metrics[prompt_num]['models']['Google Gemini']['metrics'][metric_name].append(0)
-                        per_prompt_metrics[prompt_num]['models']['OpenAI GPT']['metrics'][metric_name].append(0)
+                    # Failed after retrying: recorded as missing and left out of the aggregates
+                    for model_name in MODEL_NAMES:
+                        accumulator.add_missing(prompt_num, model_name)
+    if batch_queued:
+        logger.info(f"{batch_queued} repeats are waiting for their batch results and were not scored")
+    bertscore_queue.flush()
+    factuality.flush()
     for prompt_num, prompt_data in per_prompt_metrics.items():
-        for model_name in ['Google Gemini', 'OpenAI GPT']:
-            metrics = prompt_data['models'][model_name]['metrics']
-            average_metrics = {metric_name: np.mean(values) for metric_name, values in metrics.items()}
-            std_metrics = {metric_name: np.std(values) for metric_name, values in metrics.items()}
-            prompt_data['models'][model_name]['average_metrics'] = average_metrics
-            prompt_data['models'][model_name]['std_metrics'] = std_metrics
+        for model_name in MODEL_NAMES:
+            # Population std, as np.nanstd gave over the per-repeat scores
+            prompt_data['models'][model_name] = {
+                'metric_states': {name: accumulator.state(prompt_num, model_name, name) for name in METRIC_NAMES},
+                'average_metrics': {name: accumulator.mean(prompt_num, model_name, name) for name in METRIC_NAMES},
+                'std_metrics': {name: accumulator.std(prompt_num, model_name, name) for name in METRIC_NAMES},
+            }
     return per_prompt_metrics
 
 if __name__ == "__main__":
-    with open(DATA_PATH, 'r') as f:
-        data = json.load(f)
+    setup_logger(LOG_FILE_PATH)
     num_documents_to_process = 2
+    data = iter_documents(DATA_PATH, num_documents=num_documents_to_process)
     per_prompt_metrics = process_and_evaluate(data, num_repeats=3, num_documents=num_documents_to_process)
     write_per_prompt_csv(per_prompt_metrics, CSV_FILE_PATH)
     logging.shutdown()
@@ -5,7 +5,8 @@ This script is part of a thesis project evaluating summarisation quality on biom
 - **Extracts key sentences** from biomedical abstracts using an LLM-powered extractive prompt.
 - **Generates abstractive summaries** from extracted sentences and keyword guidance, using an LLM (OpenAI GPT-4o-mini by default).
 - **Evaluates generated summaries** against human reference summaries using ROUGE metrics, BERTScore, and readability formulas (Flesch-Kincaid, Dale-Chall, Coleman-Liau).
-- **Handles long abstracts** by splitting into manageable token-length chunks.
+- **Reuses each abstract's extract** across repeats (set EXTRACT_REUSE=repeat to re-extract every repeat); extracts are stored next to the results.
+- **Handles long abstracts** by splitting into manageable token-length chunks, summarised concurrently (at most MAP_CONCURRENCY calls in flight) and then combined.
 - **Logs outputs and metrics** for traceability and reproducibility.
 
 This pipeline was developed for experimentation, benchmarking, and prompt engineering during the research process.
@@ -16,111 +17,116 @@ Please ensure your API keys, input/output file paths, and dependencies are corre
 from dotenv import load_dotenv
 import os
 import logging
-import openai
 import csv
-import json
 import numpy as np
-from rouge_score import rouge_scorer
-from bert_score import score as bert_score
-import textstat
-import tiktoken
+from rouge_engine import RougeEngine
+from readability import readability
+from chunking import chunk_text, count_tokens
+from completion_cache import get_default_cache
+from async_generation import GenerationRequest, generate_all, request_cache_key
+from llm_providers import get_provider, provider_cache_name
+from retry import MISSING, call_with_retry
+from dataset_reader import iter_documents
+from extract_store import ExtractStore
 
+# OPENAI_API_KEY is read from .env when the first completion is requested
 load_dotenv()
-openai_api_key = os.getenv('OPENAI_API_KEY')
-openai.api_key = openai_api_key
 
-rouge_scorer_instance = rouge_scorer.RougeScorer(['rouge1', 'rouge2', 'rougeL'], use_stemmer=True)
+rouge_scorer_instance = RougeEngine(['rouge1', 'rouge2', 'rougeL'], use_stemmer=True)
 
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.INFO)
 log_directory = '/File Path'
-if not os.path.exists(log_directory):
-    os.makedirs(log_directory)
 log_file_path = os.path.join(log_directory, 'FileName.log')
 csv_file_path = os.path.join(log_directory, 'FileName.csv')
+extracts_path = os.path.join(log_directory, 'FileName.extracts.jsonl')
 json_file_path = '/FileName.json'
-file_handler = logging.FileHandler(log_file_path)
-console_handler = logging.StreamHandler()
-formatter = logging.Formatter('%(asctime)s - %(message)s')
-file_handler.setFormatter(formatter)
-console_handler.setFormatter(formatter)
-logger.addHandler(file_handler)
-logger.addHandler(console_handler)
 
 num_repeats = 3  
+# Most chunk (map) calls of one document in flight at once
+map_concurrency = int(os.getenv('MAP_CONCURRENCY', 8))
+
+def setup_logging():
+    logger.setLevel(logging.INFO)
+    os.makedirs(log_directory, exist_ok=True)
+    file_handler = logging.FileHandler(log_file_path)
+    console_handler = logging.StreamHandler()
+    formatter = logging.Formatter('%(asctime)s - %(message)s')
+    file_handler.setFormatter(formatter)
+    console_handler.setFormatter(formatter)
+    logger.addHandler(file_handler)
+    logger.addHandler(console_handler)
 
 def calculate_readability(text):
-    fkgl = textstat.flesch_kincaid_grade(text)
-    dcrs = textstat.dale_chall_readability_score(text)
-    cli = textstat.coleman_liau_index(text)
-    return fkgl, dcrs, cli
-
-def split_text_into_chunks(text, max_tokens_per_chunk, model="gpt-4o-mini"):
-    encoding = tiktoken.encoding_for_model(model)
-    tokens = encoding.encode(text)
-    chunks = []
-    for i in range(0, len(tokens), max_tokens_per_chunk):
-        chunk_tokens = tokens[i:i + max_tokens_per_chunk]
-        chunk_text = encoding.decode(chunk_tokens)
-        chunks.append(chunk_text)
-    return chunks
-
-def extract_key_sentences(abstract_text):
+    # One shared analysis of the text for all three formulas
+    scores = readability(text, ('fkgl', 'dcrs', 'cli'))
+    return scores['fkgl'], scores['dcrs'], scores['cli']
+
+def chat_completion(model_name, prompt, repeat=0):
+    # Replayed from the on-disk completion cache when this exact call was made before
+    request = GenerationRequest('openai', model_name, prompt, repeat=repeat)
+    return get_default_cache().get_or_call(
+        request_cache_key(request), lambda: call_with_retry(get_provider('openai').complete, request),
+        provider=provider_cache_name('openai'), model=model_name, repeat=repeat)
+
+def chat_completions(model_name, prompts, repeat=0):
+    # Map step: every chunk prompt is sent at once, so a long document waits for its slowest chunk rather than
+    # the sum of them. Shares cache entries with chat_completion; completions come back in prompt order.
+    requests = [GenerationRequest('openai', model_name, prompt, repeat=repeat) for prompt in prompts]
+    completions = generate_all(requests, max_concurrency=map_concurrency)
+    for completion in completions:
+        if isinstance(completion, Exception):
+            raise completion
+    return completions
+
+def extract_key_sentences(abstract_text, repeat=0):
     model_name = "gpt-4o-mini"
     max_context_tokens = 4096
     max_response_tokens = 500
     max_prompt_tokens = max_context_tokens - max_response_tokens - 1000
-    abstract_chunks = split_text_into_chunks(abstract_text, max_prompt_tokens, model=model_name)
-    extracted_sentences_list = []
-    for idx, chunk in enumerate(abstract_chunks):
-        extractive_prompt = (
+    # Chunks end on sentence boundaries and carry their token counts
+    abstract_chunks = chunk_text(abstract_text, max_prompt_tokens, model=model_name)
+    extractive_prompts = [
+        (
             f"Part {idx+1} of {len(abstract_chunks)}:\n\n"
             "Extract the key sentences from the following part of a research abstract that highlight "
             "the main objectives, methods, and findings. Ensure that all critical technical details are included.\n\n"
-            f"{chunk}\n\n"
+            f"{chunk.text}\n\n"
             "Return only the most important sentences as an extract."
         )
-        response = openai.ChatCompletion.create(
-            model=model_name,
-            messages=[{"role": "user", "content": extractive_prompt}]
-        )
-        extracted_text = response['choices'][0]['message']['content']
+        for idx, chunk in enumerate(abstract_chunks)
+    ]
+    extracted_sentences_list = chat_completions(model_name, extractive_prompts, repeat=repeat)
+    for extractive_prompt, extracted_text in zip(extractive_prompts, extracted_sentences_list):
         logger.info(f"Extractive Prompt: {extractive_prompt}")
         logger.info(f"Extracted key sentences: {extracted_text}")
-        extracted_sentences_list.append(extracted_text)
     combined_extracted_text = ' '.join(extracted_sentences_list)
     return combined_extracted_text
 
-def abstractive_summarization(extracted_text, keywords):
+def abstractive_summarization(extracted_text, keywords, repeat=0):
     model_name = "gpt-4o-mini"
     max_context_tokens = 8192
     max_response_tokens = 500
     max_prompt_tokens = max_context_tokens - max_response_tokens - 1000
-    encoding = tiktoken.encoding_for_model(model_name)
-    tokens = encoding.encode(extracted_text)
     few_shot_example = (
         "Example Abstract:\n"
         "Example Summary:\n"
     )
     keyword_string = ", ".join(keywords)
-    if len(tokens) > max_prompt_tokens:
-        chunks = split_text_into_chunks(extracted_text, max_prompt_tokens - len(encoding.encode(few_shot_example)), model=model_name)
-        summaries = []
-        for idx, chunk in enumerate(chunks):
-            abstractive_prompt = (
+    chunks = chunk_text(extracted_text, max_prompt_tokens - count_tokens(few_shot_example, model_name), model=model_name)
+    if len(chunks) > 1:
+        abstractive_prompts = [
+            (
                 f"{few_shot_example}"
                 f"Part {idx+1} of {len(chunks)}:\n\n"
                 "Compose an accessible summary of the following key points, avoiding technical jargon and explaining any necessary terms in simple language. "
                 f"Ensure that the summary includes the following keywords: {keyword_string}.\n\n"
-                f"{chunk}\n\n"
+                f"{chunk.text}\n\n"
                 "The summary should be concise, engaging, and no more than 300 words."
             )
-            response = openai.ChatCompletion.create(
-                model=model_name,
-                messages=[{"role": "user", "content": abstractive_prompt}]
-            )
-            summary_text = response['choices'][0]['message']['content']
-            summaries.append(summary_text)
+            for idx, chunk in enumerate(chunks)
+        ]
+        summaries = chat_completions(model_name, abstractive_prompts, repeat=repeat)
+        # Reduce step: issued as soon as the last chunk summary arrives
         combined_summary = ' '.join(summaries)
         final_prompt = (
             f"{few_shot_example}"
@@ -129,11 +135,7 @@ def abstractive_summarization(extracted_text, keywords):
             f"{combined_summary}\n\n"
             "The final summary should be engaging and no more than 300 words."
         )
-        response = openai.ChatCompletion.create(
-            model=model_name,
-            messages=[{"role": "user", "content": final_prompt}]
-        )
-        final_summary = response['choices'][0]['message']['content']
+        final_summary = chat_completion(model_name, final_prompt, repeat=repeat)
         return final_summary
     else:
         abstractive_prompt = (
@@ -143,19 +145,16 @@ def abstractive_summarization(extracted_text, keywords):
             f"{extracted_text}\n\n"
             "The summary should be concise, engaging, and no more than 300 words."
         )
-        response = openai.ChatCompletion.create(
-            model=model_name,
-            messages=[{"role": "user", "content": abstractive_prompt}]
-        )
-        summary_text = response['choices'][0]['message']['content']
+        summary_text = chat_completion(model_name, abstractive_prompt, repeat=repeat)
         return summary_text
 
+# Streams documents from the JSON file; evaluate_and_log stops reading after max_documents
 def load_data_from_json(json_file_path):
-    with open(json_file_path, 'r') as file:
-        data = json.load(file)
-    return data
+    return iter_documents(json_file_path)
 
-def evaluate_and_log(data):
+def evaluate_and_log(data, num_repeats=num_repeats, max_documents=50, csv_file_path=csv_file_path,
+                     extracts_path=extracts_path, extract_reuse=None):
+    extracts = ExtractStore(extracts_path, reuse=extract_reuse)
     per_prompt_metrics = {
         'prompt_text': "Extract and summarize abstracts",
         'papers_tested': 0,
@@ -175,10 +174,9 @@ def evaluate_and_log(data):
         }
     }
     results_list = []
-    max_documents = 50
     processed_docs = 0
     for i, document in enumerate(data):
-        if processed_docs >= max_documents:
+        if max_documents is not None and processed_docs >= max_documents:
             break
         logger.info(f"Processing document {i+1}")
         abstract_list = document.get('abstract', [])
@@ -196,8 +194,17 @@ def evaluate_and_log(data):
         rougeL_scores = []
         for repeat in range(num_repeats):
             logger.info(f"Repeat {repeat+1}/{num_repeats} for document {i+1}")
-            extracted_sentences = extract_key_sentences(abstract)
-            summary = abstractive_summarization(extracted_sentences, keywords)
+            try:
+                extracted_sentences = extracts.get_or_extract(
+                    'gpt-4o-mini', abstract, repeat, lambda extract_repeat: extract_key_sentences(abstract, repeat=extract_repeat))
+                summary = abstractive_summarization(extracted_sentences, keywords, repeat=repeat)
+            except Exception as e:
+                # Calls that fail after retrying are recorded as missing, not as zero scores
+                logger.error(f"Generation failed for document {i+1}, repeat {repeat+1}: {e}")
+                rouge1_scores.append(MISSING)
+                rouge2_scores.append(MISSING)
+                rougeL_scores.append(MISSING)
+                continue
             rouge_scores_abstractive = rouge_scorer_instance.score(reference_summary, summary)
             rouge1_scores.append(rouge_scores_abstractive['rouge1'].fmeasure)
             rouge2_scores.append(rouge_scores_abstractive['rouge2'].fmeasure)
@@ -205,12 +212,12 @@ def evaluate_and_log(data):
         logger.info(f"Document {i+1} ROUGE-1 Scores: {rouge1_scores}")
         logger.info(f"Document {i+1} ROUGE-2 Scores: {rouge2_scores}")
         logger.info(f"Document {i+1} ROUGE-L Scores: {rougeL_scores}")
-        rouge1_mean = np.mean(rouge1_scores)
-        rouge1_std = np.std(rouge1_scores)
-        rouge2_mean = np.mean(rouge2_scores)
-        rouge2_std = np.std(rouge2_scores)
-        rougeL_mean = np.mean(rougeL_scores)
-        rougeL_std = np.std(rougeL_scores)
+        rouge1_mean = np.nanmean(rouge1_scores)
+        rouge1_std = np.nanstd(rouge1_scores)
+        rouge2_mean = np.nanmean(rouge2_scores)
+        rouge2_std = np.nanstd(rouge2_scores)
+        rougeL_mean = np.nanmean(rougeL_scores)
+        rougeL_std = np.nanstd(rougeL_scores)
         logger.info(f"Document {i+1} ROUGE-1 Mean: {rouge1_mean}, Std: {rouge1_std}")
         logger.info(f"Document {i+1} ROUGE-2 Mean: {rouge2_mean}, Std: {rouge2_std}")
         logger.info(f"Document {i+1} ROUGE-L Mean: {rougeL_mean}, Std: {rougeL_std}")
@@ -233,9 +240,11 @@ def evaluate_and_log(data):
         writer.writeheader()
         for data in results_list:
             writer.writerow(data)
+    extracts.close()
     print(f"Results written to {csv_file_path}")
     logging.shutdown()
 
 if __name__ == "__main__":
+    setup_logging()
     data = load_data_from_json(json_file_path)
     evaluate_and_log(data)
\ No newline at end of file
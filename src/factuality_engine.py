@@ -0,0 +1,107 @@
+"""
+Batched Factuality Scoring (AlignScore and SummaC)
+
+Shared by the benchmark scripts so each process holds a single loaded copy of each
+factuality model, rather than every script building its own SummaCConv and
+AlignScore at import time and scoring one (context, claim) pair per call.
+
+Pairs are queued during a run, identical contexts are stored once, identical
+(context, claim) pairs are scored once, and everything is sent to the models in
+full batches when the engine is flushed. Each queued pair carries a target container
+and key so its score lands back in the bucket it came from.
+"""
+
+import logging
+from importlib.util import find_spec
+from profiling import get_profiler
+
+# Checked without importing: both packages load torch, so they are only imported when a model is built.
+HAS_FACTUALITY_MODELS = find_spec('alignscore') is not None and find_spec('summac') is not None
+
+logger = logging.getLogger(__name__)
+
+METRICS = ('alignscore', 'summaC')
+
+# Process-wide model caches, keyed by the settings that change the loaded weights.
+_alignscore_models = {}
+_summac_models = {}
+
+
+def get_alignscore_model(device='cpu', batch_size=16):
+    key = (device, batch_size)
+    if key not in _alignscore_models:
+        from alignscore import AlignScore
+        logger.info(f"Loading AlignScore model (device={device})")
+        _alignscore_models[key] = AlignScore(
+            model='roberta-base', batch_size=batch_size, device=device, ckpt_path=None, evaluation_mode='nli_sp'
+        )
+    return _alignscore_models[key]
+
+
+def get_summac_model(start_file, device='cpu'):
+    key = (start_file, device)
+    if key not in _summac_models:
+        from summac.model_summac import SummaCConv
+        logger.info(f"Loading SummaC model (device={device})")
+        _summac_models[key] = SummaCConv(
+            models=["vitc"],
+            bins='percentile',
+            granularity="sentence",
+            nli_labels="e",
+            device=device,
+            start_file=start_file,
+            agg="mean"
+        )
+    return _summac_models[key]
+
+
+class FactualityEngine:
+    """Queues (context, claim) pairs per metric and scores them in batches on flush()."""
+
+    def __init__(self, summac_start_file, device='cpu', batch_size=16):
+        if not HAS_FACTUALITY_MODELS:
+            raise ImportError("alignscore and summac must be installed to score factuality.")
+        self.summac_start_file = summac_start_file
+        self.device = device
+        self.batch_size = batch_size
+        self._contexts = {}
+        self._pairs = {metric: {} for metric in METRICS}
+
+    def __len__(self):
+        return sum(len(targets) for pairs in self._pairs.values() for targets in pairs.values())
+
+    def add(self, metric, context, claim, target, key):
+        """Queue one pair for `metric`; its score is written to target[key] when flushed."""
+        context_id = self._contexts.setdefault(context, len(self._contexts))
+        self._pairs[metric].setdefault((context_id, claim), []).append((target, key))
+
+    def _score_alignscore(self, contexts, claims):
+        model = get_alignscore_model(self.device, self.batch_size)
+        return [float(s) for s in model.score(contexts=contexts, claims=claims)]
+
+    def _score_summac(self, contexts, claims):
+        model = get_summac_model(self.summac_start_file, self.device)
+        return [float(s) for s in model.score(contexts, claims)['scores']]
+
+    def flush(self):
+        """Score every queued pair and write each score back to its targets."""
+        contexts = list(self._contexts)
+        scorers = {'alignscore': self._score_alignscore, 'summaC': self._score_summac}
+        for metric in METRICS:
+            pairs = self._pairs[metric]
+            if not pairs:
+                continue
+            # Keep pairs sharing a context adjacent so batches reuse the same source text.
+            unique_pairs = sorted(pairs, key=lambda pair: pair[0])
+            logger.info(f"Scoring {len(unique_pairs)} unique pairs with {metric}")
+            scores = []
+            for start in range(0, len(unique_pairs), self.batch_size):
+                batch = unique_pairs[start:start + self.batch_size]
+                with get_profiler().stage(metric, items=len(batch)):
+                    scores.extend(scorers[metric](
+                        [contexts[context_id] for context_id, _ in batch], [claim for _, claim in batch]))
+            for pair, score in zip(unique_pairs, scores):
+                for target, key in pairs[pair]:
+                    target[key] = score
+        self._contexts = {}
+        self._pairs = {metric: {} for metric in METRICS}
@@ -0,0 +1,190 @@
+"""
+Corpus-Level LexRank Extraction
+
+Selects the key sentences of many abstracts at once, with the same results as sumy's
+LexRankSummarizer (threshold 0.1, epsilon 0.1, no stemming or stop words) applied to
+each abstract in turn. sumy compares every pair of sentences, and computes every
+term's IDF, in Python loops, and the benchmark also built a new NLTK tokenizer for
+every abstract. Here:
+- The sumy tokenizer is built once and each abstract is tokenised once.
+- The sentences of a whole batch become one sparse TF-IDF matrix whose columns are
+  (document, term) pairs, so X·X^T holds every document's sentence similarities in
+  its diagonal blocks and nothing across documents. IDF is per document, with each
+  sentence counted as a document, as in sumy.
+- Power iteration runs on the block-diagonal transition matrix of the whole batch;
+  each document's vector stops updating as soon as it converges, so every document
+  takes the same number of steps, and gets the same scores, as sumy gives it.
+
+Batched sums are taken in a different order from sumy's, so scores can differ in the
+last bit, and sumy breaks exact ties between sentences on exactly those bits. Any
+document whose cut-off between selected and unselected sentences falls on such a
+near-tie is re-scored with sumy's own dense power iteration over the same matrix, so
+the selected sentences match sumy's. Duplicate sentences are ranked as sumy ranks them
+(a repeated sentence takes the score of its last occurrence). Only a similarity within
+rounding error of the threshold could still resolve differently.
+"""
+
+import math
+from functools import lru_cache
+from profiling import get_profiler
+import numpy as np
+from scipy import sparse
+
+THRESHOLD = 0.1
+EPSILON = 0.1
+# Scores this close are treated as tied, and the document is re-scored exactly as sumy does
+TIE_TOLERANCE = 1e-9
+
+
+@lru_cache(maxsize=None)
+def get_tokenizer(language='english'):
+    # sumy (and its NLTK sentence models) is only imported by runs that extract
+    from sumy.nlp.tokenizers import Tokenizer
+    return Tokenizer(language)
+
+
+@lru_cache(maxsize=None)
+def _idf(sentences_count, n_j):
+    # math.log, as sumy uses, so IDF values agree to the last bit
+    return math.log(sentences_count / (1 + n_j))
+
+
+class LexRankExtractor:
+    def __init__(self, language='english', threshold=THRESHOLD, epsilon=EPSILON, tokenizer=None):
+        self.tokenizer = tokenizer or get_tokenizer(language)
+        self.threshold = threshold
+        self.epsilon = epsilon
+
+    def tokenize(self, text):
+        """sumy's sentences of `text`, each as (sentence text, is_heading, lower-cased words)."""
+        from sumy.parsers.plaintext import PlaintextParser
+        document = PlaintextParser.from_string(text, self.tokenizer).document
+        return [(str(sentence), sentence.is_heading, [word.lower() for word in sentence.words])
+                for sentence in document.sentences]
+
+    def _transition_matrix(self, documents, offsets):
+        vocabulary = {}
+        rows, cols, counts = [], [], []
+        row = 0
+        for doc_index, sentences in enumerate(documents):
+            for _, _, words in sentences:
+                for word in words:
+                    cols.append(vocabulary.setdefault((doc_index, word), len(vocabulary)))
+                    rows.append(row)
+                    counts.append(1.0)
+                row += 1
+        shape = (row, len(vocabulary))
+        counts = sparse.csr_matrix((counts, (rows, cols)), shape=shape)  # duplicates are summed
+        counts.sum_duplicates()
+
+        # tf = count / max count in the sentence
+        row_of_entry = np.repeat(np.arange(shape[0]), np.diff(counts.indptr))
+        max_tf = np.zeros(shape[0])
+        np.maximum.at(max_tf, row_of_entry, counts.data)
+        tf = counts.data / max_tf[row_of_entry]
+
+        # idf = log(sentences in document / (1 + sentences containing the term))
+        sentences_per_doc = np.diff(offsets)
+        term_doc = np.empty(shape[1], dtype=np.int64)
+        for (doc_index, _), column in vocabulary.items():
+            term_doc[column] = doc_index
+        n_j = np.bincount(counts.indices, minlength=shape[1])
+        idf = np.array([_idf(int(sentences_per_doc[doc]), int(n)) for doc, n in zip(term_doc, n_j)])
+
+        weights = sparse.csr_matrix((tf * idf[counts.indices], counts.indices, counts.indptr), shape=shape)
+        norms = np.sqrt(np.asarray(weights.multiply(weights).sum(axis=1)).ravel())
+        similarity = (weights @ weights.T).tocoo()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            cosine = similarity.data / (norms[similarity.row] * norms[similarity.col])
+        linked = (norms[similarity.row] > 0) & (norms[similarity.col] > 0) & (cosine > self.threshold)
+        link_rows, link_cols = similarity.row[linked], similarity.col[linked]
+
+        degrees = np.bincount(link_rows, minlength=shape[0]).astype(float)
+        degrees[degrees == 0] = 1
+        return sparse.csr_matrix((1.0 / degrees[link_rows], (link_rows, link_cols)), shape=(shape[0], shape[0]))
+
+    def _power_method(self, matrix, offsets):
+        sentences_per_doc = np.diff(offsets)
+        doc_of_row = np.repeat(np.arange(len(sentences_per_doc)), sentences_per_doc)
+        starts = offsets[:-1]
+        transposed = matrix.T.tocsr()
+        p_vector = 1.0 / sentences_per_doc[doc_of_row]
+        active = np.ones(len(sentences_per_doc), dtype=bool)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            while active.any():
+                next_p = transposed @ p_vector
+                next_p /= np.sqrt(np.add.reduceat(next_p * next_p, starts))[doc_of_row]
+                delta = next_p - p_vector
+                lambda_val = np.sqrt(np.add.reduceat(delta * delta, starts))
+                update = active[doc_of_row]
+                p_vector[update] = next_p[update]
+                # NaN (a document with no links at all) stops the loop, as in sumy
+                active &= lambda_val > self.epsilon
+        return p_vector
+
+    def _power_method_dense(self, matrix):
+        # sumy's LexRankSummarizer.power_method, operation for operation
+        transposed_matrix = matrix.T
+        sentences_count = len(matrix)
+        p_vector = np.array([1.0 / sentences_count] * sentences_count)
+        lambda_val = 1.0
+        with np.errstate(divide='ignore', invalid='ignore'):
+            while lambda_val > self.epsilon:
+                next_p = np.dot(transposed_matrix, p_vector)
+                next_p /= np.linalg.norm(next_p)
+                lambda_val = np.linalg.norm(np.subtract(next_p, p_vector))
+                p_vector = next_p
+        return p_vector
+
+    @staticmethod
+    def _near_tie(scores, num_sentences):
+        if len(scores) <= num_sentences:
+            return False
+        ranked = np.sort(scores)[::-1]
+        cutoff, runner_up = ranked[num_sentences - 1], ranked[num_sentences]
+        return abs(cutoff - runner_up) <= TIE_TOLERANCE * max(1.0, abs(cutoff))
+
+    def rate(self, documents, num_sentences=None):
+        """LexRank scores of each tokenised document's sentences (one array per document).
+
+        With `num_sentences`, documents whose top-`num_sentences` cut-off is a near-tie are re-scored
+        with sumy's dense iteration, so selecting that many sentences matches sumy exactly.
+        """
+        sizes = [len(sentences) for sentences in documents]
+        offsets = np.concatenate([[0], np.cumsum(sizes)]).astype(np.int64)
+        ratings = [np.zeros(0) for _ in documents]
+        if not offsets[-1]:
+            return ratings
+        # Empty documents are dropped from the batch; reduceat needs every segment to be non-empty
+        kept = [index for index, size in enumerate(sizes) if size]
+        kept_offsets = np.concatenate([[0], np.cumsum([sizes[index] for index in kept])]).astype(np.int64)
+        kept_documents = [documents[index] for index in kept]
+        matrix = self._transition_matrix(kept_documents, kept_offsets)
+        scores = self._power_method(matrix, kept_offsets)
+        for position, index in enumerate(kept):
+            start, end = kept_offsets[position], kept_offsets[position + 1]
+            ratings[index] = scores[start:end]
+            if num_sentences and self._near_tie(ratings[index], num_sentences):
+                ratings[index] = self._power_method_dense(matrix[start:end, start:end].toarray())
+        return ratings
+
+    def extract_batch(self, texts, num_sentences=3):
+        """The `num_sentences` highest-rated sentences of each text, in document order and joined by spaces."""
+        with get_profiler().stage('lexrank', items=len(texts)):
+            documents = [self.tokenize(text) for text in texts]
+            extracts = []
+            for sentences, scores in zip(documents, self.rate(documents, num_sentences)):
+                # sumy keys ratings by sentence, so a repeated sentence takes its last occurrence's score
+                last_score = {(text, heading): score for (text, heading, _), score in zip(sentences, scores)}
+                ratings = [last_score[(text, heading)] for text, heading, _ in sentences]
+                best = sorted(range(len(sentences)), key=lambda position: ratings[position], reverse=True)[:num_sentences]
+                extracts.append(' '.join(sentences[position][0] for position in sorted(best)))
+        return extracts
+
+    def extract(self, text, num_sentences=3):
+        return self.extract_batch([text], num_sentences)[0]
+
+
+@lru_cache(maxsize=None)
+def get_extractor(language='english'):
+    return LexRankExtractor(language)
@@ -0,0 +1,251 @@
+"""
+LLM Provider Backends
+
+One interface for every model call the benchmarks make. A provider turns a
+GenerationRequest (see async_generation.py) into completion text, synchronously
+(complete) or inside an event loop (acomplete):
+- OpenAIProvider: the openai SDK with one pooled, keep-alive requests.Session for
+  synchronous calls and one aiohttp session (connection pool) per event loop for
+  async calls, instead of a new connection per request. Calls time out after
+  LLM_TIMEOUT seconds.
+- GoogleProvider: google.generativeai with one GenerativeModel handle per model name
+  for the whole process, and the same timeout.
+- MockProvider: a deterministic local stand-in. Its completion is a slice of the
+  prompt chosen from a hash of the request, so it varies with the model, prompt and
+  repeat but is identical on every run. No network access or API key is needed;
+  MOCK_LATENCY_MS adds a fixed delay per call to mimic a real round trip.
+
+Set LLM_BACKEND=mock to serve every provider name ('openai', 'google') with a
+MockProvider, e.g. to load-test a full pipeline on a machine with no API access.
+Mock completions are cached under their own provider name (mock:openai, ...) so
+they never mix with real completions in the completion cache.
+
+Settings (in .env or the environment): LLM_BACKEND (live or mock), LLM_TIMEOUT
+(default 60 s), LLM_POOL_SIZE (connections per provider, default 32),
+MOCK_LATENCY_MS (default 0).
+"""
+
+import os
+import time
+import asyncio
+import hashlib
+import logging
+from profiling import get_profiler
+
+logger = logging.getLogger(__name__)
+
+PROVIDER_API_KEYS = {'openai': 'OPENAI_API_KEY', 'google': 'API_KEY'}
+BACKENDS = ('live', 'mock')
+
+
+def _api_key(provider):
+    api_key = os.getenv(PROVIDER_API_KEYS[provider])
+    if not api_key:
+        raise RuntimeError(f"{PROVIDER_API_KEYS[provider]} must be set in your .env file.")
+    return api_key
+
+
+class Provider:
+    """Base class: subclasses implement _complete() and _acomplete(), returning (text, total tokens or None)."""
+
+    name = None
+
+    @property
+    def cache_name(self):
+        # Provider name used in completion cache keys
+        return self.name
+
+    def complete(self, request):
+        start = time.perf_counter()
+        text, tokens = self._complete(request)
+        self._record(request, time.perf_counter() - start, text, tokens)
+        return text
+
+    async def acomplete(self, request):
+        start = time.perf_counter()
+        text, tokens = await self._acomplete(request)
+        self._record(request, time.perf_counter() - start, text, tokens)
+        return text
+
+    def _record(self, request, seconds, text, tokens):
+        if tokens is None:
+            # ~4 characters per token when the provider does not report usage
+            tokens = (len(request.prompt) + len(request.system_prompt or '') + len(text or '')) // 4
+        get_profiler().record('generation', seconds, self.cache_name, tokens=tokens)
+
+    def _complete(self, request):
+        raise NotImplementedError
+
+    async def _acomplete(self, request):
+        raise NotImplementedError
+
+    async def open_async(self):
+        """Called inside an event loop before its first acomplete()."""
+
+    async def close_async(self):
+        """Called before that event loop ends."""
+
+
+class OpenAIProvider(Provider):
+    name = 'openai'
+
+    def __init__(self, api_key, timeout=60, pool_size=32):
+        import openai
+        import requests
+        from requests.adapters import HTTPAdapter
+        self.openai = openai
+        self.openai.api_key = api_key
+        self.timeout = timeout
+        self.pool_size = pool_size
+        # openai<1.0 sends synchronous calls through openai.requestssession when it is set
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        self.openai.requestssession = session
+        self._aiosession_token = None
+
+    @staticmethod
+    def _messages(request):
+        messages = []
+        if request.system_prompt:
+            messages.append({"role": "system", "content": request.system_prompt})
+        messages.append({"role": "user", "content": request.prompt})
+        return messages
+
+    def _kwargs(self, request):
+        kwargs = {'request_timeout': self.timeout}
+        if request.max_tokens is not None:
+            kwargs['max_tokens'] = request.max_tokens
+        if request.temperature is not None:
+            kwargs['temperature'] = request.temperature
+        return kwargs
+
+    @staticmethod
+    def _result(response):
+        return response['choices'][0]['message']['content'], (response.get('usage') or {}).get('total_tokens')
+
+    def _complete(self, request):
+        return self._result(self.openai.ChatCompletion.create(
+            model=request.model, messages=self._messages(request), **self._kwargs(request)))
+
+    async def _acomplete(self, request):
+        return self._result(await self.openai.ChatCompletion.acreate(
+            model=request.model, messages=self._messages(request), **self._kwargs(request)))
+
+    async def open_async(self):
+        # openai<1.0 reads its aiohttp session from the openai.aiosession context variable
+        import aiohttp
+        session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.pool_size))
+        self._aiosession_token = self.openai.aiosession.set(session)
+
+    async def close_async(self):
+        if self._aiosession_token is not None:
+            session = self.openai.aiosession.get()
+            self.openai.aiosession.reset(self._aiosession_token)
+            self._aiosession_token = None
+            await session.close()
+
+
+class GoogleProvider(Provider):
+    name = 'google'
+
+    def __init__(self, api_key, timeout=60):
+        import google.generativeai as genai
+        self.genai = genai
+        self.genai.configure(api_key=api_key)
+        self.timeout = timeout
+        self._models = {}
+
+    def model(self, model_name):
+        """The process-wide GenerativeModel handle for `model_name`."""
+        if model_name not in self._models:
+            self._models[model_name] = self.genai.GenerativeModel(model_name)
+        return self._models[model_name]
+
+    @staticmethod
+    def _generation_config(request):
+        generation_config = {}
+        if request.max_tokens is not None:
+            generation_config['max_output_tokens'] = request.max_tokens
+        if request.temperature is not None:
+            generation_config['temperature'] = request.temperature
+        return generation_config or None
+
+    @staticmethod
+    def _result(response):
+        usage = getattr(response, 'usage_metadata', None)
+        return response.text, getattr(usage, 'total_token_count', None)
+
+    def _complete(self, request):
+        return self._result(self.model(request.model).generate_content(
+            request.prompt, generation_config=self._generation_config(request),
+            request_options={'timeout': self.timeout}))
+
+    async def _acomplete(self, request):
+        return self._result(await self.model(request.model).generate_content_async(
+            request.prompt, generation_config=self._generation_config(request),
+            request_options={'timeout': self.timeout}))
+
+
+class MockProvider(Provider):
+    def __init__(self, name, latency=0.0, words=120):
+        self.name = name
+        self.latency = latency
+        self.words = words
+        self.calls = 0
+
+    @property
+    def cache_name(self):
+        return provider_cache_name(self.name, 'mock')
+
+    def _completion(self, request):
+        self.calls += 1
+        digest = hashlib.sha256(repr((self.name, request.model, request.prompt, request.system_prompt,
+                                      request.max_tokens, request.temperature, request.repeat)).encode('utf-8')).digest()
+        words = request.prompt.split()
+        if len(words) <= self.words:
+            return ' '.join(words)
+        start = int.from_bytes(digest[:8], 'big') % (len(words) - self.words + 1)
+        return ' '.join(words[start:start + self.words])
+
+    def _complete(self, request):
+        if self.latency:
+            time.sleep(self.latency)
+        return self._completion(request), None
+
+    async def _acomplete(self, request):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self._completion(request), None
+
+
+_providers = {}
+
+
+def backend():
+    name = os.getenv('LLM_BACKEND', 'live')
+    if name not in BACKENDS:
+        raise ValueError(f"LLM_BACKEND must be one of {', '.join(BACKENDS)}, got {name!r}")
+    return name
+
+
+def provider_cache_name(name, backend_name=None):
+    """Provider name for completion cache keys; known without creating (or authenticating) the provider."""
+    return f"mock:{name}" if (backend_name or backend()) == 'mock' else name
+
+
+def get_provider(name):
+    """The shared provider for `name` ('openai' or 'google'), created on first use."""
+    if name not in _providers:
+        if name not in PROVIDER_API_KEYS:
+            raise ValueError(f"Unknown provider {name!r}; choose from {', '.join(PROVIDER_API_KEYS)}")
+        timeout = float(os.getenv('LLM_TIMEOUT', 60))
+        if backend() == 'mock':
+            _providers[name] = MockProvider(name, latency=float(os.getenv('MOCK_LATENCY_MS', 0)) / 1000)
+        elif name == 'openai':
+            _providers[name] = OpenAIProvider(_api_key(name), timeout, int(os.getenv('LLM_POOL_SIZE', 32)))
+        else:
+            _providers[name] = GoogleProvider(_api_key(name), timeout)
+        logger.info(f"Using {type(_providers[name]).__name__} for {name}")
+    return _providers[name]
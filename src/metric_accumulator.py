@@ -0,0 +1,224 @@
+"""
+Streaming Metric Aggregation
+
+The benchmarks used to append every per-repeat score to a Python list per prompt,
+model and metric and average the lists at the end. MetricAccumulator keeps only the
+running aggregates instead: for every (group, model, metric) cell a count, mean and
+sum of squared deviations (Welford's online update, O(1) per score), held in flat
+typed arrays rather than lists of floats. Aggregates can be read at any point of a
+run (snapshot(), log_snapshot()), so partial results are visible while the run is
+still going, and each cell converts to a partial_results.MetricState for sharded
+merges.
+
+Missing scores (None or NaN, see retry.MISSING) are counted separately and left out
+of the aggregates. Optional quantiles are estimated in O(1) memory per cell with
+the P² algorithm (Jain & Chlamtac), exact for the first five scores.
+
+Deferred scoring queues (DeferredBertScore, FactualityEngine, ParallelScorer) write
+results as target[key] = value; sink() returns a target that feeds the accumulator,
+so queued scores are aggregated as soon as their queue is flushed.
+"""
+
+import math
+import logging
+from array import array
+from partial_results import MetricState
+
+logger = logging.getLogger(__name__)
+
+
+class P2Quantile:
+    """Streaming estimate of the p-quantile (0 < p < 1) from five markers."""
+
+    __slots__ = ('p', 'heights', 'positions', 'desired', 'increments', 'initial')
+
+    def __init__(self, p):
+        self.p = p
+        self.initial = []
+        self.heights = None
+
+    def add(self, value):
+        if self.heights is None:
+            self.initial.append(value)
+            if len(self.initial) == 5:
+                p = self.p
+                self.heights = sorted(self.initial)
+                self.positions = [1, 2, 3, 4, 5]
+                self.desired = [1, 1 + 2 * p, 1 + 4 * p, 3 + 2 * p, 5]
+                self.increments = [0, p / 2, p, (1 + p) / 2, 1]
+            return
+        q, n = self.heights, self.positions
+        if value < q[0]:
+            q[0] = value
+            k = 0
+        elif value >= q[4]:
+            q[4] = value
+            k = 3
+        else:
+            k = next(i for i in range(1, 5) if value < q[i]) - 1
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+        for i in range(1, 4):
+            d = self.desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                height = q[i] + d / (n[i + 1] - n[i - 1]) * (
+                    (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+                    + (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1]))
+                if not q[i - 1] < height < q[i + 1]:
+                    height = q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+                q[i] = height
+                n[i] += d
+
+    def value(self):
+        if self.heights is not None:
+            return self.heights[2]
+        if not self.initial:
+            return float('nan')
+        values = sorted(self.initial)
+        position = (len(values) - 1) * self.p
+        lower = math.floor(position)
+        upper = min(lower + 1, len(values) - 1)
+        return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+class _Sink:
+    """Target for a deferred scoring queue: target[key] = value adds the score to one accumulator cell."""
+
+    __slots__ = ('accumulator', 'cell')
+
+    def __init__(self, accumulator, cell):
+        self.accumulator = accumulator
+        self.cell = cell
+
+    def __setitem__(self, key, value):
+        self.accumulator._add_cell(self.cell, value)
+
+
+class MetricAccumulator:
+    def __init__(self, metric_names, quantiles=()):
+        self.metric_names = list(metric_names)
+        self.quantiles = tuple(quantiles)
+        self._columns = {name: column for column, name in enumerate(self.metric_names)}
+        self._rows = {}
+        # One entry per cell (row * number of metrics + column)
+        self._count = array('q')
+        self._missing = array('q')
+        self._mean = array('d')
+        self._m2 = array('d')
+        self._estimators = {}
+
+    def _row(self, group, model):
+        row = self._rows.get((group, model))
+        if row is None:
+            row = self._rows[(group, model)] = len(self._rows)
+            width = len(self.metric_names)
+            self._count.extend([0] * width)
+            self._missing.extend([0] * width)
+            self._mean.extend([0.0] * width)
+            self._m2.extend([0.0] * width)
+        return row
+
+    def _cell(self, group, model, metric):
+        return self._row(group, model) * len(self.metric_names) + self._columns[metric]
+
+    def _add_cell(self, cell, value):
+        if value is None or math.isnan(value):
+            self._missing[cell] += 1
+            return
+        count = self._count[cell] + 1
+        mean = self._mean[cell]
+        delta = value - mean
+        mean += delta / count
+        self._count[cell] = count
+        self._mean[cell] = mean
+        self._m2[cell] += delta * (value - mean)
+        if self.quantiles:
+            estimators = self._estimators.get(cell)
+            if estimators is None:
+                estimators = self._estimators[cell] = [P2Quantile(q / 100) for q in self.quantiles]
+            for estimator in estimators:
+                estimator.add(value)
+
+    def add(self, group, model, metric, value):
+        self._add_cell(self._cell(group, model, metric), value)
+
+    def add_many(self, group, model, values):
+        """Add one score per metric from a {metric: value} mapping."""
+        for metric, value in values.items():
+            self.add(group, model, metric, value)
+
+    def add_missing(self, group, model, metrics=None):
+        """Record a repeat that produced no scores (e.g. its generation failed)."""
+        for metric in metrics or self.metric_names:
+            self._missing[self._cell(group, model, metric)] += 1
+
+    def sink(self, group, model, metric):
+        return _Sink(self, self._cell(group, model, metric))
+
+    def sinks(self, group, model, metrics=None):
+        """{metric: sink} for queues that write target[metric][key] (ParallelScorer)."""
+        return {metric: self.sink(group, model, metric) for metric in metrics or self.metric_names}
+
+    def groups(self):
+        """(group, model) pairs in the order they were first seen."""
+        return list(self._rows)
+
+    def count(self, group, model, metric):
+        return self._count[self._cell(group, model, metric)]
+
+    def mean(self, group, model, metric):
+        cell = self._cell(group, model, metric)
+        return self._mean[cell] if self._count[cell] else float('nan')
+
+    def std(self, group, model, metric, ddof=0):
+        """Population (ddof=0, np.std) or sample (ddof=1, statistics.stdev) standard deviation."""
+        cell = self._cell(group, model, metric)
+        count = self._count[cell]
+        if count <= ddof:
+            return float('nan') if not count else 0.0
+        return math.sqrt(self._m2[cell] / (count - ddof))
+
+    def quantile(self, group, model, metric, q):
+        estimators = self._estimators.get(self._cell(group, model, metric))
+        if not estimators:
+            return float('nan')
+        return estimators[self.quantiles.index(q)].value()
+
+    def state(self, group, model, metric):
+        cell = self._cell(group, model, metric)
+        return MetricState(self._count[cell], self._mean[cell], self._m2[cell])
+
+    def summary(self, group, model, ddof=0):
+        """Per-metric readout of one (group, model) pair."""
+        readout = {}
+        for metric in self.metric_names:
+            cell = self._cell(group, model, metric)
+            entry = {
+                'count': self._count[cell],
+                'missing': self._missing[cell],
+                'mean': self.mean(group, model, metric),
+                'std': self.std(group, model, metric, ddof),
+            }
+            for q in self.quantiles:
+                entry[f'p{q:g}'] = self.quantile(group, model, metric, q)
+            readout[metric] = entry
+        return readout
+
+    def snapshot(self, ddof=0):
+        """{group: {model: {metric: readout}}} of everything aggregated so far."""
+        snapshot = {}
+        for group, model in self._rows:
+            snapshot.setdefault(group, {})[model] = self.summary(group, model, ddof)
+        return snapshot
+
+    def log_snapshot(self, metrics=None, log=None):
+        """Log the running means of `metrics` (default: all) for every (group, model) pair."""
+        log = log or logger
+        for group, model in self._rows:
+            means = ', '.join(
+                f"{metric} {self.mean(group, model, metric):.4f} (n={self.count(group, model, metric)})"
+                for metric in metrics or self.metric_names)
+            log.info(f"Running means, {group} / {model}: {means}")
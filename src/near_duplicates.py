@@ -0,0 +1,308 @@
+"""
+Near-Duplicate Documents
+
+PLOS/eLife splits contain the same paper more than once. A split can hold several
+versions of a paper (elife-56656-v1 and elife-56656-v2), corrections, and abstracts
+that differ only in punctuation or a sentence. Summarising every copy spends API
+calls on what is effectively one document. The copies also pull means towards that
+paper.
+
+This module clusters a split's documents in two ways:
+- By versioned id: ids that match once the -vN suffix is removed are one paper.
+- By abstract text: each abstract becomes a set of word 5-shingles and gets a
+  128-value MinHash signature. Locality-sensitive hashing (bands of the signature)
+  then proposes candidate pairs. A pair becomes part of one cluster (union-find)
+  when its estimated Jaccard similarity reaches the threshold (default 0.8).
+Every cluster has one representative: the highest version, then the earliest
+document of the split. A run over part of the split (--start/--num-documents) picks
+each cluster's representative the same way among the documents in its range, so a
+paper whose split-wide representative lies outside the range is still evaluated
+once, and every shard of the range agrees on it.
+
+The index is built once per split and saved next to it as <split>.neardup.npz. It
+is rebuilt only if the split file or the index settings change. Runs then either:
+- representative: skip every document that is not its cluster's representative, so
+  no completions are requested for duplicates
+- flag: keep every document, log the duplicates, and mark each one with
+  near_duplicate_of (the representative's id)
+
+Usage:
+    python src/near_duplicates.py data/elife_val.json --list
+    python src/run_benchmark.py xero --data data/elife_val.json --near-duplicates representative
+"""
+
+import os
+import re
+import json
+import zlib
+import logging
+import argparse
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+INDEX_VERSION = 1
+INDEX_SUFFIX = '.neardup.npz'
+MODES = ('representative', 'flag')
+
+_VERSION_SUFFIX = re.compile(r'-v(\d+)$')
+_WORD = re.compile(r'\w+')
+
+
+def base_id(doc_id):
+    """Document id without its version suffix: elife-56656-v2 -> elife-56656."""
+    return _VERSION_SUFFIX.sub('', str(doc_id).strip().lower())
+
+
+def id_version(doc_id):
+    match = _VERSION_SUFFIX.search(str(doc_id).strip().lower())
+    return int(match.group(1)) if match else 0
+
+
+def shingle_hashes(text, shingle_size):
+    """CRC32 of every distinct word `shingle_size`-gram of `text` (one shingle for shorter texts)."""
+    words = _WORD.findall(text.lower())
+    if not words:
+        return np.empty(0, dtype=np.uint64)
+    shingles = {' '.join(words[i:i + shingle_size]) for i in range(max(1, len(words) - shingle_size + 1))}
+    return np.fromiter((zlib.crc32(shingle.encode('utf-8')) for shingle in shingles), dtype=np.uint64,
+                       count=len(shingles))
+
+
+class MinHasher:
+    """MinHash signatures from multiply-shift hashes ((a * x + b) mod 2^64) >> 32, one (a, b) pair per value."""
+
+    def __init__(self, num_perm=128, shingle_size=5, seed=1):
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, 2 ** 63, size=num_perm, dtype=np.uint64) | np.uint64(1)
+        self._b = rng.integers(0, 2 ** 63, size=num_perm, dtype=np.uint64)
+
+    def signature(self, text):
+        """uint32 signature of `text`, or None for text without words."""
+        hashes = shingle_hashes(text, self.shingle_size)
+        if not len(hashes):
+            return None
+        with np.errstate(over='ignore'):
+            values = (self._a[:, None] * hashes[None, :] + self._b[:, None]) >> np.uint64(32)
+        return values.min(axis=1).astype(np.uint32)
+
+
+def lsh_bands(num_perm, threshold):
+    """(bands, rows) with bands * rows == num_perm and an LSH threshold (1/bands)^(1/rows) at or just below `threshold`."""
+    options = [(num_perm // rows, rows) for rows in range(1, num_perm + 1) if num_perm % rows == 0]
+    below = [(bands, rows) for bands, rows in options if (1 / bands) ** (1 / rows) <= threshold]
+    return max(below, key=lambda option: (1 / option[0]) ** (1 / option[1])) if below else options[0]
+
+
+class _UnionFind:
+    def __init__(self, size):
+        self.parent = np.arange(size)
+
+    def find(self, item):
+        parent = self.parent
+        while parent[item] != item:
+            parent[item] = parent[parent[item]]
+            item = parent[item]
+        return item
+
+    def union(self, first, second):
+        first, second = self.find(first), self.find(second)
+        if first != second:
+            self.parent[max(first, second)] = min(first, second)
+
+
+def _document_text(document):
+    abstract = document.get('abstract', '')
+    return ' '.join(str(part) for part in abstract) if isinstance(abstract, list) else str(abstract or '')
+
+
+def _pick_representatives(ids, clusters, start, stop):
+    """Representative of each position in start..stop-1 among the positions of its cluster in that range; -1 elsewhere."""
+    representatives = np.full(len(ids), -1, dtype=np.int64)
+    best = {}
+    for position in range(start, stop):
+        current = best.get(clusters[position])
+        if current is None or id_version(ids[position]) > id_version(ids[current]):
+            best[clusters[position]] = position
+    for position in range(start, stop):
+        representatives[position] = best[clusters[position]]
+    return representatives
+
+
+class NearDuplicateIndex:
+    """Cluster of every document of a split, by position in the split."""
+
+    def __init__(self, ids, signatures, has_signature, representatives, settings):
+        self.ids = list(ids)
+        self.signatures = signatures
+        self.has_signature = has_signature
+        self.representatives = representatives
+        self.settings = settings
+
+    @classmethod
+    def build(cls, documents, threshold=0.8, num_perm=128, shingle_size=5, seed=1):
+        hasher = MinHasher(num_perm, shingle_size, seed)
+        ids, rows, has_signature = [], [], []
+        for position, document in enumerate(documents):
+            ids.append(str(document.get('id', position)))
+            signature = hasher.signature(_document_text(document))
+            has_signature.append(signature is not None)
+            rows.append(signature if signature is not None else np.zeros(num_perm, dtype=np.uint32))
+        signatures = np.vstack(rows) if rows else np.empty((0, num_perm), dtype=np.uint32)
+        has_signature = np.asarray(has_signature, dtype=bool)
+
+        clusters = _UnionFind(len(ids))
+        # Versions of one paper belong together whatever their text
+        first_by_id = {}
+        for position, doc_id in enumerate(ids):
+            clusters.union(first_by_id.setdefault(base_id(doc_id), position), position)
+
+        bands, rows_per_band = lsh_bands(num_perm, threshold)
+        positions = np.flatnonzero(has_signature)
+        mixer = np.random.default_rng(seed + 1).integers(1, 2 ** 63, size=rows_per_band, dtype=np.uint64)
+        for band in range(bands):
+            values = signatures[positions, band * rows_per_band:(band + 1) * rows_per_band].astype(np.uint64)
+            with np.errstate(over='ignore'):
+                keys = (values * mixer).sum(axis=1)
+            order = np.argsort(keys, kind='stable')
+            sorted_keys = keys[order]
+            starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+            ends = np.r_[starts[1:], len(sorted_keys)]
+            for start, end in zip(starts[ends - starts > 1], ends[ends - starts > 1]):
+                bucket = positions[order[start:end]]
+                for index, position in enumerate(bucket[1:], start=1):
+                    for other in bucket[:index]:
+                        if clusters.find(other) == clusters.find(position):
+                            break
+                        # A shared band only proposes the pair; the estimated Jaccard similarity decides
+                        if np.mean(signatures[other] == signatures[position]) >= threshold:
+                            clusters.union(other, position)
+                            break
+
+        roots = [clusters.find(position) for position in range(len(ids))]
+        representatives = _pick_representatives(ids, roots, 0, len(ids))
+        settings = {'version': INDEX_VERSION, 'threshold': threshold, 'num_perm': num_perm,
+                    'shingle_size': shingle_size, 'seed': seed}
+        return cls(ids, signatures, has_signature, representatives, settings)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def representative(self, position):
+        return int(self.representatives[position])
+
+    def is_representative(self, position):
+        return self.representatives[position] == position
+
+    def representatives_within(self, start=0, stop=None):
+        """Representatives chosen among documents start..stop-1 only, by position (-1 outside the range)."""
+        stop = len(self) if stop is None else min(stop, len(self))
+        # The split-wide representative identifies the cluster
+        return _pick_representatives(self.ids, self.representatives.tolist(), start, stop)
+
+    def similarity(self, first, second):
+        """Estimated Jaccard similarity of two documents' abstracts."""
+        if not (self.has_signature[first] and self.has_signature[second]):
+            return 0.0
+        return float(np.mean(self.signatures[first] == self.signatures[second]))
+
+    def clusters(self):
+        """{representative position: member positions} for every cluster with more than one document."""
+        members = {}
+        for position, representative in enumerate(self.representatives.tolist()):
+            members.setdefault(representative, []).append(position)
+        return {representative: positions for representative, positions in members.items() if len(positions) > 1}
+
+    def save(self, path, source=None):
+        tmp_path = f"{path}.tmp.npz"
+        np.savez_compressed(tmp_path, ids=np.array(self.ids, dtype=str), signatures=self.signatures,
+                            has_signature=self.has_signature, representatives=self.representatives,
+                            settings=np.array(json.dumps(dict(self.settings, source=source))))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            settings = json.loads(str(data['settings']))
+            return cls(data['ids'].tolist(), data['signatures'], data['has_signature'], data['representatives'],
+                       settings)
+
+
+def index_path(split_path):
+    return split_path + INDEX_SUFFIX
+
+
+def _source_fingerprint(split_path):
+    stat = os.stat(split_path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def load_or_build(split_path, threshold=0.8, num_perm=128, shingle_size=5, seed=1, rebuild=False):
+    """The split's saved index, or a new one (built over the whole split and saved) if it is missing or stale."""
+    from dataset_reader import iter_documents
+    path = index_path(split_path)
+    wanted = {'version': INDEX_VERSION, 'threshold': threshold, 'num_perm': num_perm,
+              'shingle_size': shingle_size, 'seed': seed, 'source': _source_fingerprint(split_path)}
+    if not rebuild and os.path.isfile(path):
+        index = NearDuplicateIndex.load(path)
+        if index.settings == wanted:
+            return index
+        logger.info(f"{path} was built for another version of the split or other settings; rebuilding")
+    index = NearDuplicateIndex.build(iter_documents(split_path, fields=('id', 'abstract')),
+                                     threshold, num_perm, shingle_size, seed)
+    index.save(path, source=wanted['source'])
+    clusters = index.clusters()
+    logger.info(f"Near-duplicate index of {split_path}: {len(index)} documents, {len(clusters)} clusters "
+                f"of duplicates ({sum(len(members) - 1 for members in clusters.values())} redundant); "
+                f"saved to {path}")
+    return index
+
+
+def filter_documents(documents, index, mode, positions, start=0, stop=None):
+    """Apply `mode` to `documents`, whose positions in the split are `positions` (an iterable, e.g. itertools.count).
+
+    Representatives are chosen among documents `start` to `stop` of the split, the run's range (all shards of it).
+    """
+    if mode not in MODES:
+        raise ValueError(f"near-duplicate mode must be one of {', '.join(MODES)}, got {mode!r}")
+    representatives = index.representatives_within(start, stop)
+    skipped = 0
+    for position, document in zip(positions, documents):
+        if representatives[position] == position:
+            yield document
+            continue
+        representative_id = index.ids[representatives[position]]
+        if mode == 'representative':
+            skipped += 1
+            logger.info(f"Skipping {document.get('id', position)}: near-duplicate of {representative_id}")
+            continue
+        logger.warning(f"{document.get('id', position)} is a near-duplicate of {representative_id}")
+        yield dict(document, near_duplicate_of=representative_id)
+    if skipped:
+        logger.info(f"Skipped {skipped} near-duplicate documents")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build a split's near-duplicate index and list its clusters.")
+    parser.add_argument('split', help="JSON/JSON Lines split or .bmds store")
+    parser.add_argument('--threshold', type=float, default=0.8, help="estimated Jaccard similarity of abstracts")
+    parser.add_argument('--rebuild', action='store_true')
+    parser.add_argument('--list', action='store_true', help="print every cluster of duplicates")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
+
+    index = load_or_build(args.split, threshold=args.threshold, rebuild=args.rebuild)
+    clusters = index.clusters()
+    print(f"{len(index)} documents; {len(clusters)} clusters of near-duplicates, "
+          f"{sum(len(members) - 1 for members in clusters.values())} documents redundant")
+    if args.list:
+        for representative, members in sorted(clusters.items()):
+            duplicates = ', '.join(f"{index.ids[member]} ({index.similarity(representative, member):.2f})"
+                                   for member in members if member != representative)
+            print(f"{index.ids[representative]}: {duplicates}")
+
+
+if __name__ == "__main__":
+    main()
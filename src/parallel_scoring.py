@@ -0,0 +1,207 @@
+"""
+Parallel Metric Scoring Across CPU Cores
+
+Scores (reference, candidate, source) triples in a pool of worker processes instead
+of on the main thread inside the generation loop. ROUGE (rouge_engine, stemmed as
+RougeScorer with use_stemmer=True), the readability formulas (FKGL, DCRS, CLI) and SummaC are pure
+CPU work with no shared state, so throughput scales with the number of workers.
+
+Each worker builds its own ROUGE engine and SummaC model once, in the pool
+initializer, and keeps them for the life of the pool; the pool itself is reused
+across flushes. Triples are sent in chunks so SummaC still scores a batch per call
+and IPC overhead stays small next to the scoring work. Triples are queued document by
+document, so a chunk's candidates mostly share a reference, which the ROUGE engine
+tokenises once.
+
+Like the deferred BERTScore and factuality queues, each queued triple carries a
+target and key: on flush every computed metric is written to target[metric][key],
+so results land back in the prompt/model buckets they came from.
+
+Worker count comes from the max_workers argument or SCORING_WORKERS (default: all
+cores). With one worker, triples are scored in-process and no pool is started.
+
+A triple that fails to score (e.g. a SummaC error on one summary) gets MISSING for
+every metric and is left out of the aggregates like a failed generation. A crashed
+worker (BrokenProcessPool after an out-of-memory kill) breaks the whole pool, so the
+chunks still unscored in that flush get MISSING the same way and the next flush starts
+a fresh pool. flush() itself never raises for a scoring error, so the run and its
+checkpoint carry on.
+"""
+
+import os
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+from readability import readability
+from profiling import get_profiler
+from retry import MISSING
+
+logger = logging.getLogger(__name__)
+
+ROUGE_TYPES = ('rouge1', 'rouge2', 'rougeL')
+READABILITY_METRICS = ('fkgl', 'dcrs', 'cli')
+METRICS = ROUGE_TYPES + READABILITY_METRICS + ('summaC',)
+
+# Per-process scoring state, built once by _init_worker
+_worker = {}
+
+
+def default_workers():
+    return int(os.getenv('SCORING_WORKERS', os.cpu_count() or 1))
+
+
+def _init_worker(metric_names, summac_start_file=None, device='cpu'):
+    _worker['metric_names'] = tuple(metric_names)
+    _worker['rouge'] = None
+    _worker['summac'] = None
+    if any(name in ROUGE_TYPES for name in metric_names):
+        from rouge_engine import RougeEngine
+        _worker['rouge'] = RougeEngine(ROUGE_TYPES, use_stemmer=True)
+    if 'summaC' in metric_names:
+        try:
+            import torch
+            # One intra-op thread per worker; the pool already occupies every core.
+            torch.set_num_threads(1)
+        except ImportError:
+            pass
+        from factuality_engine import get_summac_model
+        _worker['summac'] = get_summac_model(summac_start_file, device)
+
+
+def _score_task(reference, candidate):
+    scores = {}
+    if _worker['rouge'] is not None:
+        rouge_scores = _worker['rouge'].score(reference, candidate)
+        for rouge_type in ROUGE_TYPES:
+            scores[rouge_type] = rouge_scores[rouge_type].fmeasure
+    if 'fkgl' in _worker['metric_names']:
+        scores.update(readability(candidate, READABILITY_METRICS))
+    return scores
+
+
+def _missing_scores(metric_names):
+    return {name: MISSING for name in metric_names}
+
+
+def score_batch(tasks):
+    """Score a list of (tag, reference, candidate, source) tasks. Returns [(tag, {metric: value})].
+
+    A task that fails gets MISSING for all its metrics; the rest of the batch is still scored.
+    """
+    metric_names = _worker['metric_names']
+    results = []
+    for tag, reference, candidate, source in tasks:
+        try:
+            results.append((tag, _score_task(reference, candidate)))
+        except Exception as e:
+            logger.error(f"Scoring failed for one summary: {type(e).__name__}: {e}")
+            results.append((tag, _missing_scores(metric_names)))
+    if _worker['summac'] is not None:
+        try:
+            summac_scores = _worker['summac'].score([task[3] for task in tasks], [task[2] for task in tasks])['scores']
+        except Exception as e:
+            # Find the pair that fails by scoring the batch one pair at a time
+            logger.error(f"SummaC failed on a batch of {len(tasks)}, scoring one at a time: {type(e).__name__}: {e}")
+            summac_scores = []
+            for task in tasks:
+                try:
+                    summac_scores.extend(_worker['summac'].score([task[3]], [task[2]])['scores'])
+                except Exception as e:
+                    logger.error(f"SummaC failed for one summary: {type(e).__name__}: {e}")
+                    summac_scores.append(MISSING)
+        for (_, scores), value in zip(results, summac_scores):
+            scores['summaC'] = float(value)
+    return [(tag, {name: scores.get(name, MISSING) for name in metric_names}) for tag, scores in results]
+
+
+class ParallelScorer:
+    """Queue of (reference, candidate, source) triples scored across worker processes on flush()."""
+
+    def __init__(self, metric_names, max_workers=None, summac_start_file=None, device='cpu', chunksize=8):
+        unknown = [name for name in metric_names if name not in METRICS]
+        if unknown:
+            raise ValueError(f"Cannot score {unknown} in worker processes; supported metrics are {METRICS}")
+        self.metric_names = tuple(metric_names)
+        self.max_workers = max_workers or default_workers()
+        self.summac_start_file = summac_start_file
+        self.device = device
+        self.chunksize = chunksize
+        self._executor = None
+        self._tasks = []
+        self._targets = []
+
+    def __len__(self):
+        return len(self._tasks)
+
+    def add(self, reference, candidate, source, target, key):
+        """Queue one triple; each metric's value is written to target[metric][key] when flushed."""
+        self._tasks.append((len(self._targets), reference, candidate, source))
+        self._targets.append((target, key))
+
+    def _get_executor(self):
+        if self._executor is None:
+            logger.info(f"Starting {self.max_workers} scoring workers for {', '.join(self.metric_names)}")
+            # spawn: workers start clean instead of inheriting the parent's event loop and model state
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker,
+                initargs=(self.metric_names, self.summac_start_file, self.device)
+            )
+        return self._executor
+
+    def flush(self):
+        """Score every queued triple and write the results back to their targets. Returns the number scored."""
+        if not self._tasks:
+            return 0
+        tasks, targets = self._tasks, self._targets
+        self._tasks, self._targets = [], []
+        chunks = [tasks[start:start + self.chunksize] for start in range(0, len(tasks), self.chunksize)]
+        logger.info(f"Scoring {len(tasks)} summaries in {len(chunks)} chunks")
+        # Worker processes keep their own timings, so the pool is timed as one stage here
+        with get_profiler().stage('parallel_scoring', items=len(tasks)):
+            for batch in self._score_chunks(chunks):
+                for tag, scores in batch:
+                    target, key = targets[tag]
+                    for metric_name, value in scores.items():
+                        target[metric_name][key] = value
+        return len(tasks)
+
+    def _score_chunks(self, chunks):
+        if self.max_workers == 1:
+            if _worker.get('metric_names') != self.metric_names:
+                _init_worker(self.metric_names, self.summac_start_file, self.device)
+            yield from map(score_batch, chunks)
+            return
+        executor = self._get_executor()
+        futures = []
+        for chunk in chunks:
+            try:
+                futures.append(executor.submit(score_batch, chunk))
+            except BrokenProcessPool as e:
+                futures.append(e)
+        broken = False
+        for chunk, future in zip(chunks, futures):
+            try:
+                if isinstance(future, Exception):
+                    raise future
+                yield future.result()
+            except Exception as e:
+                broken = broken or isinstance(e, BrokenProcessPool)
+                logger.error(f"Lost a chunk of {len(chunk)} summaries, recorded as missing: {type(e).__name__}: {e}")
+                yield [(task[0], _missing_scores(self.metric_names)) for task in chunk]
+        if broken:
+            # A dead worker breaks the whole pool; the next flush starts a new one
+            self.close()
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
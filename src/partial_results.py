@@ -0,0 +1,180 @@
+"""
+Mergeable Partial Benchmark Results
+
+A shard of a sharded run (see run_benchmark.py) cannot be combined with the others
+from its final CSV, because a mean of shard means is only right when every shard has
+the same number of values, and averaged standard deviations are never right.
+Instead, each shard also writes a partial-results file: for every prompt, model and
+metric it stores the count, mean and sum of squared deviations (Welford's M2). Those
+states combine exactly (Chan et al.'s parallel update), so merging the shards gives
+the same mean and population standard deviation (np.std, ddof=0) as one machine
+scoring every value. Merged values can differ from a single run only in the last
+floating-point digit.
+
+Usage:
+    python src/partial_results.py merge outputs/xero.csv outputs/xero.shard-*.partial.json
+"""
+
+import json
+import math
+import argparse
+import numpy as np
+
+FORMAT_VERSION = 1
+
+
+class MetricState:
+    """Count, mean and M2 (sum of squared deviations from the mean) of one metric's values."""
+
+    __slots__ = ('count', 'mean', 'm2')
+
+    def __init__(self, count=0, mean=0.0, m2=0.0):
+        self.count = count
+        self.mean = mean
+        self.m2 = m2
+
+    @classmethod
+    def from_values(cls, values):
+        values = np.asarray(values, dtype=float)
+        # Missing values (NaN: a call that failed after retrying) are not counted
+        values = values[~np.isnan(values)]
+        if not len(values):
+            return cls()
+        mean = float(np.mean(values))
+        return cls(len(values), mean, float(np.sum((values - mean) ** 2)))
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+    def merge(self, other):
+        if not other.count:
+            return self
+        if not self.count:
+            self.count, self.mean, self.m2 = other.count, other.mean, other.m2
+            return self
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta * delta * self.count * other.count / count
+        self.count = count
+        return self
+
+    def std(self):
+        # Population standard deviation, matching np.std
+        return math.sqrt(self.m2 / self.count) if self.count else float('nan')
+
+    def average(self):
+        return self.mean if self.count else float('nan')
+
+    def to_dict(self):
+        return {'count': self.count, 'mean': self.mean, 'm2': self.m2}
+
+    @classmethod
+    def from_dict(cls, state):
+        return cls(state['count'], state['mean'], state['m2'])
+
+
+def _model_states(model_data):
+    # Streaming runs carry their MetricAccumulator states; the others the per-repeat value lists
+    if 'metric_states' in model_data:
+        return {metric_name: state.to_dict() for metric_name, state in model_data['metric_states'].items()}
+    return {metric_name: MetricState.from_values(values).to_dict()
+            for metric_name, values in model_data['metrics'].items()}
+
+
+def partials_from_metrics(per_prompt_metrics):
+    """Per-prompt/per-model metric states from the results process_and_evaluate returns."""
+    return {
+        str(prompt_num): {
+            'prompt_text': prompt_data['prompt_text'],
+            'papers_tested': prompt_data['papers_tested'],
+            'repeats': prompt_data['repeats'],
+            'models': {
+                model_name: _model_states(model_data)
+                for model_name, model_data in prompt_data['models'].items()
+            },
+        }
+        for prompt_num, prompt_data in per_prompt_metrics.items()
+    }
+
+
+def write_partial(per_prompt_metrics, path, experiment, shard_index=0, shard_count=1):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({
+            'version': FORMAT_VERSION,
+            'experiment': experiment,
+            'shard_index': shard_index,
+            'shard_count': shard_count,
+            'prompts': partials_from_metrics(per_prompt_metrics),
+        }, f, ensure_ascii=False, indent=1)
+
+
+def load_partial(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        partial = json.load(f)
+    if partial.get('version') != FORMAT_VERSION:
+        raise ValueError(f"{path}: unsupported partial-results version {partial.get('version')}")
+    return partial
+
+
+def merge_partials(partials):
+    """Combine shard partials into per_prompt_metrics with average_metrics/std_metrics, as write_per_prompt_csv expects."""
+    experiments = {partial['experiment'] for partial in partials}
+    if len(experiments) != 1:
+        raise ValueError(f"Cannot merge partial results from different experiments: {sorted(experiments)}")
+    merged = {}
+    for partial in partials:
+        for prompt_num, prompt_data in partial['prompts'].items():
+            target = merged.setdefault(prompt_num, {
+                'prompt_text': prompt_data['prompt_text'],
+                'papers_tested': 0,
+                'repeats': prompt_data['repeats'],
+                'models': {},
+            })
+            if target['repeats'] != prompt_data['repeats']:
+                raise ValueError(f"Prompt {prompt_num} was run with different repeat counts across shards")
+            target['papers_tested'] += prompt_data['papers_tested']
+            for model_name, metric_states in prompt_data['models'].items():
+                model_states = target['models'].setdefault(model_name, {})
+                for metric_name, state in metric_states.items():
+                    model_states.setdefault(metric_name, MetricState()).merge(MetricState.from_dict(state))
+
+    per_prompt_metrics = {}
+    for prompt_num in sorted(merged, key=lambda key: (not key.isdigit(), int(key) if key.isdigit() else key)):
+        prompt_data = merged[prompt_num]
+        models = {}
+        for model_name, model_states in prompt_data['models'].items():
+            models[model_name] = {
+                'average_metrics': {name: state.average() for name, state in model_states.items()},
+                'std_metrics': {name: state.std() for name, state in model_states.items()},
+            }
+        per_prompt_metrics[int(prompt_num) if prompt_num.isdigit() else prompt_num] = dict(prompt_data, models=models)
+    return experiments.pop(), per_prompt_metrics
+
+
+def merge_files(paths, csv_path):
+    from run_benchmark import EXPERIMENTS, load_module
+
+    partials = [load_partial(path) for path in paths]
+    shard_count = {partial['shard_count'] for partial in partials}
+    shards = sorted(partial['shard_index'] for partial in partials)
+    if len(shard_count) == 1 and shards != list(range(shard_count.pop())):
+        print(f"Warning: merging shards {shards} of {partials[0]['shard_count']}; the result covers only those shards")
+    experiment, per_prompt_metrics = merge_partials(partials)
+    module = load_module(EXPERIMENTS[experiment]['module'])
+    module.write_per_prompt_csv(per_prompt_metrics, csv_path)
+    return experiment
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Merge per-shard partial results into one results CSV.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    merge_parser = subparsers.add_parser('merge')
+    merge_parser.add_argument('csv_path')
+    merge_parser.add_argument('partial_paths', nargs='+')
+    args = parser.parse_args()
+    experiment = merge_files(args.partial_paths, args.csv_path)
+    print(f"Merged {len(args.partial_paths)} {experiment} partial results into {args.csv_path}")
@@ -0,0 +1,153 @@
+"""
+Run Profiling
+
+Records how long each stage of a benchmark run takes, so a slow run can be traced to
+the providers or to scoring. The shared modules report into one process-wide
+Profiler:
+- generation: latency and token count of every provider call, per provider
+  (llm_providers.py), plus queue_wait, the time a request waited for its concurrency
+  slot and rate budget (async_generation.py), and retries (retry.py)
+- rouge, readability: every score call
+- bertscore, alignscore, summaC: every model batch; parallel_scoring: every flush of
+  the worker pool
+- lexrank, chunking: every extraction / chunking call
+
+report() summarises each stage (calls, items, total seconds, share of the run's wall
+time, items per second and p50/p95/p99 latency) and each provider, plus documents
+per minute. share_of_wall is a stage's summed call time over the run's wall time, so
+concurrent generation can exceed 1. run_benchmark.py writes the report to
+<experiment>.profile.json next to the results. Recording a timing costs well under a
+microsecond.
+"""
+
+import json
+import math
+import time
+from array import array
+from contextlib import contextmanager
+
+PERCENTILES = (50, 95, 99)
+
+
+def percentile(sorted_values, q):
+    """q-th percentile of `sorted_values` with linear interpolation (numpy's default method)."""
+    if not sorted_values:
+        return None
+    position = (len(sorted_values) - 1) * q / 100
+    lower = math.floor(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def latency_summary(seconds):
+    """Mean, p50/p95/p99 and max of `seconds`, in milliseconds."""
+    values = sorted(seconds)
+    if not values:
+        return {}
+    summary = {'mean': 1000 * math.fsum(values) / len(values)}
+    for q in PERCENTILES:
+        summary[f'p{q}'] = 1000 * percentile(values, q)
+    summary['max'] = 1000 * values[-1]
+    return summary
+
+
+class StageTimings:
+    __slots__ = ('seconds', 'items', 'tokens', 'retries')
+
+    def __init__(self):
+        self.seconds = array('d')
+        self.items = 0
+        self.tokens = 0
+        self.retries = 0
+
+
+class Profiler:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.started = time.perf_counter()
+        self.documents = 0
+        self._stages = {}
+
+    def _timings(self, stage, provider):
+        key = (stage, provider)
+        timings = self._stages.get(key)
+        if timings is None:
+            timings = self._stages[key] = StageTimings()
+        return timings
+
+    def record(self, stage, seconds, provider=None, items=1, tokens=None):
+        """One call of `stage` that took `seconds` and handled `items` documents/pairs."""
+        timings = self._timings(stage, provider)
+        timings.seconds.append(seconds)
+        timings.items += items
+        if tokens:
+            timings.tokens += tokens
+
+    def retry(self, stage, provider=None):
+        self._timings(stage, provider).retries += 1
+
+    @contextmanager
+    def stage(self, name, provider=None, items=1):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start, provider, items)
+
+    def count_documents(self, documents):
+        """Pass `documents` through, counting each one for documents per minute."""
+        for document in documents:
+            self.documents += 1
+            yield document
+
+    def _summary(self, timings_list, wall):
+        seconds = [value for timings in timings_list for value in timings.seconds]
+        total = math.fsum(seconds)
+        items = sum(timings.items for timings in timings_list)
+        summary = {
+            'calls': len(seconds),
+            'items': items,
+            'total_seconds': total,
+            'share_of_wall': total / wall if wall else None,
+            'items_per_second': items / total if total else None,
+            'latency_ms': latency_summary(seconds),
+        }
+        tokens = sum(timings.tokens for timings in timings_list)
+        retries = sum(timings.retries for timings in timings_list)
+        if tokens:
+            summary['tokens'] = tokens
+            summary['tokens_per_second'] = tokens / total if total else None
+        if retries:
+            summary['retries'] = retries
+        return summary
+
+    def report(self):
+        wall = time.perf_counter() - self.started
+        by_stage, by_provider = {}, {}
+        for (stage, provider), timings in self._stages.items():
+            by_stage.setdefault(stage, []).append(timings)
+            if provider is not None:
+                by_provider.setdefault(provider, {})[stage] = self._summary([timings], wall)
+        return {
+            'wall_seconds': wall,
+            'documents': self.documents,
+            'documents_per_minute': 60 * self.documents / wall if wall else None,
+            'stages': {stage: self._summary(timings, wall) for stage, timings in sorted(by_stage.items())},
+            'providers': dict(sorted(by_provider.items())),
+        }
+
+    def write(self, path):
+        report = self.report()
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=1)
+        return report
+
+
+_profiler = Profiler()
+
+
+def get_profiler():
+    """The process-wide Profiler every shared module records into."""
+    return _profiler
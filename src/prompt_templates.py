@@ -0,0 +1,206 @@
+"""
+Prompt Template Registry
+
+Every benchmark prompt is built from a registered PromptTemplate. A template has two
+parts. The first is a stable prefix: the instruction text (and few-shot examples),
+which is identical for every document. The second is a document layout, which holds
+the title, year, abstract and so on, and always comes after the prefix.
+
+Both providers reuse work on a repeated prompt prefix, and neither can help when
+per-document text comes first, so a prompt that varies early is always billed and
+processed in full. OpenAI only reuses a prefix that is identical across requests and
+at least 1,024 tokens long. The registered prefixes are far shorter, so they get no
+cross-document cache hits until a prefix grows past that (e.g. longer few-shot
+examples); token_report() flags the templates that do.
+
+render_prompts() builds all of a document's prompts at once. Each distinct layout is
+formatted only once and joined onto every template's prefix, so a document block
+shared by five prompt variants is rendered once rather than five times. Prefixes
+are plain strings, built once at import.
+
+token_report() gives the prompt token counts for each template: the shared prefix,
+and the mean, p50 and p95 of the per-document block and of the whole prompt. Use it
+to compare the cost and latency of templates before a run:
+
+    python src/prompt_templates.py data/plos_val.json --set xero --documents 100
+
+Counts use chunking.count_tokens (the tiktoken encoding of gpt-4o-mini). They are
+exact for GPT, and approximate for Gemini.
+"""
+
+import sys
+import json
+import argparse
+
+# OpenAI reuses a cached prefix only if it is identical across requests and at least this many tokens
+OPENAI_MIN_CACHED_PROMPT = 1024
+
+# Per-document blocks, always placed after the instruction prefix
+PAPER_LAYOUT = "**Title**: \"{title}\"\n**Year**: {year}\n\n**Abstract**:\n{abstract}\n\n"
+PAPER_KEYWORDS_LAYOUT = PAPER_LAYOUT + "**Keywords**: {keywords}\n\n"
+KEY_SENTENCES_LAYOUT = "**Title**: \"{title}\"\n**Year**: {year}\n\n**Key Sentences**:\n{key_sentences}\n\n"
+ABSTRACT_LAYOUT = "{abstract}\n\n"
+EXTRACT_LAYOUT = "Keywords: {keywords}\n\n{extracted_text}\n\n"
+
+# Shown in place of the abstract when a prompt is logged
+SANITIZED_ABSTRACT = "[Abstract text not shown]"
+
+
+class PromptTemplate:
+    __slots__ = ('name', 'prefix', 'layout')
+
+    def __init__(self, name, prefix, layout):
+        self.name = name
+        self.prefix = prefix
+        self.layout = layout
+
+    def render(self, values):
+        return self.prefix + self.layout.format(**values)
+
+
+_registry = {}
+TEMPLATE_SETS = {}
+
+
+def register(template, template_set=None):
+    if template.name in _registry:
+        raise ValueError(f"Prompt template {template.name!r} is already registered")
+    _registry[template.name] = template
+    if template_set is not None:
+        TEMPLATE_SETS.setdefault(template_set, []).append(template.name)
+    return template
+
+
+def get_template(name):
+    try:
+        return _registry[name]
+    except KeyError:
+        raise KeyError(f"Unknown prompt template {name!r}; registered: {', '.join(sorted(_registry))}") from None
+
+
+def get_templates(template_set):
+    return [_registry[name] for name in TEMPLATE_SETS[template_set]]
+
+
+def render_prompts(templates, values):
+    """Every template's prompt for one document's `values`; each distinct layout is formatted once."""
+    blocks = {}
+    prompts = []
+    for template in templates:
+        block = blocks.get(template.layout)
+        if block is None:
+            block = blocks[template.layout] = template.layout.format(**values)
+        prompts.append(template.prefix + block)
+    return prompts
+
+
+# --- Registered templates ---
+
+# xero_biomed_summ_benchmark: plain-language summaries of the full abstract
+register(PromptTemplate('xero-pls-detailed', (
+    "Compose a detailed Plain-Language Summary (PLS) of the following biomedical research paper to promote "
+    "Knowledge Translation (KT) and make the findings accessible to a non-expert audience.\n\n"
+), PAPER_LAYOUT), 'xero')
+register(PromptTemplate('xero-pls-accessible', (
+    "Create an informative and accessible Plain-Language Summary (PLS) for the following biomedical research "
+    "paper, aimed at enhancing Knowledge Translation (KT) and making the content understandable to individuals "
+    "without a scientific background.\n\n"
+), PAPER_LAYOUT), 'xero')
+
+# extractive_abstractive_benchmark: the same two instructions over LexRank key sentences
+register(PromptTemplate('lexrank-pls-detailed', (
+    "Compose a detailed Plain-Language Summary (PLS) of the following key sentences extracted from a biomedical "
+    "research paper to promote Knowledge Translation (KT) and make the findings accessible to a non-expert "
+    "audience.\n\n"
+), KEY_SENTENCES_LAYOUT), 'lexrank')
+register(PromptTemplate('lexrank-pls-accessible', (
+    "Create an informative and accessible Plain-Language Summary (PLS) for the following key sentences extracted "
+    "from a biomedical research paper, aimed at enhancing Knowledge Translation (KT) and making the content "
+    "understandable to individuals without a scientific background.\n\n"
+), KEY_SENTENCES_LAYOUT), 'lexrank')
+
+# promptwise_summarisation_benchmark: five prompt variants to fill in (replace each PROMPT n)
+for number in range(1, 6):
+    register(PromptTemplate(f'promptwise-{number}', f"PROMPT {number}\n\n", PAPER_KEYWORDS_LAYOUT), 'promptwise')
+
+# summarisation_llm_benchmark: GPT extraction, then a few-shot abstractive summary of the extract
+register(PromptTemplate('gpt-extract', (
+    "Extract the key sentences from the following research abstract that highlight the main objectives, "
+    "methods, and findings. Ensure that all critical technical details are included. "
+    "Return only the most important sentences as an extract.\n\n"
+), ABSTRACT_LAYOUT), 'gpt-extract-abstract')
+register(PromptTemplate('gpt-abstract', (
+    "Example Abstract 1:\n"
+    "Example Summary 1:\n"
+    "Example Abstract 2:\n"
+    "Example Summary 2:\n"
+    "Compose an accessible summary of the following key points, avoiding technical jargon and explaining any "
+    "necessary terms in simple language. The paragraph summary should be concise and engaging. "
+    "Ensure that the summary includes the keywords listed with the key points.\n\n"
+), EXTRACT_LAYOUT), 'gpt-extract-abstract')
+
+
+# --- Token counts ---
+
+def document_values(document):
+    """Layout values for a dataset document. Key sentences and extracts stand in as the full abstract."""
+    def joined(value, separator=' '):
+        return separator.join(value) if isinstance(value, list) else (value or '')
+    abstract = joined(document.get('abstract', ''))
+    return {
+        'title': document.get('title', 'No title available'),
+        'year': document.get('year', 'No year available'),
+        'abstract': abstract,
+        'keywords': joined(document.get('keywords', []), ', '),
+        'key_sentences': abstract,
+        'extracted_text': abstract,
+    }
+
+
+def token_report(templates, documents, model="gpt-4o-mini"):
+    """Prefix, per-document and total prompt tokens per template over `documents`."""
+    from chunking import count_tokens
+    from metric_accumulator import MetricAccumulator
+    accumulator = MetricAccumulator(['document_tokens', 'prompt_tokens'], quantiles=(50, 95))
+    prefix_tokens = {template.name: count_tokens(template.prefix, model) for template in templates}
+    for document in documents:
+        values = document_values(document)
+        for template in templates:
+            # Layout blocks repeat across templates and are memoised by count_tokens
+            block_tokens = count_tokens(template.layout.format(**values), model)
+            accumulator.add_many(template.name, model, {
+                'document_tokens': block_tokens,
+                'prompt_tokens': prefix_tokens[template.name] + block_tokens,
+            })
+    report = {}
+    for template in templates:
+        summary = accumulator.summary(template.name, model)
+        report[template.name] = {
+            'prefix_tokens': prefix_tokens[template.name],
+            'document_tokens': {key: summary['document_tokens'][key] for key in ('mean', 'p50', 'p95')},
+            'prompt_tokens': {key: summary['prompt_tokens'][key] for key in ('mean', 'p50', 'p95')},
+            'prefix_share': prefix_tokens[template.name] / summary['prompt_tokens']['mean']
+            if summary['prompt_tokens']['count'] else None,
+            'openai_cacheable': prefix_tokens[template.name] >= OPENAI_MIN_CACHED_PROMPT,
+        }
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Report prompt token counts per template.")
+    parser.add_argument('data', help="dataset split (JSON) to render the prompts for")
+    parser.add_argument('--set', dest='template_set', choices=sorted(TEMPLATE_SETS), default=None,
+                        help="template set to report (default: every registered template)")
+    parser.add_argument('--documents', type=int, default=100)
+    parser.add_argument('--model', default="gpt-4o-mini", help="tokeniser model")
+    args = parser.parse_args(argv)
+
+    from dataset_reader import iter_documents
+    templates = get_templates(args.template_set) if args.template_set else list(_registry.values())
+    documents = list(iter_documents(args.data, num_documents=args.documents))
+    json.dump(token_report(templates, documents, args.model), sys.stdout, indent=1)
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -7,39 +7,34 @@ The resulting summaries are compared to gold-standard references using ROUGE met
 
 Features:
 - Loads biomedical abstract dataset from JSON.
-- Runs 5 custom prompt variants per abstract (edit `create_prompts()` to define your prompts).
+- Runs 5 custom prompt variants per abstract (edit the 'promptwise' templates in prompt_templates.py to define your prompts).
 - Calls both Gemini and GPT for each prompt and logs all outputs.
 - Evaluates each generated summary with ROUGE-1, ROUGE-2, and ROUGE-L.
 - Writes all results to a CSV for downstream analysis.
 
+Run directly for the first 5 documents of DATA_PATH, or through run_benchmark.py to choose
+the dataset, document range, shard and repeats.
+
 """
 from dotenv import load_dotenv
 import os
 import csv
-import openai
-import google.generativeai as genai
 import time
-import json
-from rouge_score import rouge_scorer
-from statistics import mean, stdev
+from rouge_engine import RougeEngine
+from async_generation import GenerationRequest
+from llm_providers import get_provider
+from retry import MISSING, call_with_retry, mean_and_stdev
+from dataset_reader import iter_documents
+from prompt_templates import get_templates, render_prompts
 
+# API_KEY and OPENAI_API_KEY are read when each provider is first called
 load_dotenv()
 
-google_api_key = os.getenv('API_KEY')
-openai_api_key = os.getenv('OPENAI_API_KEY')
-
-genai.configure(api_key=google_api_key)
-google_model = genai.GenerativeModel('gemini-pro')
-openai.api_key = openai_api_key
-
-rouge_scorer = rouge_scorer.RougeScorer(['rouge1', 'rouge2', 'rougeL'], use_stemmer=True)
+rouge_scorer = RougeEngine(['rouge1', 'rouge2', 'rougeL'], use_stemmer=True)
 
 DATA_PATH = os.path.join('data', 'val.json')
 CSV_FILE_PATH = os.path.join('outputs', 'chain_of_thought.csv')
 
-with open(DATA_PATH, 'r') as f:
-    data = json.load(f)
-
 def get_first_item(value, default=''):
     if isinstance(value, list):
         return value[0] if value else default
@@ -49,51 +44,16 @@ def get_first_item(value, default=''):
         return default
 
 def create_prompts(document):
-    abstract = get_first_item(document.get("abstract", ""))
-    title = document.get('title', 'No title available')
-    year = document.get('year', 'No year available')
+    # The five 'promptwise' templates: the paper block is rendered once and follows each instruction
     keywords = document.get('keywords', ['No keywords available'])
     if not isinstance(keywords, list):
         keywords = [keywords]
-    prompts = [
-        (
-            f"**Title**: \"{title}\"\n"
-            f"**Year**: {year}\n\n"
-            f"**Abstract**:\n{abstract}\n\n"
-            f"**Keywords**: {', '.join(keywords)}\n\n"
-            "PROMPT 1\n"
-        ),
-        (
-            f"**Title**: \"{title}\"\n"
-            f"**Year**: {year}\n\n"
-            f"**Abstract**:\n{abstract}\n\n"
-            f"**Keywords**: {', '.join(keywords)}\n\n"
-            "PROMPT 2\n"
-        ),
-        (
-            f"**Title**: \"{title}\"\n"
-            f"**Year**: {year}\n\n"
-            f"**Abstract**:\n{abstract}\n\n"
-            f"**Keywords**: {', '.join(keywords)}\n\n"
-            "PROMPT 3\n"
-        ),
-        (
-            f"**Title**: \"{title}\"\n"
-            f"**Year**: {year}\n\n"
-            f"**Abstract**:\n{abstract}\n\n"
-            f"**Keywords**: {', '.join(keywords)}\n\n"
-            "PROMPT 4\n"
-
-        ),
-        (
-            f"**Title**: \"{title}\"\n"
-            f"**Year**: {year}\n\n"
-            f"**Abstract**:\n{abstract}\n\n"
-            f"**Keywords**: {', '.join(keywords)}\n\n"
-            "PROMPT 5\n"
-        )
-    ]
-    return prompts
+    return render_prompts(get_templates('promptwise'), {
+        'title': document.get('title', 'No title available'),
+        'year': document.get('year', 'No year available'),
+        'abstract': get_first_item(document.get("abstract", "")),
+        'keywords': ', '.join(keywords),
+    })
 
 def write_to_csv(results, file_path):
     os.makedirs(os.path.dirname(file_path), exist_ok=True)
@@ -109,7 +69,9 @@ def write_to_csv(results, file_path):
 
 def process_and_evaluate(data, num_repeats=2):
     results = []
-    for test_num, document in enumerate(data[:5]):
+    google = get_provider('google')
+    openai = get_provider('openai')
+    for test_num, document in enumerate(data):
         prompts = create_prompts(document)
         reference_summary = get_first_item(document.get("summary", ""))
         for prompt_num, prompt in enumerate(prompts):
@@ -118,16 +80,10 @@ def process_and_evaluate(data, num_repeats=2):
             openai_results = []
             for repeat in range(num_repeats):
                 try:
-                    responseGoogle = google_model.generate_content(f'{prompt}')
-                    summaryGoogle = responseGoogle.text
-                    responseOpenAI = openai.ChatCompletion.create(
-                        model="gpt-4o-mini",
-                        messages=[
-                            {"role": "system", "content": "You are a helpful assistant."},
-                            {"role": "user", "content": f'{prompt}'}
-                        ],
-                    )
-                    summaryOpenAI = responseOpenAI['choices'][0]['message']['content']
+                    summaryGoogle = call_with_retry(google.complete, GenerationRequest('google', 'gemini-pro', f'{prompt}'))
+                    summaryOpenAI = call_with_retry(openai.complete, GenerationRequest(
+                        'openai', "gpt-4o-mini", f'{prompt}', system_prompt="You are a helpful assistant."
+                    ))
                     rouge_google = rouge_scorer.score(summaryGoogle, reference_summary)
                     rouge_openai = rouge_scorer.score(summaryOpenAI, reference_summary)
                     google_results.append([
@@ -138,16 +94,20 @@ def process_and_evaluate(data, num_repeats=2):
                     ])
                     time.sleep(1)
                 except Exception as e:
-                    google_results.append([0]*3)
-                    openai_results.append([0]*3)
-            google_means = [mean([x[i] for x in google_results]) for i in range(3)]
-            google_stds = [stdev([x[i] for x in google_results]) if len(google_results) > 1 else 0 for i in range(3)]
-            openai_means = [mean([x[i] for x in openai_results]) for i in range(3)]
-            openai_stds = [stdev([x[i] for x in openai_results]) if len(openai_results) > 1 else 0 for i in range(3)]
+                    # Failed after retrying: recorded as missing and left out of the means
+                    google_results.append([MISSING]*3)
+                    openai_results.append([MISSING]*3)
+            google_means, google_stds = (list(column) for column in zip(*(
+                mean_and_stdev([x[i] for x in google_results]) for i in range(3))))
+            openai_means, openai_stds = (list(column) for column in zip(*(
+                mean_and_stdev([x[i] for x in openai_results]) for i in range(3))))
             results.append([hypothesis_test, prompt, 'Google Gemini'] + google_means + google_stds)
             results.append([hypothesis_test, prompt, 'OpenAI GPT'] + openai_means + openai_stds)
     return results
 
-final_results = process_and_evaluate(data)
-write_to_csv(final_results, CSV_FILE_PATH)
-print(f"Results have been written to {CSV_FILE_PATH}")
\ No newline at end of file
+if __name__ == "__main__":
+    # Only the first 5 documents are evaluated, so only those are read
+    data = list(iter_documents(DATA_PATH, num_documents=5))
+    final_results = process_and_evaluate(data)
+    write_to_csv(final_results, CSV_FILE_PATH)
+    print(f"Results have been written to {CSV_FILE_PATH}")
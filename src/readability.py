@@ -0,0 +1,157 @@
+"""
+Shared-Pass Readability Scores
+
+Calling textstat.flesch_kincaid_grade, dale_chall_readability_score and
+coleman_liau_index one after another splits the text into words, counts its
+sentences and looks up every word's syllables once per formula (textstat's own
+caches hold only 128 entries). Here a text is analysed once into its counts (words,
+sentences, letters, syllables, difficult and polysyllabic words) and every formula
+is computed from those counts:
+- fkgl, dcrs, cli: the three scores the benchmarks report
+- smog, gunning_fog: available to any script at no extra analysis cost
+
+Word splitting, sentence counting and the formulas follow textstat 0.7 (unrounded),
+and per-word syllable counts and the Dale-Chall easy-word test are textstat's own
+(CMUdict with a Pyphen fallback), memoised per distinct word. Counts are kept in an
+LRU keyed by a hash of the text, so re-scoring a summary (a cached completion reused
+across runs, or the same extract scored for several metrics) costs a lookup.
+"""
+
+import re
+import time
+import hashlib
+from collections import OrderedDict, namedtuple
+from functools import lru_cache
+from profiling import get_profiler
+
+METRICS = ('fkgl', 'dcrs', 'cli', 'smog', 'gunning_fog')
+DEFAULT_METRICS = ('fkgl', 'dcrs', 'cli')
+CACHE_SIZE = 65536
+# textstat's English syllable threshold for Gunning fog "complex" words
+FOG_SYLLABLE_THRESHOLD = 3
+
+TextCounts = namedtuple('TextCounts', [
+    'words', 'sentences', 'letters', 'syllables', 'dale_chall_difficult', 'fog_difficult', 'polysyllables'
+])
+
+_NONCONTRACTION_APOSTROPHE = re.compile(r"\'(?!(?:[tsd]|ve|ll|re))")
+_PUNCTUATION = re.compile(r"[^\w\s\']")
+_SENTENCE = re.compile(r"\b[^.!?]+[.!?]*", re.UNICODE)
+_LETTER = re.compile(r"\w")
+
+_counts = OrderedDict()
+
+
+def _words(text):
+    # textstat's list_words: drop punctuation (keeping contraction apostrophes), split on whitespace
+    return _PUNCTUATION.sub('', _NONCONTRACTION_APOSTROPHE.sub('', text)).split()
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _word_counts(word):
+    """(syllables, is Dale-Chall easy word) for a lower-cased word."""
+    import textstat
+    return textstat.syllable_count(word), not textstat.is_difficult_word(word, 0)
+
+
+def _sentence_count(text):
+    if not text:
+        return 0
+    sentences = _SENTENCE.findall(text)
+    # Fragments of two words or fewer are not counted as sentences
+    ignored = sum(1 for sentence in sentences if len(_words(sentence)) <= 2)
+    return max(1, len(sentences) - ignored)
+
+
+def analyse(text):
+    """Counts of `text` behind every readability formula, from one pass over its words."""
+    words = _words(text)
+    syllables = dale_chall_difficult = fog_difficult = polysyllables = 0
+    for word in words:
+        word_syllables, easy = _word_counts(word.lower())
+        syllables += word_syllables
+        if not easy:
+            dale_chall_difficult += 1
+            if word_syllables >= FOG_SYLLABLE_THRESHOLD:
+                fog_difficult += 1
+        if word_syllables >= 3:
+            polysyllables += 1
+    return TextCounts(len(words), _sentence_count(text), len(_LETTER.findall(text)), syllables,
+                      dale_chall_difficult, fog_difficult, polysyllables)
+
+
+def get_counts(text):
+    key = hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+    counts = _counts.get(key)
+    if counts is not None:
+        _counts.move_to_end(key)
+        return counts
+    counts = analyse(text)
+    _counts[key] = counts
+    if len(_counts) > CACHE_SIZE:
+        _counts.popitem(last=False)
+    return counts
+
+
+def clear_cache():
+    """Forget the cached counts of every text (per-word syllable counts stay cached)."""
+    _counts.clear()
+
+
+def _per(numerator, denominator):
+    return numerator / denominator if denominator else 0.0
+
+
+def fkgl(counts):
+    sentence_length = _per(counts.words, counts.sentences)
+    syllables = _per(counts.syllables, counts.words)
+    if sentence_length == 0 or syllables == 0:
+        return 0.0
+    return (0.39 * sentence_length) + (11.8 * syllables) - 15.59
+
+
+def dcrs(counts):
+    if not counts.words:
+        return 0.0
+    per_difficult_words = 100 * counts.dale_chall_difficult / counts.words
+    score = (0.1579 * per_difficult_words) + (0.0496 * _per(counts.words, counts.sentences))
+    if per_difficult_words > 5:
+        score += 3.6365
+    return score
+
+
+def cli(counts):
+    letters = _per(counts.letters, counts.words) * 100
+    sentences = _per(counts.sentences, counts.words) * 100
+    if letters == 0 or sentences == 0:
+        return 0.0
+    return (0.058 * letters) - (0.296 * sentences) - 15.8
+
+
+def smog(counts):
+    if not counts.sentences:
+        return 0.0
+    return (1.043 * (30 * (counts.polysyllables / counts.sentences)) ** 0.5) + 3.1291
+
+
+def gunning_fog(counts):
+    if not counts.words:
+        return 0.0
+    per_difficult_words = 100 * counts.fog_difficult / counts.words
+    return 0.4 * (_per(counts.words, counts.sentences) + per_difficult_words)
+
+
+FORMULAS = {'fkgl': fkgl, 'dcrs': dcrs, 'cli': cli, 'smog': smog, 'gunning_fog': gunning_fog}
+
+
+def readability(text, metrics=DEFAULT_METRICS):
+    """{metric: score} for `text`; the text is analysed once for all metrics."""
+    start = time.perf_counter()
+    counts = get_counts(text)
+    scores = {metric: FORMULAS[metric](counts) for metric in metrics}
+    get_profiler().record('readability', time.perf_counter() - start)
+    return scores
+
+
+def readability_batch(texts, metrics=DEFAULT_METRICS):
+    return [readability(text, metrics) for text in texts]
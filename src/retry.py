@@ -0,0 +1,175 @@
+"""
+Retries for Provider Calls
+
+Shared retry behaviour for every Gemini/GPT call. An error is retried when it is
+transient: a timeout or dropped connection, HTTP 408/409/429 or any 5xx status
+(openai RateLimitError/ServiceUnavailableError/APIError, google ResourceExhausted/
+ServiceUnavailable/InternalServerError/DeadlineExceeded, ...). Anything else (bad
+request, authentication, content filter) is permanent and raised at once.
+
+Waits grow exponentially with full jitter (a uniform draw up to base * 2^attempt,
+capped at RETRY_MAX_DELAY) so concurrent callers that were throttled together do
+not retry together. When the server says how long to wait (a Retry-After or
+retry-after-ms header, or a Google RetryInfo detail) that wait is honoured instead.
+
+A call that still fails is recorded by the benchmarks as MISSING (NaN), never as a
+zero score, and left out of means and standard deviations.
+
+Settings (in .env or the environment): RETRY_MAX_ATTEMPTS (default 6),
+RETRY_BASE_DELAY (default 1 s), RETRY_MAX_DELAY (default 60 s).
+"""
+
+import os
+import math
+import time
+import random
+import asyncio
+import logging
+from email.utils import parsedate_to_datetime
+from functools import wraps
+from profiling import get_profiler
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUS = frozenset({408, 409, 429, 500, 502, 503, 504})
+# Transient errors that carry no HTTP status, matched by class name so no SDK has to be imported
+TRANSIENT_ERRORS = frozenset({
+    'TimeoutError', 'Timeout', 'ReadTimeout', 'ConnectTimeout', 'ConnectionError', 'APIConnectionError',
+    'TryAgain', 'RateLimitError', 'ServiceUnavailableError', 'ResourceExhausted', 'ServiceUnavailable',
+    'InternalServerError', 'DeadlineExceeded', 'TooManyRequests', 'ServerDisconnectedError',
+    'ClientConnectionError', 'ChunkedEncodingError',
+})
+
+MISSING = float('nan')
+
+
+def is_missing(value):
+    return value is None or (isinstance(value, float) and math.isnan(value))
+
+
+def present(values):
+    """`values` without missing entries."""
+    return [value for value in values if not is_missing(value)]
+
+
+def mean_and_stdev(values):
+    """statistics.mean and stdev of the values that are present (stdev 0 for a single value, NaN for none)."""
+    values = present(values)
+    if not values:
+        return MISSING, MISSING
+    mean = math.fsum(values) / len(values)
+    if len(values) == 1:
+        return mean, 0
+    return mean, math.sqrt(math.fsum((value - mean) ** 2 for value in values) / (len(values) - 1))
+
+
+def status_code(error):
+    """HTTP status of a provider error, or None."""
+    for attribute in ('http_status', 'status_code', 'status', 'code'):
+        value = getattr(error, attribute, None)
+        if isinstance(value, int) and not isinstance(value, bool) and 100 <= value < 600:
+            return value
+    response = getattr(error, 'response', None)
+    value = getattr(response, 'status_code', None)
+    return value if isinstance(value, int) else None
+
+
+def retry_after(error):
+    """Seconds the server asked us to wait before retrying, or None."""
+    headers = getattr(error, 'headers', None) or getattr(getattr(error, 'response', None), 'headers', None)
+    if headers:
+        headers = {str(name).lower(): value for name, value in dict(headers).items()}
+        try:
+            if 'retry-after-ms' in headers:
+                return float(headers['retry-after-ms']) / 1000
+            if 'retry-after' in headers:
+                value = headers['retry-after']
+                try:
+                    return max(0.0, float(value))
+                except ValueError:
+                    return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            pass
+    for detail in getattr(error, 'details', None) or ():
+        delay = getattr(detail, 'retry_delay', None)
+        if delay is not None:
+            return delay.seconds + delay.nanos / 1e9
+    return None
+
+
+def is_retryable(error):
+    status = status_code(error)
+    if status is not None:
+        return status in RETRYABLE_STATUS
+    return (isinstance(error, (TimeoutError, ConnectionError, asyncio.TimeoutError))
+            or any(cls.__name__ in TRANSIENT_ERRORS for cls in type(error).__mro__))
+
+
+class RetryPolicy:
+    def __init__(self, max_attempts=None, base_delay=None, max_delay=None):
+        self.max_attempts = max_attempts or int(os.getenv('RETRY_MAX_ATTEMPTS', 6))
+        self.base_delay = base_delay if base_delay is not None else float(os.getenv('RETRY_BASE_DELAY', 1))
+        self.max_delay = max_delay if max_delay is not None else float(os.getenv('RETRY_MAX_DELAY', 60))
+
+    def delay(self, attempt, error):
+        """Seconds to wait after failed attempt number `attempt` (0-based)."""
+        hint = retry_after(error)
+        if hint is not None:
+            return hint + random.uniform(0, self.base_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def should_retry(self, attempt, error):
+        return attempt < self.max_attempts - 1 and is_retryable(error)
+
+
+def _log_retry(func, provider, description, attempt, policy, error, delay):
+    # Counted against `provider`, or the provider whose method func is (e.g. provider.complete)
+    get_profiler().retry('generation', provider or getattr(getattr(func, '__self__', None), 'cache_name', None))
+    logger.warning(f"{description} failed (attempt {attempt + 1}/{policy.max_attempts}): "
+                   f"{type(error).__name__}: {error}; retrying in {delay:.1f} s")
+
+
+def call_with_retry(func, *args, policy=None, description='API call', provider=None, **kwargs):
+    """func(*args, **kwargs), retried on transient errors. The last error is raised once retries run out."""
+    policy = policy or RetryPolicy()
+    attempt = 0
+    while True:
+        try:
+            return func(*args, **kwargs)
+        except Exception as e:
+            if not policy.should_retry(attempt, e):
+                logger.error(f"{description} failed after {attempt + 1} attempt(s): {type(e).__name__}: {e}")
+                raise
+            delay = policy.delay(attempt, e)
+            _log_retry(func, provider, description, attempt, policy, e, delay)
+            time.sleep(delay)
+            attempt += 1
+
+
+async def acall_with_retry(func, *args, policy=None, description='API call', provider=None, on_retry=None, **kwargs):
+    """Async call_with_retry: awaits func(*args, **kwargs). `on_retry(error, delay)` is called before each wait."""
+    policy = policy or RetryPolicy()
+    attempt = 0
+    while True:
+        try:
+            return await func(*args, **kwargs)
+        except Exception as e:
+            if not policy.should_retry(attempt, e):
+                logger.error(f"{description} failed after {attempt + 1} attempt(s): {type(e).__name__}: {e}")
+                raise
+            delay = policy.delay(attempt, e)
+            _log_retry(func, provider, description, attempt, policy, e, delay)
+            if on_retry is not None:
+                on_retry(e, delay)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+
+def retrying(policy=None, description=None):
+    """Decorator form of call_with_retry."""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            return call_with_retry(func, *args, policy=policy, description=description or func.__name__, **kwargs)
+        return wrapper
+    return decorator
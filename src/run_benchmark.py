@@ -0,0 +1,274 @@
+"""
+Unified Benchmark Runner
+
+Runs any of the experiment scripts with the dataset, document range, shard, repeats,
+providers and output directory given on the command line, instead of editing each
+script's DATA_PATH / CSV path / document count / num_repeats constants. A scheduler
+can fan one experiment out over many machines by launching the same command with a
+different --shard-index.
+
+Examples (run from the repository root):
+    python src/run_benchmark.py xero --data data/plos_val.json --num-documents 1000 --shard-index 3 --shard-count 8
+    python src/run_benchmark.py lexrank --data data/plos_val.bmds --start 200 --num-documents 50 --repeats 2
+    python src/run_benchmark.py xero --providers openai --metrics rouge,readability --num-documents all
+
+Shard i of n evaluates documents start + i, start + i + n, ... of the selected range
+and writes <experiment>.shard-<i>-of-<n>.csv, with its own log (and, for xero, its own
+checkpoint) in the output directory, so shards never share a file. Document count and
+repeats default to each script's own settings.
+
+xero and lexrank also write <experiment>[.shard-<i>-of-<n>].partial.json; merge the
+shards' partial files into one exact results CSV with partial_results.py.
+
+Every run also writes <experiment>[...].profile.json: per-stage and per-provider
+latency percentiles, throughput and documents per minute (see profiling.py).
+
+The two-stage experiments (lexrank, llm-pipeline, chunked-pipeline) store their extracts
+in <experiment>[...].extracts.jsonl; --extract-reuse repeat makes the GPT pipelines
+re-extract for every repeat instead of once per document.
+
+--batch-dir DIR (xero, lexrank, prompt-comparison) writes every uncached request to
+provider batch files in DIR instead of calling the providers; ingest the batch results
+with batch_mode.py and run the same command without --batch-dir to score them.
+
+--near-duplicates representative skips documents that are near-duplicates (versions,
+corrections, near-identical abstracts) of another document in the run's document
+range; 'flag' keeps them and logs them. The split's index is built once and saved next to it (see
+near_duplicates.py).
+"""
+
+import os
+import logging
+import argparse
+import itertools
+import importlib
+from importlib.machinery import SourceFileLoader
+from importlib.util import spec_from_loader, module_from_spec
+from dataset_reader import iter_documents
+from partial_results import write_partial
+from extract_store import EXTRACT_REUSE_POLICIES
+from batch_mode import enable_batch_mode
+from profiling import get_profiler
+from near_duplicates import MODES as NEAR_DUPLICATE_MODES, filter_documents, load_or_build
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+ALL_PROVIDERS = ('google', 'openai')
+
+
+def load_module(module_name):
+    # llm_fewshot_summarisation_benchmark.PY has an uppercase extension, so it is loaded by path
+    if module_name.endswith('.PY'):
+        name = os.path.splitext(module_name)[0]
+        loader = SourceFileLoader(name, os.path.join(SRC_DIR, module_name))
+        module = module_from_spec(spec_from_loader(name, loader))
+        loader.exec_module(module)
+        return module
+    return importlib.import_module(module_name)
+
+
+def run_xero(module, data, args, paths):
+    kwargs = {'metrics': args.metrics} if args.metrics else {}
+    results = module.process_and_evaluate(
+        data, num_repeats=args.repeats, checkpoint_path=paths['checkpoint'], providers=args.providers, **kwargs)
+    module.write_per_prompt_csv(results, paths['csv'])
+    write_partial(results, paths['partial'], args.experiment, args.shard_index, args.shard_count)
+
+
+def run_lexrank(module, data, args, paths):
+    results = module.process_and_evaluate(data, num_repeats=args.repeats, extracts_path=paths['extracts'])
+    module.write_per_prompt_csv(results, paths['csv'])
+    write_partial(results, paths['partial'], args.experiment, args.shard_index, args.shard_count)
+
+
+def run_prompt_comparison(module, data, args, paths):
+    results = module.process_and_evaluate(data, num_repeats=args.repeats, num_documents=None,
+                                          prompt_log_path=paths['prompts'])
+    module.write_to_csv(results, paths['csv'])
+
+
+def run_pipeline(module, data, args, paths):
+    module.evaluate_and_log(data, num_repeats=args.repeats, max_documents=None, csv_file_path=paths['csv'],
+                            extracts_path=paths['extracts'], extract_reuse=args.extract_reuse)
+
+
+def run_promptwise(module, data, args, paths):
+    results = module.process_and_evaluate(list(data), num_repeats=args.repeats)
+    module.write_to_csv(results, paths['csv'])
+
+
+def run_fewshot(module, data, args, paths):
+    results = module.process_and_evaluate(list(data), module.example_abstracts_summaries, num_repeats=args.repeats,
+                                          prompt_log_path=paths['prompts'])
+    module.write_to_csv(results, paths['csv'])
+
+
+def run_gemini_prompts(module, data, args, paths):
+    # Prints its comparison rather than writing a CSV
+    module.print_comparison(*module.process_and_evaluate(data, num_documents=None))
+
+
+# module: script to run; documents/repeats: the script's own defaults;
+# providers: the providers it calls; select_providers: whether it can run a subset;
+# batch: whether all of its generation is one concurrent pass that batch mode can divert
+EXPERIMENTS = {
+    'xero': {'module': 'xero_biomed_summ_benchmark', 'run': run_xero, 'documents': 50, 'repeats': 3,
+             'providers': ALL_PROVIDERS, 'select_providers': True, 'batch': True},
+    'lexrank': {'module': 'extractive_abstractive_benchmark', 'run': run_lexrank, 'documents': 2, 'repeats': 3,
+                'providers': ALL_PROVIDERS, 'select_providers': False, 'batch': True},
+    'prompt-comparison': {'module': 'summarisation_prompt_comparison', 'run': run_prompt_comparison,
+                          'documents': 20, 'repeats': 2, 'providers': ALL_PROVIDERS, 'select_providers': False,
+                          'batch': True},
+    'llm-pipeline': {'module': 'summarisation_llm_benchmark', 'run': run_pipeline, 'documents': 2, 'repeats': 3,
+                     'providers': ('openai',), 'select_providers': False},
+    'chunked-pipeline': {'module': 'extractive_abstractive_pipeline', 'run': run_pipeline, 'documents': 50,
+                         'repeats': 3, 'providers': ('openai',), 'select_providers': False},
+    'promptwise': {'module': 'promptwise_summarisation_benchmark', 'run': run_promptwise, 'documents': 5,
+                   'repeats': 2, 'providers': ALL_PROVIDERS, 'select_providers': False},
+    'fewshot': {'module': 'llm_fewshot_summarisation_benchmark.PY', 'run': run_fewshot, 'documents': 5,
+                'repeats': 3, 'providers': ALL_PROVIDERS, 'select_providers': False},
+    'gemini-prompts': {'module': 'biomed_prompt_comparison', 'run': run_gemini_prompts, 'documents': 2,
+                       'repeats': None, 'providers': ('google',), 'select_providers': False},
+}
+
+
+def document_count(value):
+    if value == 'all':
+        return value
+    count = int(value)
+    if count <= 0:
+        raise argparse.ArgumentTypeError("must be a positive integer or 'all'")
+    return count
+
+
+def provider_list(value):
+    providers = tuple(provider.strip() for provider in value.split(',') if provider.strip())
+    unknown = [provider for provider in providers if provider not in ALL_PROVIDERS]
+    if unknown or not providers:
+        raise argparse.ArgumentTypeError(f"choose from {', '.join(ALL_PROVIDERS)}")
+    return providers
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run a summarisation benchmark on a dataset shard.")
+    parser.add_argument('experiment', choices=sorted(EXPERIMENTS))
+    parser.add_argument('--data', required=True, help="JSON/JSON Lines split or .bmds store")
+    parser.add_argument('--start', type=int, default=0, help="index of the first document in the range")
+    parser.add_argument('--num-documents', type=document_count, default=None,
+                        help="size of the document range, or 'all' (default: the script's own count)")
+    parser.add_argument('--shard-index', type=int, default=0)
+    parser.add_argument('--shard-count', type=int, default=1)
+    parser.add_argument('--repeats', type=int, default=None, help="default: the script's own repeat count")
+    parser.add_argument('--providers', type=provider_list, default=None, help="comma-separated, e.g. google,openai")
+    parser.add_argument('--metrics', default=None, help="xero only: comma-separated metric groups")
+    parser.add_argument('--extract-reuse', choices=EXTRACT_REUSE_POLICIES, default=None,
+                        help="llm-pipeline/chunked-pipeline: extract once per 'document' or every 'repeat'")
+    parser.add_argument('--batch-dir', default=None,
+                        help="xero/lexrank/prompt-comparison: write uncached requests to provider batch files here "
+                             "instead of calling the providers (see batch_mode.py)")
+    parser.add_argument('--near-duplicates', choices=NEAR_DUPLICATE_MODES, default=None,
+                        help="'representative': evaluate one document per near-duplicate cluster; "
+                             "'flag': evaluate all and log duplicates (see near_duplicates.py)")
+    parser.add_argument('--near-duplicate-threshold', type=float, default=0.8,
+                        help="estimated Jaccard similarity of abstracts above which documents are duplicates")
+    parser.add_argument('--output-dir', default='outputs')
+    args = parser.parse_args(argv)
+
+    experiment = EXPERIMENTS[args.experiment]
+    if not 0 <= args.shard_index < args.shard_count:
+        parser.error(f"--shard-index must be in [0, {args.shard_count})")
+    if args.start < 0:
+        parser.error("--start must be non-negative")
+    if not os.path.isfile(args.data):
+        parser.error(f"dataset not found: {args.data}")
+    if args.providers is not None and not experiment['select_providers'] \
+            and set(args.providers) != set(experiment['providers']):
+        parser.error(f"{args.experiment} always calls {', '.join(experiment['providers'])}")
+    if args.metrics is not None:
+        if args.experiment != 'xero':
+            parser.error("--metrics is only supported by the xero experiment")
+        args.metrics = [metric.strip() for metric in args.metrics.split(',') if metric.strip()]
+    if args.extract_reuse is not None and experiment['run'] is not run_pipeline:
+        parser.error("--extract-reuse is only supported by the llm-pipeline and chunked-pipeline experiments")
+    if args.batch_dir is not None and not experiment.get('batch'):
+        parser.error("--batch-dir is only supported by the xero, lexrank and prompt-comparison experiments")
+    if experiment['repeats'] is None and args.repeats is not None:
+        parser.error(f"{args.experiment} does not repeat generations")
+    if args.repeats is None:
+        args.repeats = experiment['repeats']
+    elif args.repeats <= 0:
+        parser.error("--repeats must be positive")
+    if not 0 < args.near_duplicate_threshold <= 1:
+        parser.error("--near-duplicate-threshold must be in (0, 1]")
+    if args.num_documents is None:
+        args.num_documents = experiment['documents']
+    elif args.num_documents == 'all':
+        args.num_documents = None
+    return args
+
+
+def output_paths(args):
+    suffix = f".shard-{args.shard_index}-of-{args.shard_count}" if args.shard_count > 1 else ''
+    if args.batch_dir is not None:
+        # A submit run scores nothing, so it must not overwrite the real run's results
+        suffix += '.batch-submit'
+    stem = os.path.join(args.output_dir, f"{args.experiment}{suffix}")
+    return {
+        'csv': f"{stem}.csv",
+        'log': f"{stem}.log",
+        'prompts': f"{stem}.prompts.txt",
+        'checkpoint': f"{stem}.checkpoint.jsonl",
+        'partial': f"{stem}.partial.json",
+        'extracts': f"{stem}.extracts.jsonl",
+        'profile': f"{stem}.profile.json",
+    }
+
+
+def setup_logging(log_path):
+    formatter = logging.Formatter('%(asctime)s - %(message)s')
+    root = logging.getLogger()
+    root.setLevel(logging.INFO)
+    for handler in (logging.FileHandler(log_path), logging.StreamHandler()):
+        handler.setFormatter(formatter)
+        root.addHandler(handler)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    experiment = EXPERIMENTS[args.experiment]
+    os.makedirs(args.output_dir, exist_ok=True)
+    paths = output_paths(args)
+    setup_logging(paths['log'])
+    logging.getLogger(__name__).info(
+        f"{args.experiment}: {args.data} documents {args.start}+{args.num_documents or 'all'}, "
+        f"shard {args.shard_index + 1}/{args.shard_count}, {args.repeats} repeats")
+
+    profiler = get_profiler()
+    data = iter_documents(args.data, num_documents=args.num_documents, start=args.start,
+                          shard_index=args.shard_index, shard_count=args.shard_count)
+    if args.near_duplicates is not None:
+        # Representatives come from the whole run's range, so every shard of it picks the same ones
+        index = load_or_build(args.data, threshold=args.near_duplicate_threshold)
+        data = filter_documents(data, index, args.near_duplicates,
+                                itertools.count(args.start + args.shard_index, args.shard_count),
+                                start=args.start,
+                                stop=None if args.num_documents is None else args.start + args.num_documents)
+    data = profiler.count_documents(data)
+    batch = enable_batch_mode(args.batch_dir) if args.batch_dir is not None else None
+    module = load_module(experiment['module'])
+    profiler.reset()
+    experiment['run'](module, data, args, paths)
+    profile = profiler.write(paths['profile'])
+    logging.getLogger(__name__).info(
+        f"{profile['documents']} documents in {profile['wall_seconds']:.1f} s "
+        f"({profile['documents_per_minute'] or 0:.1f}/min); profile written to {paths['profile']}")
+    logging.shutdown()
+    if batch is not None:
+        batch.close()
+        print(f"{len(batch)} requests are in the batch files in {args.batch_dir}. Once their results are "
+              f"ingested (python src/batch_mode.py ingest ...), rerun without --batch-dir to score them.")
+    elif experiment['run'] is not run_gemini_prompts:
+        print(f"Results have been written to {paths['csv']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -8,12 +8,15 @@ This script automates a two-step biomedical summarisation pipeline:
 The script evaluates the generated summaries against reference summaries using ROUGE, readability, factuality (AlignScore, SummaC), and logs all results for reproducibility.
 
 Features:
-- Loads biomedical papers from a JSON file (see `json_file_path`).
+- Streams biomedical papers from a JSON file (see `json_file_path`).
 - Handles nested lists in input (abstract, summary, keywords).
-- Calls OpenAI GPT for extractive and abstractive steps (with error/retry logic).
+- Calls OpenAI GPT for extractive and abstractive steps (with error/retry logic). Each abstract is
+  extracted once and reused by every repeat unless EXTRACT_REUSE=repeat (see extract_store.py).
 - Evaluates output with ROUGE, FKGL, DCRS, CLI, AlignScore, SummaC.
-- Aggregates results and writes mean/std metrics to CSV.
+- Aggregates results as they are scored (metric_accumulator.py) and writes mean/std metrics to CSV.
 - Full logging to file and stderr for experiment traceability.
+- AlignScore/SummaC are only computed when selected in BENCHMARK_METRICS (comma-separated,
+  e.g. "rouge,readability"); the OpenAI client and factuality models load on first use.
 
 Requirements:
 - Environment variables (`OPENAI_API_KEY`, etc.) in a `.env` file.
@@ -23,120 +26,90 @@ Requirements:
 import sys
 import os
 import logging
-import openai
 import csv
-import json
-import numpy as np
-from rouge_score import rouge_scorer
-from bert_score import score as bert_score
-import textstat
-import time
-from requests.exceptions import ReadTimeout
-from summac.model_summac import SummaCConv
-from alignscore import AlignScore
+from rouge_engine import RougeEngine
+from readability import readability
+from factuality_engine import FactualityEngine
+from async_generation import GenerationRequest, request_cache_key
+from completion_cache import get_default_cache
+from llm_providers import get_provider, provider_cache_name
+from retry import retrying
+from metric_accumulator import MetricAccumulator
+from extract_store import ExtractStore
+from prompt_templates import get_template
+from dataset_reader import iter_documents
 from dotenv import load_dotenv
 import traceback
 
 
-# Load environment variables and API keys
+# Load environment variables; the OpenAI key is read when the first completion is requested
 load_dotenv()
-openai_api_key = os.getenv('OPENAI_API_KEY')
-openai.api_key = openai_api_key
 
-# Initialize ROUGE scorer and logging
-rouge_scorer_instance = rouge_scorer.RougeScorer(
-    ['rouge1', 'rouge2', 'rougeL'], use_stemmer=True)
+# Initialize ROUGE scorer
+rouge_scorer_instance = RougeEngine(['rouge1', 'rouge2', 'rougeL'], use_stemmer=True)
 
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.INFO)
-
-# Ensure the log directory exists
-log_directory = 'logs'
-if not os.path.exists(log_directory):
-    os.makedirs(log_directory)
 
 # Update the file paths to valid locations
+log_directory = 'logs'
 log_file_path = os.path.join(log_directory, 'summarisation_pipeline.log')
 csv_file_path = os.path.join(log_directory, 'summarisation_results.csv')
+extracts_path = os.path.join(log_directory, 'summarisation_extracts.jsonl')
 json_file_path = 'data/elife_val.json'
 
-# Logging handlers
-file_handler = logging.FileHandler(log_file_path)
-console_handler = logging.StreamHandler(sys.stderr)  # Output logs to stderr
-formatter = logging.Formatter('%(asctime)s - %(message)s')
-file_handler.setFormatter(formatter)
-console_handler.setFormatter(formatter)
-logger.addHandler(file_handler)
-logger.addHandler(console_handler)
-
 # Number of repeats per prompt
 num_repeats = 3  # You can adjust this number as needed
 
-# Initialize SummaC and AlignScore models
-summac_model = SummaCConv(
-    models=["vitc"],
-    bins='percentile',
-    granularity="sentence",
-    nli_labels="e",
-    device="cpu",
-    start_file="INSERT_FILE_PATH_HERE.bin",
-    agg="mean"
-)
-
-alignscore_model = AlignScore(
-    model='roberta-base', batch_size=16, device='cpu', ckpt_path=None, evaluation_mode='nli_sp'
-)
+# Metrics to compute; ROUGE and readability are always reported
+METRICS = os.getenv('BENCHMARK_METRICS', 'rouge,readability,alignscore,summaC').split(',')
+compute_factuality = 'alignscore' in METRICS or 'summaC' in METRICS
+SCORE_METRICS = ['rouge1', 'rouge2', 'rougeL', 'fkgl', 'dcrs', 'cli', 'alignscore', 'summaC']
+
+def setup_logging():
+    logger.setLevel(logging.INFO)
+    # Ensure the log directory exists
+    os.makedirs(log_directory, exist_ok=True)
+    file_handler = logging.FileHandler(log_file_path)
+    console_handler = logging.StreamHandler(sys.stderr)  # Output logs to stderr
+    formatter = logging.Formatter('%(asctime)s - %(message)s')
+    file_handler.setFormatter(formatter)
+    console_handler.setFormatter(formatter)
+    logger.addHandler(file_handler)
+    logger.addHandler(console_handler)
+
+# Shared SummaC and AlignScore engine; pairs are queued per repeat and scored in batches.
+# Only created when factuality is selected; nothing is loaded until the first flush with queued pairs.
+factuality = FactualityEngine(summac_start_file="INSERT_FILE_PATH_HERE.bin", device='cpu', batch_size=16) \
+    if compute_factuality else None
 
 # Function to calculate readability metrics
 def calculate_readability(text):
-    fkgl = textstat.flesch_kincaid_grade(text)
-    dcrs = textstat.dale_chall_readability_score(text)
-    cli = textstat.coleman_liau_index(text)
-    return fkgl, dcrs, cli
+    # One shared analysis of the text for all three formulas
+    scores = readability(text, ('fkgl', 'dcrs', 'cli'))
+    return scores['fkgl'], scores['dcrs'], scores['cli']
 
-# Function to calculate AlignScore
-def calculate_align_score(summary, reference):
+# Function to queue AlignScore and SummaC for a summary; scores reach `accumulator` in factuality.flush()
+def queue_factuality_scores(summary, reference, accumulator):
     # Ensure summary and reference are strings
     if not isinstance(summary, str):
         summary = " ".join(flatten_list(summary))
     if not isinstance(reference, str):
         reference = " ".join(flatten_list(reference))
-    return np.mean(alignscore_model.score(contexts=[reference], claims=[summary]))
-
-# Function to calculate SummaC score
-def calculate_summac_score(summary, reference):
-    # Ensure summary and reference are strings
-    if not isinstance(summary, str):
-        summary = " ".join(flatten_list(summary))
-    if not isinstance(reference, str):
-        reference = " ".join(flatten_list(reference))
-    return np.mean(summac_model.score([reference], [summary])['scores'])
-
-# Retry decorator for API calls
-def retry_api_call(max_retries=3, delay=5):
-    def decorator(func):
-        def wrapper(*args, **kwargs):
-            for attempt in range(max_retries):
-                try:
-                    return func(*args, **kwargs)
-                except (ReadTimeout, openai.error.Timeout) as e:
-                    if attempt < max_retries - 1:
-                        logger.warning(f"API call failed (attempt {attempt + 1}/{max_retries}), retrying after {delay} seconds...")
-                        time.sleep(delay)
-                    else:
-                        logger.error("API call failed after all retries.")
-                        raise
-        return wrapper
-    return decorator
-
-@retry_api_call()
-def openai_chat_completion(model_name, prompt):
-    response = openai.ChatCompletion.create(
-        model=model_name,
-        messages=[{"role": "user", "content": prompt}],
-        timeout=60
-    )
-    return response['choices'][0]['message']['content']
+    factuality.add('alignscore', reference, summary, accumulator.sink('All', 'GPT', 'alignscore'), None)
+    factuality.add('summaC', reference, summary, accumulator.sink('All', 'GPT', 'summaC'), None)
+
+# Retried with backoff on timeouts, rate limits and server errors (see retry.py)
+@retrying(description='OpenAI call')
+def _openai_chat_completion_uncached(request):
+    # Times out after LLM_TIMEOUT seconds (default 60)
+    return get_provider('openai').complete(request)
+
+def openai_chat_completion(model_name, prompt, repeat=0):
+    # Replayed from the on-disk completion cache when this exact call was made before
+    request = GenerationRequest('openai', model_name, prompt, repeat=repeat)
+    return get_default_cache().get_or_call(
+        request_cache_key(request), lambda: _openai_chat_completion_uncached(request),
+        provider=provider_cache_name('openai'), model=model_name, repeat=repeat)
 
 # Function to flatten nested lists
 def flatten_list(lst):
@@ -152,32 +125,17 @@ def flatten_list(lst):
     return flat_list
 
 # Extract key sentences with AI model
-def extract_key_sentences(abstract_text):
+def extract_key_sentences(abstract_text, repeat=0):
     model_name = "gpt-4o-mini"  # Update to the model you are using
-    extractive_prompt = (
-        "Extract the key sentences from the following research abstract that highlight "
-        "the main objectives, methods, and findings. Ensure that all critical technical details are included.\n\n"
-        f"{abstract_text}\n\n"
-        "Return only the most important sentences as an extract."
-    )
-    extracted_text = openai_chat_completion(model_name, extractive_prompt)
+    # Instruction first, abstract last, so the instruction is a prefix shared by every request
+    extractive_prompt = get_template('gpt-extract').render({'abstract': abstract_text})
+    extracted_text = openai_chat_completion(model_name, extractive_prompt, repeat=repeat)
     logger.info(f"Extractive Summary: {extracted_text}")
     return extracted_text
 
-def abstractive_summarization(extracted_text, keywords):
+def abstractive_summarization(extracted_text, keywords, repeat=0):
     model_name = "gpt-4o-mini"  # Update to the model you are using
 
-    few_shot_examples = (
-        "Example Abstract 1:\n"
-
-        "Example Summary 1:\n"
-
-        "Example Abstract 2:\n"
-
-        "Example Summary 2:\n"
-
-    )
-
     # Flatten and join keywords
     if isinstance(keywords, list):
         keywords = flatten_list(keywords)
@@ -185,14 +143,10 @@ def abstractive_summarization(extracted_text, keywords):
         keywords = [keywords]
     keyword_string = ", ".join(keywords)
 
-    abstractive_prompt = (
-        f"{few_shot_examples}"
-        "Compose an accessible summary of the following key points, avoiding technical jargon and explaining any necessary terms in simple language. "
-        f"Ensure that the summary includes the following keywords: {keyword_string}.\n\n"
-        f"{extracted_text}\n\n"
-        "The paragraph summary should be concise and engaging."
-    )
-    summary_text = openai_chat_completion(model_name, abstractive_prompt)
+    # Few-shot examples and instructions first; this document's keywords and key points last
+    abstractive_prompt = get_template('gpt-abstract').render(
+        {'keywords': keyword_string, 'extracted_text': extracted_text})
+    summary_text = openai_chat_completion(model_name, abstractive_prompt, repeat=repeat)
     
     # Log the abstractive summary
     logger.info(f"Abstractive Summary: {summary_text}")
@@ -209,12 +163,13 @@ def abstractive_summarization(extracted_text, keywords):
     return summary_text
 
 # Function to load data from JSON file
+# Streams documents from the JSON file; evaluate_and_log stops reading after max_documents
 def load_data_from_json(json_file_path):
-    with open(json_file_path, 'r') as file:
-        data = json.load(file)
-    return data
+    return iter_documents(json_file_path)
 
-def evaluate_and_log(data):
+def evaluate_and_log(data, num_repeats=num_repeats, max_documents=2, csv_file_path=csv_file_path,
+                     extracts_path=extracts_path, extract_reuse=None):
+    extracts = ExtractStore(extracts_path, reuse=extract_reuse)
     per_prompt_metrics = {
         'prompt_text': "Extract and summarize abstracts",
         'papers_tested': 0,
@@ -222,20 +177,12 @@ def evaluate_and_log(data):
         'models': {}
     }
     
-    # Initialize main metric lists
-    rouge1_all_scores = []
-    rouge2_all_scores = []
-    rougeL_all_scores = []
-    fkgl_all_scores = []
-    dcrs_all_scores = []
-    cli_all_scores = []
-    align_all_scores = []
-    summac_all_scores = []
-    max_documents = 2
+    # Running mean/std of every metric over all documents and repeats
+    accumulator = MetricAccumulator(SCORE_METRICS)
     processed_docs = 0
 
     for i, document in enumerate(data):
-        if processed_docs >= max_documents:
+        if max_documents is not None and processed_docs >= max_documents:
             break
 
         try:
@@ -261,20 +208,17 @@ def evaluate_and_log(data):
             per_prompt_metrics['papers_tested'] += 1
             processed_docs += 1
 
-            # Initialize per-document metric lists
-            rouge1_scores = []
-            rouge2_scores = []
-            rougeL_scores = []
-            fkgl_scores = []
-            dcrs_scores = []
-            cli_scores = []
-            align_scores = []
-            summac_scores = []
-
             for repeat in range(num_repeats):
                 logger.info(f"Repeat {repeat+1}/{num_repeats} for document {i+1}")
-                extracted_sentences = extract_key_sentences(abstract)
-                summary = abstractive_summarization(extracted_sentences, keywords)
+                try:
+                    extracted_sentences = extracts.get_or_extract(
+                        'gpt-4o-mini', abstract, repeat, lambda extract_repeat: extract_key_sentences(abstract, repeat=extract_repeat))
+                    summary = abstractive_summarization(extracted_sentences, keywords, repeat=repeat)
+                except Exception as e:
+                    # Calls that fail after retrying are recorded as missing; the other repeats still count
+                    logger.error(f"Generation failed for document {i+1}, repeat {repeat+1}: {e}")
+                    accumulator.add_missing('All', 'GPT')
+                    continue
 
                 # Log the abstractive summary
                 logger.info(f"Abstractive Summary: {summary}")
@@ -292,69 +236,43 @@ def evaluate_and_log(data):
                 rouge_scores_abstractive = rouge_scorer_instance.score(reference_summary, summary)
                 logger.info(f"ROUGE between Reference Summary and Abstractive Summary:")
                 logger.info(f"ROUGE-1: {rouge_scores_abstractive['rouge1'].fmeasure}, ROUGE-2: {rouge_scores_abstractive['rouge2'].fmeasure}, ROUGE-L: {rouge_scores_abstractive['rougeL'].fmeasure}")
-                rouge1_scores.append(rouge_scores_abstractive['rouge1'].fmeasure)
-                rouge2_scores.append(rouge_scores_abstractive['rouge2'].fmeasure)
-                rougeL_scores.append(rouge_scores_abstractive['rougeL'].fmeasure)
-
                 fkgl, dcrs, cli = calculate_readability(summary)
-                fkgl_scores.append(fkgl)
-                dcrs_scores.append(dcrs)
-                cli_scores.append(cli)
-
-                align_score = calculate_align_score(summary, reference_summary)
-                align_scores.append(align_score)
-
-                summac_score = calculate_summac_score(summary, reference_summary)
-                summac_scores.append(summac_score)
-
-            # After processing all repeats for the document, extend the main lists
-            rouge1_all_scores.extend(rouge1_scores)
-            rouge2_all_scores.extend(rouge2_scores)
-            rougeL_all_scores.extend(rougeL_scores)
-            fkgl_all_scores.extend(fkgl_scores)
-            dcrs_all_scores.extend(dcrs_scores)
-            cli_all_scores.extend(cli_scores)
-            align_all_scores.extend(align_scores)
-            summac_all_scores.extend(summac_scores)
+                accumulator.add_many('All', 'GPT', {
+                    'rouge1': rouge_scores_abstractive['rouge1'].fmeasure,
+                    'rouge2': rouge_scores_abstractive['rouge2'].fmeasure,
+                    'rougeL': rouge_scores_abstractive['rougeL'].fmeasure,
+                    'fkgl': fkgl, 'dcrs': dcrs, 'cli': cli,
+                })
+
+                if compute_factuality:
+                    queue_factuality_scores(summary, reference_summary, accumulator)
 
         except Exception as e:
             logger.error(f"Error processing document {i+1}: {e}")
             traceback.print_exc()
             continue
 
-    # Function to filter out invalid values
-    def filter_valid_values(values_list):
-        return [x for x in values_list if x is not None and not np.isnan(x)]
-
-    # Apply filtering before calculating mean and std
-    rouge1_valid_scores = filter_valid_values(rouge1_all_scores)
-    rouge2_valid_scores = filter_valid_values(rouge2_all_scores)
-    rougeL_valid_scores = filter_valid_values(rougeL_all_scores)
-    fkgl_valid_scores = filter_valid_values(fkgl_all_scores)
-    dcrs_valid_scores = filter_valid_values(dcrs_all_scores)
-    cli_valid_scores = filter_valid_values(cli_all_scores)
-    align_valid_scores = filter_valid_values(align_all_scores)
-    summac_valid_scores = filter_valid_values(summac_all_scores)
-
-    # Calculate the mean and std for all documents processed
-    rouge1_mean = np.mean(rouge1_valid_scores) if rouge1_valid_scores else 0
-    rouge1_std = np.std(rouge1_valid_scores) if rouge1_valid_scores else 0
-    rouge2_mean = np.mean(rouge2_valid_scores) if rouge2_valid_scores else 0
-    rouge2_std = np.std(rouge2_valid_scores) if rouge2_valid_scores else 0
-    rougeL_mean = np.mean(rougeL_valid_scores) if rougeL_valid_scores else 0
-    rougeL_std = np.std(rougeL_valid_scores) if rougeL_valid_scores else 0
-
-    fkgl_mean = np.mean(fkgl_valid_scores) if fkgl_valid_scores else 0
-    fkgl_std = np.std(fkgl_valid_scores) if fkgl_valid_scores else 0
-    dcrs_mean = np.mean(dcrs_valid_scores) if dcrs_valid_scores else 0
-    dcrs_std = np.std(dcrs_valid_scores) if dcrs_valid_scores else 0
-    cli_mean = np.mean(cli_valid_scores) if cli_valid_scores else 0
-    cli_std = np.std(cli_valid_scores) if cli_valid_scores else 0
-
-    align_mean = np.mean(align_valid_scores) if align_valid_scores else 0
-    align_std = np.std(align_valid_scores) if align_valid_scores else 0
-    summac_mean = np.mean(summac_valid_scores) if summac_valid_scores else 0
-    summac_std = np.std(summac_valid_scores) if summac_valid_scores else 0
+    # Score all queued AlignScore/SummaC pairs in batches; the scores go straight to the accumulator
+    if factuality is not None:
+        factuality.flush()
+
+    # Mean and (population) std over all documents processed; missing scores are left out
+    def mean_and_std(metric):
+        return accumulator.mean('All', 'GPT', metric), accumulator.std('All', 'GPT', metric)
+
+    rouge1_mean, rouge1_std = mean_and_std('rouge1')
+    rouge2_mean, rouge2_std = mean_and_std('rouge2')
+    rougeL_mean, rougeL_std = mean_and_std('rougeL')
+    fkgl_mean, fkgl_std = mean_and_std('fkgl')
+    dcrs_mean, dcrs_std = mean_and_std('dcrs')
+    cli_mean, cli_std = mean_and_std('cli')
+    align_mean, align_std = mean_and_std('alignscore')
+    summac_mean, summac_std = mean_and_std('summaC')
+    # Leave metrics that were not selected blank rather than reporting them as 0
+    if 'alignscore' not in METRICS:
+        align_mean = align_std = None
+    if 'summaC' not in METRICS:
+        summac_mean = summac_std = None
 
     # Store final results in a list for CSV output
     result = {
@@ -397,9 +315,11 @@ def evaluate_and_log(data):
         writer.writeheader()
         writer.writerow(result)
 
+    extracts.close()
     print(f"Results written to {csv_file_path}")
     logging.shutdown()
 
 if __name__ == "__main__":
+    setup_logging()
     data = load_data_from_json(json_file_path)
     evaluate_and_log(data)
@@ -3,70 +3,44 @@ Biomedical Paper Summarisation — Prompt Comparison Pipeline
 
 Compares Google Gemini and OpenAI GPT model summaries using a variety of prompt templates on biomedical abstracts.
 Calculates ROUGE, BERTScore, readability, and (optionally) factuality metrics. All results are written to CSV.
+Scores are aggregated per prompt and model as they arrive (metric_accumulator.py).
 Set your API keys in a .env file and configure file paths before running.
 """
 from dotenv import load_dotenv
 import os
 import csv
-import openai
-import google.generativeai as genai
-from statistics import mean, stdev
-import time
-import json
-from rouge_score import rouge_scorer
-from bert_score import score as bert_score
-import textstat
-import numpy as np
-
-# Optional: Import these only if available
-try:
-    from alignscore import AlignScore
-    from summac.model_summac import SummaCConv
-    HAS_FACTUALITY_MODELS = True
-except ImportError:
-    HAS_FACTUALITY_MODELS = False
+from itertools import islice
+from rouge_engine import RougeEngine
+from bertscore_batch import DeferredBertScore
+from async_generation import GenerationRequest, generate_all
+from dataset_reader import iter_documents
+from readability import readability
+from metric_accumulator import MetricAccumulator
+from batch_mode import BatchPending
+
+# Optional: factuality metrics are only scored if alignscore and summac are installed
+from factuality_engine import FactualityEngine, HAS_FACTUALITY_MODELS
 
 # Load environment variables from .env
+# Set API_KEY (Gemini) and OPENAI_API_KEY in .env; llm_providers configures each provider on first use
 load_dotenv()
 
-# Get API keys from environment variables
-google_api_key = os.getenv('API_KEY')          # Set your Gemini API Key in .env
-openai_api_key = os.getenv('OPENAI_API_KEY')   # Set your OpenAI API Key in .env
-
-if not google_api_key or not openai_api_key:
-    raise ValueError("API_KEY and OPENAI_API_KEY must be set in your .env file.")
-
-# Configure Gemini and OpenAI
-genai.configure(api_key=google_api_key)
-google_model = genai.GenerativeModel('gemini-pro')
-openai.api_key = openai_api_key
-
 # ROUGE scorer
-rouge_scorer = rouge_scorer.RougeScorer(['rouge1', 'rouge2', 'rougeL'], use_stemmer=True)
-
-# Optional: Initialise factuality models if available
-if HAS_FACTUALITY_MODELS:
-    summac_model = SummaCConv(
-        models=["vitc"],
-        bins='percentile',
-        granularity="sentence",
-        nli_labels="e",
-        device="cpu",
-        start_file="PATH/TO/summac_conv_vitc_sent_perc_e.bin",  
-        agg="mean"
-    )
-    alignscore_model = AlignScore(
-        model='roberta-base', batch_size=16, device='cpu', ckpt_path=None, evaluation_mode='nli_sp'
-    )
+rouge_scorer = RougeEngine(['rouge1', 'rouge2', 'rougeL'], use_stemmer=True)
+
+SUMMAC_START_FILE = "PATH/TO/summac_conv_vitc_sent_perc_e.bin"
 
 DATA_PATH = os.path.join('data', 'val.json')
 PROMPT_LOG_PATH = os.path.join('logs', 'prompt_log.csv')
 CSV_FILE_PATH = os.path.join('outputs', 'chain_of_thought_results.csv')
+# Column order of the means and standard deviations in each result row
+METRIC_NAMES = ['rouge1', 'rouge2', 'rougeL', 'bertscore', 'fkgl', 'dcrs', 'cli', 'alignscore', 'summaC']
+MODEL_NAMES = ['Google Gemini', 'OpenAI GPT']
 
 # Utility to log prompts and responses
-def log_prompt(hypothesis_test, prompt, model, generated_summary):
+def log_prompt(hypothesis_test, prompt, model, generated_summary, log_path=PROMPT_LOG_PATH):
     try:
-        with open(PROMPT_LOG_PATH, 'a', newline='', encoding='utf-8') as csvfile:
+        with open(log_path, 'a', newline='', encoding='utf-8') as csvfile:
             writer = csv.writer(csvfile)
             writer.writerow([hypothesis_test, prompt, model, generated_summary])
     except Exception as e:
@@ -99,75 +73,93 @@ def write_to_csv(results, file_path):
         print(f"Error writing to CSV: {e}")
 
 def calculate_readability(summary):
-    fkgl = textstat.flesch_kincaid_grade(summary)
-    dcrs = textstat.dale_chall_readability_score(summary)
-    cli = textstat.coleman_liau_index(summary)
-    return fkgl, dcrs, cli
+    # One shared analysis of the text for all three formulas
+    scores = readability(summary, ('fkgl', 'dcrs', 'cli'))
+    return scores['fkgl'], scores['dcrs'], scores['cli']
 
-def process_and_evaluate(data, num_repeats=2):
+def process_and_evaluate(data, num_repeats=2, num_documents=20, prompt_log_path=PROMPT_LOG_PATH):
     results = []
-    for test_num, document in enumerate(data[:20]):
+    data = list(islice(data, num_documents))
+    accumulator = MetricAccumulator(METRIC_NAMES)
+    pending = []
+    bertscore_queue = DeferredBertScore(lang="en", device='cpu')
+    factuality = FactualityEngine(summac_start_file=SUMMAC_START_FILE) if HAS_FACTUALITY_MODELS else None
+    # Send every document, prompt and repeat concurrently, within provider quotas
+    requests = []
+    for document in data:
+        for prompt in create_prompts(document):
+            for repeat in range(num_repeats):
+                requests.append(GenerationRequest('google', 'gemini-pro', f'{prompt}', repeat=repeat))
+                requests.append(GenerationRequest(
+                    'openai', 'gpt-4o-mini', f'{prompt}', system_prompt="You are a helpful assistant.", repeat=repeat))
+    completions = iter(generate_all(requests))
+    # Repeats whose completions went to provider batch files (batch mode); scored by a later run
+    batch_queued = 0
+
+    for test_num, document in enumerate(data):
         prompts = create_prompts(document)
         reference_summary = ensure_string(document.get("summary", ""))
         for prompt_num, prompt in enumerate(prompts):
             hypothesis_test = f"Hypothesis Test {test_num + 1} - Prompt {prompt_num + 1}"
-            google_results, openai_results = [], []
             for repeat in range(num_repeats):
+                responseGoogle, responseOpenAI = next(completions), next(completions)
+                if isinstance(responseGoogle, BatchPending) or isinstance(responseOpenAI, BatchPending):
+                    batch_queued += 1
+                    continue
                 try:
                     # Google Gemini generation
-                    responseGoogle = google_model.generate_content(f'{prompt}')
-                    summaryGoogle = ensure_string(getattr(responseGoogle, 'text', 'Blocked Response'))
-                    log_prompt(hypothesis_test, prompt, 'Google Gemini', summaryGoogle)
+                    if isinstance(responseGoogle, Exception):
+                        raise responseGoogle
+                    summaryGoogle = ensure_string(responseGoogle)
+                    log_prompt(hypothesis_test, prompt, 'Google Gemini', summaryGoogle, prompt_log_path)
                     # OpenAI GPT generation
-                    responseOpenAI = openai.ChatCompletion.create(
-                        model="gpt-4o-mini",
-                        messages=[{"role": "system", "content": "You are a helpful assistant."},
-                                  {"role": "user", "content": f'{prompt}'}]
-                    )
-                    summaryOpenAI = ensure_string(responseOpenAI['choices'][0]['message']['content'])
-                    log_prompt(hypothesis_test, prompt, 'OpenAI GPT', summaryOpenAI)
+                    if isinstance(responseOpenAI, Exception):
+                        raise responseOpenAI
+                    summaryOpenAI = ensure_string(responseOpenAI)
+                    log_prompt(hypothesis_test, prompt, 'OpenAI GPT', summaryOpenAI, prompt_log_path)
                     # ROUGE
                     rouge_google = rouge_scorer.score(summaryGoogle, reference_summary)
                     rouge_openai = rouge_scorer.score(summaryOpenAI, reference_summary)
-                    # BERTScore
-                    _, _, F_google = bert_score([summaryGoogle], [reference_summary], lang="en", device='cpu')
-                    _, _, F_openai = bert_score([summaryOpenAI], [reference_summary], lang="en", device='cpu')
                     # Readability
                     fkgl_google, dcrs_google, cli_google = calculate_readability(summaryGoogle)
                     fkgl_openai, dcrs_openai, cli_openai = calculate_readability(summaryOpenAI)
-                    # Factuality (if available)
-                    alignscore_google = alignscore_openai = 0
-                    summaC_google = summaC_openai = 0
-                    if HAS_FACTUALITY_MODELS:
-                        abstract_text = ensure_string(document.get("abstract", ""))
-                        alignscore_google = np.mean(alignscore_model.score(
-                            contexts=[abstract_text], claims=[summaryGoogle]))
-                        alignscore_openai = np.mean(alignscore_model.score(
-                            contexts=[abstract_text], claims=[summaryOpenAI]))
-                        summaC_google = np.mean(summac_model.score(
-                            [abstract_text], [summaryGoogle])['scores'])
-                        summaC_openai = np.mean(summac_model.score(
-                            [abstract_text], [summaryOpenAI])['scores'])
-                    # Collect results
-                    google_results.append([
-                        rouge_google['rouge1'].fmeasure, rouge_google['rouge2'].fmeasure, rouge_google['rougeL'].fmeasure,
-                        F_google.mean().item(), fkgl_google, dcrs_google, cli_google, alignscore_google, summaC_google
-                    ])
-                    openai_results.append([
-                        rouge_openai['rouge1'].fmeasure, rouge_openai['rouge2'].fmeasure, rouge_openai['rougeL'].fmeasure,
-                        F_openai.mean().item(), fkgl_openai, dcrs_openai, cli_openai, alignscore_openai, summaC_openai
-                    ])
-                    time.sleep(3)  # API rate limit buffer
+                    # BERTScore and factuality reach the accumulator when their batched passes are flushed
+                    abstract_text = ensure_string(document.get("abstract", ""))
+                    for model_name, summary, rouge, (fkgl, dcrs, cli) in (
+                            ('Google Gemini', summaryGoogle, rouge_google, (fkgl_google, dcrs_google, cli_google)),
+                            ('OpenAI GPT', summaryOpenAI, rouge_openai, (fkgl_openai, dcrs_openai, cli_openai))):
+                        accumulator.add_many(hypothesis_test, model_name, {
+                            'rouge1': rouge['rouge1'].fmeasure, 'rouge2': rouge['rouge2'].fmeasure,
+                            'rougeL': rouge['rougeL'].fmeasure, 'fkgl': fkgl, 'dcrs': dcrs, 'cli': cli,
+                        })
+                        bertscore_queue.add(summary, reference_summary,
+                                            accumulator.sink(hypothesis_test, model_name, 'bertscore'), None)
+                        # Factuality (if available; reported as 0 otherwise)
+                        for metric_name in ('alignscore', 'summaC'):
+                            if factuality is not None:
+                                factuality.add(metric_name, abstract_text, summary,
+                                               accumulator.sink(hypothesis_test, model_name, metric_name), None)
+                            else:
+                                accumulator.add(hypothesis_test, model_name, metric_name, 0)
                 except Exception as e:
                     print(f"Error: {e}")
-                    google_results.append([0]*9)
-                    openai_results.append([0]*9)
-            google_means = [mean([x[i] for x in google_results]) for i in range(9)]
-            google_stds = [stdev([x[i] for x in google_results]) if len(google_results) > 1 else 0 for i in range(9)]
-            openai_means = [mean([x[i] for x in openai_results]) for i in range(9)]
-            openai_stds = [stdev([x[i] for x in openai_results]) if len(openai_results) > 1 else 0 for i in range(9)]
-            results.append([hypothesis_test, prompt, 'Google Gemini'] + google_means + google_stds)
-            results.append([hypothesis_test, prompt, 'OpenAI GPT'] + openai_means + openai_stds)
+                    # Failed after retrying: recorded as missing and left out of the means
+                    for model_name in MODEL_NAMES:
+                        accumulator.add_missing(hypothesis_test, model_name)
+            pending.append((hypothesis_test, prompt))
+
+    if batch_queued:
+        print(f"{batch_queued} repeats are waiting for their batch results and were not scored")
+    bertscore_queue.flush()
+    if factuality is not None:
+        factuality.flush()
+
+    for hypothesis_test, prompt in pending:
+        for model_name in MODEL_NAMES:
+            # Sample standard deviation (statistics.stdev; 0 for a single repeat)
+            means = [accumulator.mean(hypothesis_test, model_name, name) for name in METRIC_NAMES]
+            stds = [accumulator.std(hypothesis_test, model_name, name, ddof=1) for name in METRIC_NAMES]
+            results.append([hypothesis_test, prompt, model_name] + means + stds)
     return results
 
 # Entrypoint for running the script
@@ -176,8 +168,8 @@ if __name__ == "__main__":
     if not os.path.isfile(DATA_PATH):
         raise FileNotFoundError(f"Dataset not found at {DATA_PATH}. Please update DATA_PATH.")
 
-    with open(DATA_PATH, 'r', encoding='utf-8') as f:
-        data = json.load(f)
+    # Stream the JSON dataset; only the documents that are evaluated are read
+    data = iter_documents(DATA_PATH, num_documents=20)
 
     final_results = process_and_evaluate(data)
     write_to_csv(final_results, CSV_FILE_PATH)
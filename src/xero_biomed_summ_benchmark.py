@@ -4,24 +4,33 @@ LLM Biomedical Summarisation Multi-Metric Benchmark
 Runs Google Gemini and OpenAI GPT on biomedical abstract summarisation, evaluating outputs
 with ROUGE, BERTScore, readability (FKGL, DCRS, CLI), AlignScore, and SummaC.
 Aggregates and logs results per prompt and model, storing all results in CSV for easy analysis.
+Each scored repeat is checkpointed as it completes, so an interrupted run resumes where it stopped.
+Scores are aggregated as they arrive (metric_accumulator.py) rather than kept per repeat, and the
+running means are logged at every scoring flush.
+
+ROUGE, readability and SummaC are scored in a pool of worker processes (SCORING_WORKERS,
+default: all cores). Model backends and provider clients are only loaded once a run needs them. Choose the
+metrics with BENCHMARK_METRICS (comma-separated groups from METRIC_GROUPS, e.g.
+"rouge,readability"); groups that are not selected never load their models.
 
 Safe for public repositories (no sensitive data paths, no API key logging).
 """
 
 import os
 import csv
+import math
 import logging
-import openai
-import google.generativeai as genai
-import time
-import json
+from itertools import islice
 from dotenv import load_dotenv
-from rouge_score import rouge_scorer
-from bert_score import score as bert_score
-import textstat
-import numpy as np
-from alignscore import AlignScore
-from summac.model_summac import SummaCConv
+from async_generation import GenerationRequest, generate_all
+from dataset_reader import iter_documents
+from checkpoint import RunCheckpoint
+from bertscore_batch import DeferredBertScore
+from parallel_scoring import ParallelScorer, METRICS as PARALLEL_METRICS
+from factuality_engine import FactualityEngine
+from batch_mode import BatchPending
+from metric_accumulator import MetricAccumulator
+from prompt_templates import SANITIZED_ABSTRACT, get_templates, render_prompts
 
 # === 1. Setup ===
 
@@ -30,47 +39,57 @@ DATA_PATH = 'data/plos_val.json'
 OUTPUT_DIR = 'outputs'
 CSV_FILE_PATH = os.path.join(OUTPUT_DIR, 'xero_biomed_summ_benchmark.csv')
 LOG_FILE_PATH = os.path.join(OUTPUT_DIR, 'xero_biomed_summ_benchmark.log')
+# Per-repeat results; delete this file to restart the experiment from scratch
+CHECKPOINT_PATH = os.path.join(OUTPUT_DIR, 'xero_biomed_summ_benchmark.checkpoint.jsonl')
 
-os.makedirs(OUTPUT_DIR, exist_ok=True)
-if not os.path.isfile(DATA_PATH):
-    raise FileNotFoundError(f"Dataset not found: {DATA_PATH}")
-
-# Logging
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.INFO)
-file_handler = logging.FileHandler(LOG_FILE_PATH)
-console_handler = logging.StreamHandler()
-formatter = logging.Formatter('%(asctime)s - %(message)s')
-file_handler.setFormatter(formatter)
-console_handler.setFormatter(formatter)
-logger.addHandler(file_handler)
-logger.addHandler(console_handler)
-
-# API keys
+
+# API keys are read by llm_providers when a provider is first called
 load_dotenv()
-google_api_key = os.getenv('API_KEY')
-openai_api_key = os.getenv('OPENAI_API_KEY')
-if not google_api_key or not openai_api_key:
-    raise RuntimeError("API keys must be set in your .env file.")
-
-genai.configure(api_key=google_api_key)
-google_model = genai.GenerativeModel('gemini-pro')
-openai.api_key = openai_api_key
-
-# Metrics models
-rouge = rouge_scorer.RougeScorer(['rouge1', 'rouge2', 'rougeL'], use_stemmer=True)
-summac_model = SummaCConv(
-    models=["vitc"],
-    bins='percentile',
-    granularity="sentence",
-    nli_labels="e",
-    device="cpu",
-    start_file="src/summac/summac_conv_vitc_sent_perc_e.bin",  # Relative path for repo
-    agg="mean"
-)
-alignscore_model = AlignScore(
-    model='roberta-base', batch_size=16, device='cpu', ckpt_path=None, evaluation_mode='nli_sp'
-)
+
+SUMMAC_START_FILE = "src/summac/summac_conv_vitc_sent_perc_e.bin"  # Relative path for repo
+
+# Generation settings per model; `providers` in process_and_evaluate selects a subset
+MODELS = {
+    'Google Gemini': {'provider': 'google', 'model': 'gemini-pro'},
+    'OpenAI GPT': {'provider': 'openai', 'model': 'gpt-4o-mini', 'system_prompt': "You are a helpful assistant.",
+                   'max_tokens': 1000, 'temperature': 0.3},
+}
+MODEL_NAMES = list(MODELS)
+METRIC_NAMES = ['rouge1', 'rouge2', 'rougeL', 'bertscore', 'fkgl', 'dcrs', 'cli', 'alignscore', 'summaC']
+# Selectable metric groups and the metrics each one produces
+METRIC_GROUPS = {
+    'rouge': ['rouge1', 'rouge2', 'rougeL'],
+    'bertscore': ['bertscore'],
+    'readability': ['fkgl', 'dcrs', 'cli'],
+    'alignscore': ['alignscore'],
+    'summaC': ['summaC'],
+}
+DEFAULT_METRICS = os.getenv('BENCHMARK_METRICS', ','.join(METRIC_GROUPS)).split(',')
+
+
+def setup_run():
+    """Create the output directory, attach the log handlers and check the dataset exists."""
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    if not os.path.isfile(DATA_PATH):
+        raise FileNotFoundError(f"Dataset not found: {DATA_PATH}")
+
+    logger.setLevel(logging.INFO)
+    file_handler = logging.FileHandler(LOG_FILE_PATH)
+    console_handler = logging.StreamHandler()
+    formatter = logging.Formatter('%(asctime)s - %(message)s')
+    file_handler.setFormatter(formatter)
+    console_handler.setFormatter(formatter)
+    logger.addHandler(file_handler)
+    logger.addHandler(console_handler)
+
+
+def selected_metric_names(metrics):
+    unknown = [group for group in metrics if group not in METRIC_GROUPS]
+    if unknown or not metrics:
+        raise ValueError(f"Unknown metric group(s) {unknown}; choose from {list(METRIC_GROUPS)}")
+    return [name for name in METRIC_NAMES if any(name in METRIC_GROUPS[group] for group in metrics)]
+
 
 # === 2. Utilities ===
 
@@ -82,34 +101,17 @@ def concatenate_items(value, default=''):
     return default
 
 def create_prompts(document):
-    abstract = concatenate_items(document.get("abstract", ""))
-    title = document.get('title', 'No title available')
-    year = document.get('year', 'No year available')
-
-    prompt_intro_1 = (
-        "Compose a detailed Plain-Language Summary (PLS) of the following biomedical research paper to promote Knowledge Translation (KT) and make the findings accessible to a non-expert audience.\n\n"
-    )
-    prompt_intro_2 = (
-        "Create an informative and accessible Plain-Language Summary (PLS) for the following biomedical research paper, aimed at enhancing Knowledge Translation (KT) and making the content understandable to individuals without a scientific background.\n\n"
-    )
-    full_prompts = [
-        prompt_intro_1 + f"**Title**: \"{title}\"\n**Year**: {year}\n\n**Abstract**:\n{abstract}\n\n",
-        prompt_intro_2 + f"**Title**: \"{title}\"\n**Year**: {year}\n\n**Abstract**:\n{abstract}\n\n"
-    ]
-    sanitized_abstract = "[Abstract text not shown]"
-    sanitized_prompts = [
-        prompt_intro_1 + f"**Title**: \"{title}\"\n**Year**: {year}\n\n**Abstract**:\n{sanitized_abstract}\n\n",
-        prompt_intro_2 + f"**Title**: \"{title}\"\n**Year**: {year}\n\n**Abstract**:\n{sanitized_abstract}\n\n"
-    ]
-    generalized_prompts = [prompt_intro_1, prompt_intro_2]
-    return list(zip(full_prompts, sanitized_prompts, generalized_prompts))
-
-def calculate_readability(summary):
-    return (
-        textstat.flesch_kincaid_grade(summary),
-        textstat.dale_chall_readability_score(summary),
-        textstat.coleman_liau_index(summary)
-    )
+    """(full prompt, sanitised prompt for the log, instruction text for the CSV) per template of the 'xero' set."""
+    values = {
+        'title': document.get('title', 'No title available'),
+        'year': document.get('year', 'No year available'),
+        'abstract': concatenate_items(document.get("abstract", "")),
+    }
+    templates = get_templates('xero')
+    full_prompts = render_prompts(templates, values)
+    sanitized_prompts = render_prompts(templates, dict(values, abstract=SANITIZED_ABSTRACT))
+    return [(full_prompt, sanitized_prompt, template.prefix)
+            for full_prompt, sanitized_prompt, template in zip(full_prompts, sanitized_prompts, templates)]
 
 def write_per_prompt_csv(per_prompt_metrics, file_path):
     with open(file_path, 'w', newline='') as csvfile:
@@ -140,34 +142,88 @@ def write_per_prompt_csv(per_prompt_metrics, file_path):
                     'Papers Tested': papers_tested,
                     'Repeats': repeats,
                     'Model': model_name,
-                    'ROUGE-1 Mean': avg['rouge1'],
-                    'ROUGE-1 Std': std['rouge1'],
-                    'ROUGE-2 Mean': avg['rouge2'],
-                    'ROUGE-2 Std': std['rouge2'],
-                    'ROUGE-L Mean': avg['rougeL'],
-                    'ROUGE-L Std': std['rougeL'],
-                    'BERTScore Mean': avg['bertscore'],
-                    'BERTScore Std': std['bertscore'],
-                    'FKGL Mean': avg['fkgl'],
-                    'FKGL Std': std['fkgl'],
-                    'DCRS Mean': avg['dcrs'],
-                    'DCRS Std': std['dcrs'],
-                    'CLI Mean': avg['cli'],
-                    'CLI Std': std['cli'],
-                    'AlignScore Mean': avg['alignscore'],
-                    'AlignScore Std': std['alignscore'],
-                    'SummaC Mean': avg['summaC'],
-                    'SummaC Std': std['summaC'],
+                    'ROUGE-1 Mean': avg.get('rouge1'),
+                    'ROUGE-1 Std': std.get('rouge1'),
+                    'ROUGE-2 Mean': avg.get('rouge2'),
+                    'ROUGE-2 Std': std.get('rouge2'),
+                    'ROUGE-L Mean': avg.get('rougeL'),
+                    'ROUGE-L Std': std.get('rougeL'),
+                    'BERTScore Mean': avg.get('bertscore'),
+                    'BERTScore Std': std.get('bertscore'),
+                    'FKGL Mean': avg.get('fkgl'),
+                    'FKGL Std': std.get('fkgl'),
+                    'DCRS Mean': avg.get('dcrs'),
+                    'DCRS Std': std.get('dcrs'),
+                    'CLI Mean': avg.get('cli'),
+                    'CLI Std': std.get('cli'),
+                    'AlignScore Mean': avg.get('alignscore'),
+                    'AlignScore Std': std.get('alignscore'),
+                    'SummaC Mean': avg.get('summaC'),
+                    'SummaC Std': std.get('summaC'),
                 }
                 writer.writerow(row)
 
 # === 3. Main Processing ===
 
-def process_and_evaluate(data, num_repeats=3, num_documents=None):
+def process_and_evaluate(data, num_repeats=3, num_documents=None, checkpoint_path=CHECKPOINT_PATH, flush_every=10,
+                         metrics=DEFAULT_METRICS, scoring_workers=None, providers=None):
     per_prompt_metrics = {}
-    if num_documents is not None:
-        data = data[:num_documents]
+    metric_names = selected_metric_names(metrics)
+    model_names = [name for name in MODEL_NAMES if providers is None or MODELS[name]['provider'] in providers]
+    if not model_names:
+        raise ValueError(f"No models for providers {providers}")
+    # Batched scorers are only created for selected metrics; their models load on the first flush.
+    # ROUGE, readability and SummaC go to the worker pool; BERTScore and AlignScore batch in-process.
+    parallel_metrics = [name for name in metric_names if name in PARALLEL_METRICS]
+    scorer = ParallelScorer(parallel_metrics, max_workers=scoring_workers, summac_start_file=SUMMAC_START_FILE) if parallel_metrics else None
+    bertscore_queue = DeferredBertScore(lang="en", device='cpu') if 'bertscore' in metric_names else None
+    factuality_metrics = [name for name in ('alignscore',) if name in metric_names]
+    factuality = FactualityEngine(summac_start_file=SUMMAC_START_FILE, device='cpu', batch_size=16) if factuality_metrics else None
+    checkpoint = RunCheckpoint(checkpoint_path)
+    accumulator = MetricAccumulator(metric_names)
+    # Repeats whose batched metrics are still queued; checkpointed and aggregated once the queues are flushed
+    pending = []
+    # Repeats whose completions went to provider batch files (batch mode); scored by a later run
+    batch_queued = 0
+    # Accepts a list or a streaming reader; only the first num_documents records are read
+    data = list(islice(data, num_documents))
+
+    def flush_pending():
+        if scorer is not None:
+            scorer.flush()
+        if bertscore_queue is not None:
+            bertscore_queue.flush()
+        if factuality is not None:
+            factuality.flush()
+        for doc_id, prompt_num, model_name, repeat, cells in pending:
+            scores = {metric_name: cell[0] for metric_name, cell in cells.items()}
+            if not all(value is not None and math.isfinite(value) for value in scores.values()):
+                # Scoring failed (MISSING): treated like a failed repeat and left out of the checkpoint for a retry
+                logger.error(f"Scoring failed for document {doc_id}, prompt {prompt_num}, {model_name}, "
+                             f"repeat {repeat + 1}; not checkpointed")
+                accumulator.add_missing(prompt_num, model_name)
+                continue
+            checkpoint.record(doc_id, prompt_num, model_name, repeat, scores)
+            accumulator.add_many(prompt_num, model_name, scores)
+        if pending:
+            accumulator.log_snapshot(metric_names[:3], logger)
+        pending.clear()
+
+    # --- Model Calls: every document, prompt and repeat is sent concurrently, within provider quotas ---
+    # Repeats already in the checkpoint are not regenerated.
+    requests = []
     for test_num, document in enumerate(data):
+        doc_id = document.get('id', test_num)
+        for prompt_num, (full_prompt, _, _) in enumerate(create_prompts(document), start=1):
+            for repeat in range(num_repeats):
+                if checkpoint.has_all(doc_id, prompt_num, model_names, repeat, metric_names):
+                    continue
+                for model_name in model_names:
+                    requests.append(GenerationRequest(prompt=full_prompt, repeat=repeat, **MODELS[model_name]))
+    completions = iter(generate_all(requests))
+
+    for test_num, document in enumerate(data):
+        doc_id = document.get('id', test_num)
         prompts = create_prompts(document)
         reference_summary = concatenate_items(document.get("summary", ""))
         logger.info(f"Processing document {test_num + 1}")
@@ -180,102 +236,72 @@ def process_and_evaluate(data, num_repeats=3, num_documents=None):
                     'prompt_text': generalized_prompt,
                     'papers_tested': 0,
                     'repeats': num_repeats,
-                    'models': {
-                        'Google Gemini': { 'metrics': {k: [] for k in [
-                            'rouge1','rouge2','rougeL','bertscore','fkgl','dcrs','cli','alignscore','summaC']}},
-                        'OpenAI GPT': { 'metrics': {k: [] for k in [
-                            'rouge1','rouge2','rougeL','bertscore','fkgl','dcrs','cli','alignscore','summaC']}},
-                    }
+                    'models': {model_name: {} for model_name in model_names}
                 }
             per_prompt_metrics[prompt_num]['papers_tested'] += 1
             for repeat in range(num_repeats):
+                if checkpoint.has_all(doc_id, prompt_num, model_names, repeat, metric_names):
+                    # Rebuild the aggregates from the checkpointed result
+                    for model_name in model_names:
+                        recorded = checkpoint.get(doc_id, prompt_num, model_name, repeat)
+                        accumulator.add_many(prompt_num, model_name,
+                                             {metric_name: recorded[metric_name] for metric_name in metric_names})
+                    continue
+                summaries = {model_name: next(completions) for model_name in model_names}
+                if any(isinstance(summary, BatchPending) for summary in summaries.values()):
+                    batch_queued += 1
+                    continue
                 try:
-                    # --- Model Calls ---
-                    responseGoogle = google_model.generate_content(full_prompt)
-                    summaryGoogle = responseGoogle.text
-                    logger.info(f"Google summary {repeat + 1}: {summaryGoogle[:180]}...")
-
-                    responseOpenAI = openai.ChatCompletion.create(
-                        model="gpt-4o-mini",
-                        messages=[
-                            {"role": "system", "content": "You are a helpful assistant."},
-                            {"role": "user", "content": full_prompt}
-                        ],
-                        max_tokens=1000,
-                        temperature=0.3
-                    )
-                    summaryOpenAI = responseOpenAI['choices'][0]['message']['content']
-                    logger.info(f"OpenAI summary {repeat + 1}: {summaryOpenAI[:180]}...")
-
-                    # --- Metrics ---
-                    rouge_google = rouge.score(reference_summary, summaryGoogle)
-                    rouge_openai = rouge.score(reference_summary, summaryOpenAI)
-                    P_google, R_google, F_google = bert_score(
-                        [summaryGoogle], [reference_summary], lang="en", device='cpu')
-                    P_openai, R_openai, F_openai = bert_score(
-                        [summaryOpenAI], [reference_summary], lang="en", device='cpu')
-                    fkgl_google, dcrs_google, cli_google = calculate_readability(summaryGoogle)
-                    fkgl_openai, dcrs_openai, cli_openai = calculate_readability(summaryOpenAI)
+                    for model_name, summary in summaries.items():
+                        if isinstance(summary, Exception):
+                            raise summary
+                        logger.info(f"{model_name} summary {repeat + 1}: {summary[:180]}...")
+
+                    # --- Metrics: one cell per metric, filled in when the scoring queues are flushed ---
                     abstract_text = concatenate_items(document.get("abstract", ""))
-                    alignscore_google = float(np.mean(alignscore_model.score(
-                        contexts=[abstract_text], claims=[summaryGoogle])))
-                    alignscore_openai = float(np.mean(alignscore_model.score(
-                        contexts=[abstract_text], claims=[summaryOpenAI])))
-                    summaC_google = float(np.mean(summac_model.score(
-                        [abstract_text], [summaryGoogle])['scores']))
-                    summaC_openai = float(np.mean(summac_model.score(
-                        [abstract_text], [summaryOpenAI])['scores']))
-
-                    metrics_google = {
-                        'rouge1': rouge_google['rouge1'].fmeasure,
-                        'rouge2': rouge_google['rouge2'].fmeasure,
-                        'rougeL': rouge_google['rougeL'].fmeasure,
-                        'bertscore': F_google.mean().item(),
-                        'fkgl': fkgl_google,
-                        'dcrs': dcrs_google,
-                        'cli': cli_google,
-                        'alignscore': alignscore_google,
-                        'summaC': summaC_google
-                    }
-                    metrics_openai = {
-                        'rouge1': rouge_openai['rouge1'].fmeasure,
-                        'rouge2': rouge_openai['rouge2'].fmeasure,
-                        'rougeL': rouge_openai['rougeL'].fmeasure,
-                        'bertscore': F_openai.mean().item(),
-                        'fkgl': fkgl_openai,
-                        'dcrs': dcrs_openai,
-                        'cli': cli_openai,
-                        'alignscore': alignscore_openai,
-                        'summaC': summaC_openai
-                    }
-                    for metric_name, value in metrics_google.items():
-                        per_prompt_metrics[prompt_num]['models']['Google Gemini']['metrics'][metric_name].append(value)
-                    for metric_name, value in metrics_openai.items():
-                        per_prompt_metrics[prompt_num]['models']['OpenAI GPT']['metrics'][metric_name].append(value)
-                    time.sleep(1)  # Be API friendly
+                    for model_name, summary in summaries.items():
+                        cells = {metric_name: [None] for metric_name in metric_names}
+                        if scorer is not None:
+                            scorer.add(reference_summary, summary, abstract_text, cells, 0)
+                        if bertscore_queue is not None:
+                            bertscore_queue.add(summary, reference_summary, cells['bertscore'], 0)
+                        for metric_name in factuality_metrics:
+                            factuality.add(metric_name, abstract_text, summary, cells[metric_name], 0)
+                        pending.append((doc_id, prompt_num, model_name, repeat, cells))
 
                 except Exception as e:
                     logger.error(f"Error on document {test_num + 1}, prompt {prompt_num}, repeat {repeat + 1}: {e}")
-                    for metric_name in per_prompt_metrics[prompt_num]['models']['Google Gemini']['metrics']:
-                        per_prompt_metrics[prompt_num]['models']['Google Gemini']['metrics'][metric_name].append(0)
-                        per_prompt_metrics[prompt_num]['models']['OpenAI GPT']['metrics'][metric_name].append(0)
+                    for model_name in model_names:
+                        accumulator.add_missing(prompt_num, model_name)
+
+        # Score the batched metrics every few documents so finished results reach the checkpoint
+        if (test_num + 1) % flush_every == 0:
+            flush_pending()
+
+    flush_pending()
+    checkpoint.close()
+    if batch_queued:
+        logger.info(f"{batch_queued} repeats are waiting for their batch results and were not scored")
+    if scorer is not None:
+        scorer.close()
 
     for prompt_num, prompt_data in per_prompt_metrics.items():
-        for model_name in ['Google Gemini', 'OpenAI GPT']:
-            metrics = prompt_data['models'][model_name]['metrics']
-            average_metrics = {metric_name: np.mean(values) for metric_name, values in metrics.items()}
-            std_metrics = {metric_name: np.std(values) for metric_name, values in metrics.items()}
-            prompt_data['models'][model_name]['average_metrics'] = average_metrics
-            prompt_data['models'][model_name]['std_metrics'] = std_metrics
+        for model_name in model_names:
+            # Repeats that failed after retrying are missing and left out; std is np.std's (population)
+            prompt_data['models'][model_name] = {
+                'metric_states': {name: accumulator.state(prompt_num, model_name, name) for name in metric_names},
+                'average_metrics': {name: accumulator.mean(prompt_num, model_name, name) for name in metric_names},
+                'std_metrics': {name: accumulator.std(prompt_num, model_name, name) for name in metric_names},
+            }
 
     return per_prompt_metrics
 
 # === 4. Run Experiment ===
 
 if __name__ == "__main__":
-    with open(DATA_PATH, 'r') as f:
-        data = json.load(f)
+    setup_run()
     num_documents_to_process = 50
+    data = iter_documents(DATA_PATH, num_documents=num_documents_to_process)
     per_prompt_metrics = process_and_evaluate(data, num_repeats=3, num_documents=num_documents_to_process)
     write_per_prompt_csv(per_prompt_metrics, CSV_FILE_PATH)
     logging.shutdown()